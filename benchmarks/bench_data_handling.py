@@ -0,0 +1,161 @@
+"""
+Micro-benchmark of standardize_quotes and concatenate_quotes on synthetic quotes,
+against the previous cell by cell implementation.
+
+Run from the root of the repository:
+    python benchmarks/bench_data_handling.py --events 10000 --sites 7
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "bet_arbitrages"))
+
+from data_handling import standardize_quotes, concatenate_quotes
+from team_index import TeamIndex
+
+COL_LOCATORS = [2, 3, 4, 5, 6]
+
+
+def make_quotes(n_events, n_sites, seed=0):
+    """
+    Build the raw quotes of n_events on n_sites and the matching keys table.
+    Each website spells the team names its own way and misses some events.
+    """
+    rng = random.Random(seed)
+    sites = [f"site{i}" for i in range(n_sites)]
+    teams = [f"team {i}" for i in range(2 * n_events)]
+    df_keys = pd.DataFrame(
+        {site: [f"{team} {site[-1]}" for team in teams] for site in sites}
+    )
+    dict_quotes = {}
+    for site in sites:
+        li = []
+        for event in range(n_events):
+            if rng.random() < 0.1:
+                continue
+            row = ["Demain", "21:00"]
+            if rng.random() < 0.02:
+                row.insert(0, "EN DIRECT")
+            row += [df_keys[site][2 * event], df_keys[site][2 * event + 1]]
+            row += [f"{rng.uniform(1.1, 8):.2f}" for _ in range(3)]
+            li.append(row)
+        dict_quotes[site] = li
+    return dict_quotes, {site: COL_LOCATORS for site in sites}, df_keys
+
+
+def applymap(df, func):
+    """DataFrame.applymap was renamed DataFrame.map in recent pandas"""
+    return df.map(func) if hasattr(df, "map") else df.applymap(func)
+
+
+def legacy_standardize_quotes(dict_quotes, col_locators):
+    """
+    standardize_quotes before the vectorization. It kept the quotes as text and
+    did not read the start nor the live state of the events.
+    """
+    dict_quotes_sc = {}
+    for name, li in dict_quotes.items():
+        if len(li) == 0:
+            continue
+        cols = [f"{name}_{i}" for i in ["home", "away", "1", "X", "2"]]
+        df = pd.DataFrame([[j for j in i if j != "EN DIRECT"] for i in li])
+        df_temp = df.iloc[:, col_locators[name]].copy()
+        df_temp.columns = cols
+        del_row = df_temp[applymap(df_temp, lambda x: x is None).sum(axis=1) > 0].index
+        df_temp.drop(index=del_row, inplace=True)
+        dict_quotes_sc[name] = df_temp
+    return dict_quotes_sc
+
+
+def legacy_concatenate_quotes(dict_quotes_sc, df_keys):
+    """concatenate_quotes before the vectorization"""
+    for index, (name, df) in enumerate(dict_quotes_sc.items()):
+        if index == 0:
+            df_allquotes = df.copy()
+            ref = name
+            continue
+        df_temp = df.merge(
+            df_keys[[name, ref]].dropna(),
+            left_on=[name + "_home"],
+            right_on=name,
+            how="left",
+        )
+        df_temp.drop(columns=name, inplace=True)
+        df_temp = df_temp.merge(
+            df_keys[[name, ref]].dropna(),
+            left_on=[name + "_away"],
+            right_on=name,
+            suffixes=["_home", "_away"],
+            how="left",
+        )
+        df_temp.drop(columns=[name, name + "_home", name + "_away"], inplace=True)
+        df_allquotes = df_allquotes.merge(df_temp, how="outer")
+    df_allquotes = applymap(df_allquotes, lambda x: np.nan if x is None else x)
+    col_win = [i for i in df_allquotes.columns if "_1" in i]
+    col_drawn = [i for i in df_allquotes.columns if "_X" in i]
+    col_loose = [i for i in df_allquotes.columns if "_2" in i]
+    df_allquotes["margin"] = (
+        1 / np.nanmax(df_allquotes[col_win].astype(float), axis=1)
+        + 1 / np.nanmax(df_allquotes[col_drawn].astype(float), axis=1)
+        + 1 / np.nanmax(df_allquotes[col_loose].astype(float), axis=1)
+    )
+    return df_allquotes
+
+
+def best_of(func, repeat, *args):
+    """Return the result and the best time of `repeat` calls"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the data handling")
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--sites", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    dict_quotes, col_locators, df_keys = make_quotes(args.events, args.sites)
+    n_rows = sum(len(i) for i in dict_quotes.values())
+    print(f"{n_rows} rows - {args.events} events on {args.sites} websites")
+
+    std_old, t_std_old = best_of(
+        legacy_standardize_quotes, args.repeat, dict_quotes, col_locators
+    )
+    std_new, t_std_new = best_of(
+        standardize_quotes, args.repeat, dict_quotes, col_locators
+    )
+    all_old, t_all_old = best_of(
+        legacy_concatenate_quotes, args.repeat, std_old, df_keys
+    )
+    team_index, t_index = best_of(TeamIndex, 1, df_keys)
+    all_new, t_all_new = best_of(concatenate_quotes, args.repeat, std_new, team_index)
+
+    # The events are now keyed by team ids, compare the margins by team names
+    ref = next(iter(std_old))
+    margin_old = all_old.set_index([f"{ref}_home", f"{ref}_away"])["margin"]
+    margin_new = all_new.set_index(["home", "away"])["margin"]
+    pd.testing.assert_series_equal(
+        margin_old.sort_index(), margin_new.sort_index(), check_names=False
+    )
+    print(f"TeamIndex built once in {t_index * 1000:.1f} ms")
+    print(f"{'stage':<20}{'legacy (ms)':>12}{'new (ms)':>12}{'speed-up':>10}")
+    for stage, t_old, t_new in [
+        ("standardize_quotes", t_std_old, t_std_new),
+        ("concatenate_quotes", t_all_old, t_all_new),
+    ]:
+        print(
+            f"{stage:<20}{t_old * 1000:>12.1f}{t_new * 1000:>12.1f}{t_old / t_new:>10.1f}"
+        )
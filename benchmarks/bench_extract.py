@@ -0,0 +1,78 @@
+"""
+Benchmark of get_quotes on the saved bookmaker pages: one script call per page
+(bulk) against one WebDriver call per element.
+
+Run from the root of the repository:
+    python benchmarks/bench_extract.py --repeat 20
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "bet_arbitrages"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from selenium import webdriver
+
+from driver_init import set_chrome_properties
+from driver_extract import get_quotes
+from fixtures_server import serve_fixtures, fixture_urls
+from sites import get_adapter
+
+PATH_CONFIG = ROOT / "config.json"
+PATH_CHROME_DRIVER = (
+    "chromedriver.exe" if os.name == "nt" else "/usr/local/bin/chromedriver"
+)
+
+
+def time_get_quotes(driver, url, css_selector, bulk, repeat):
+    """Return the quotes and the median time of get_quotes over `repeat` calls"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        quotes = get_quotes(driver, url, css_selector, max_wait=5, bulk=bulk)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return quotes, timings[len(timings) // 2]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DOM extraction")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--chromedriver", default=PATH_CHROME_DRIVER)
+    args = parser.parse_args()
+
+    with open(PATH_CONFIG) as f:
+        config = json.load(f)
+
+    server, base_url = serve_fixtures()
+    driver = webdriver.Chrome(
+        args.chromedriver, options=set_chrome_properties(headless=True)
+    )
+    try:
+        print(
+            f"{'site':<12}{'rows':>6}{'element (ms)':>15}{'bulk (ms)':>12}{'speed-up':>10}"
+        )
+        for name, url in fixture_urls(base_url).items():
+            driver.get(url)
+            css_selector = get_adapter(name, config).css_selector
+            quotes_el, t_el = time_get_quotes(
+                driver, url, css_selector, False, args.repeat
+            )
+            quotes_bulk, t_bulk = time_get_quotes(
+                driver, url, css_selector, True, args.repeat
+            )
+            if quotes_el != quotes_bulk:
+                print(f"{name}: bulk and per element extraction differ")
+            print(
+                f"{name:<12}{len(quotes_bulk):>6}{t_el * 1000:>15.1f}"
+                f"{t_bulk * 1000:>12.1f}{t_el / t_bulk:>10.1f}"
+            )
+    finally:
+        driver.quit()
+        server.shutdown()
@@ -0,0 +1,62 @@
+"""
+Fetch the Kambi websites from a local stand-in of the offering API serving the
+recorded payloads of benchmarks/fixtures/kambi, and check the rows go through
+standardize_quotes like the ones read in the browser.
+
+Run from the root of the repository:
+    python benchmarks/bench_kambi.py --repeat 50
+"""
+
+import argparse
+import copy
+import json
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "bet_arbitrages"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from kambi import KambiFetcher
+from data_handling import standardize_quotes
+from fixtures_server import serve_fixtures, FIXTURES_DIR
+from sites import get_adapters
+
+PATH_CONFIG = ROOT / "config.json"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Kambi fetcher")
+    parser.add_argument("--competition", default="ligue1")
+    parser.add_argument("--sites", nargs="+", default=["scoore"])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(PATH_CONFIG) as f:
+        config = json.load(f)
+
+    server, base_url = serve_fixtures(FIXTURES_DIR / "kambi")
+    config = copy.deepcopy(config)
+    config["KAMBI"]["base_url"] = base_url
+    fetcher = KambiFetcher(config)
+    try:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            dict_quotes = fetcher.fetch(args.competition, args.sites)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        col_locators = {
+            i: j.col_locators for i, j in get_adapters(dict_quotes, config).items()
+        }
+        dict_quotes_std = standardize_quotes(dict_quotes, col_locators)
+        for site, df in dict_quotes_std.items():
+            print(f"{site}: {df.shape[0]} events")
+            print(df.head().to_string())
+        print(
+            f"fetch of {len(args.sites)} sites - median {timings[len(timings) // 2] * 1000:.1f} ms"
+            f" - max {max(timings) * 1000:.1f} ms"
+        )
+    finally:
+        fetcher.close()
+        server.shutdown()
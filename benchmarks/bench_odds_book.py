@@ -0,0 +1,129 @@
+"""
+Throughput of the OddsBook on synthetic price ticks: one tick at a time with
+update, in batches of one bookmaker with update_many, against computing the best
+prices and the margins of every event again with arbitrage_kernel. The best
+prices and margins of the book are checked against the kernel at the end.
+
+Run from the root of the repository:
+    python benchmarks/bench_odds_book.py --ticks 2000000 --events 10000 --sites 7
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "bet_arbitrages"))
+
+from arbitrage import arbitrage_kernel
+from odds_book import OddsBook
+
+MARKETS = {"1X2": ["1", "X", "2"], "over_under_2.5": ["O2.5", "U2.5"]}
+
+
+def make_ticks(n_ticks, n_events, n_sites, seed=0):
+    """
+    Random (event, bookmaker, outcome, price) ticks around the fair probabilities
+    of each event with a bookmaker margin of 2 to 8%, 1% of withdrawn prices.
+    """
+    rng = np.random.default_rng(seed)
+    # Fair probabilities of the outcomes of each market
+    probabilities = np.concatenate(
+        [rng.dirichlet(np.full(len(i), 4.0), n_events) for i in MARKETS.values()],
+        axis=1,
+    )
+    events = rng.integers(0, n_events, n_ticks)
+    sites = rng.integers(0, n_sites, n_ticks)
+    outcomes = rng.integers(0, probabilities.shape[1], n_ticks)
+    overround = rng.uniform(1.02, 1.08, n_ticks)
+    # Each bookmaker has its own view of the event
+    noise = np.exp(rng.normal(0, 0.015, n_ticks))
+    prices = np.round(1 / (probabilities[events, outcomes] * overround * noise), 2)
+    prices[rng.random(n_ticks) < 0.01] = np.nan
+    return events, sites, outcomes, prices
+
+
+def run_ticks(book, keys, names, outcomes, ticks):
+    update = book.update
+    for event, site, outcome, price in zip(*[i.tolist() for i in ticks]):
+        update(keys[event], names[site], outcomes[outcome], price)
+
+
+def run_batches(book, keys, names, outcomes, ticks, batch):
+    events, sites, columns, prices = ticks
+    for start in range(0, len(events), batch):
+        stop = start + batch
+        # A batch is the page of one bookmaker: one price per event
+        site = names[sites[start]]
+        batch_keys = [keys[i] for i in events[start:stop].tolist()]
+        outcome = outcomes[columns[start]]
+        book.update_many(site, batch_keys, prices[start:stop, None], [outcome])
+
+
+def check(book):
+    """Compare the best prices and margins of the book with arbitrage_kernel"""
+    rows = list(book.events.values())
+    prices = book.prices[rows, : len(book.bookmakers)]
+    for market, sl in enumerate(book.market_slices):
+        best, _, margin, _ = arbitrage_kernel(prices[:, :, sl])
+        np.testing.assert_allclose(best, book.best[rows, sl])
+        np.testing.assert_allclose(margin, book.margins[rows, market])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the odds book")
+    parser.add_argument("--ticks", type=int, default=2000000)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--sites", type=int, default=7)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    keys = [("bench", i, i + 1) for i in range(args.events)]
+    names = [f"site{i}" for i in range(args.sites)]
+    outcomes = [i for market in MARKETS.values() for i in market]
+    ticks = make_ticks(args.ticks, args.events, args.sites)
+    print(f"{args.ticks} ticks - {args.events} events on {args.sites} websites")
+
+    book = OddsBook(MARKETS)
+    start = time.perf_counter()
+    run_ticks(book, keys, names, outcomes, ticks)
+    t_ticks = time.perf_counter() - start
+    check(book)
+
+    batch_book = OddsBook(MARKETS)
+    start = time.perf_counter()
+    run_batches(batch_book, keys, names, outcomes, ticks, args.batch)
+    t_batches = time.perf_counter() - start
+    check(batch_book)
+
+    # The full recomputation a sweep does, for one set of prices
+    rows = list(book.events.values())
+    cube = book.prices[rows, : len(book.bookmakers)]
+    start = time.perf_counter()
+    for sl in book.market_slices:
+        arbitrage_kernel(cube[:, :, sl])
+    t_full = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(100000):
+        book.best_surebet()
+    t_lookup = (time.perf_counter() - start) / 100000
+
+    print(f"{'stage':<28}{'time (s)':>10}{'prices/s':>14}")
+    print(f"{'update':<28}{t_ticks:>10.2f}{args.ticks / t_ticks:>14,.0f}")
+    print(
+        f"{f'update_many (batch {args.batch})':<28}{t_batches:>10.2f}"
+        f"{args.ticks / t_batches:>14,.0f}"
+    )
+    print(
+        f"{'full arbitrage_kernel':<28}{t_full:>10.4f}"
+        f"{cube.shape[0] * cube.shape[1] * cube.shape[2] / t_full:>14,.0f}"
+    )
+    print(f"best_surebet: {t_lookup * 1e6:.2f} us - {len(book.surebets)} arbitrages")
+    print(
+        f"one tick costs {t_ticks / args.ticks * 1e6:.2f} us against "
+        f"{t_full * 1e3:.1f} ms to compute every event again"
+    )
@@ -0,0 +1,102 @@
+"""
+Micro-benchmark of the row parsers on the row texts recorded from the fixtures,
+against the previous positional standardization. The recorded rows include the
+layouts which used to shift the cells: "Boosted" labels, an extra time, live
+labels and rows without quotes.
+
+Run from the root of the repository:
+    python benchmarks/bench_row_parser.py --copies 500
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "bet_arbitrages"))
+
+from data_handling import parse_odds, standardize_quotes
+from row_parser import QUARANTINE, split_row
+from sites import get_adapters
+
+ROWS_PATH = ROOT / "benchmarks" / "fixtures" / "rows.json"
+# Date of the recording of the rows
+RECORDED = datetime(2023, 10, 20, 10)
+
+
+def legacy_standardize_quotes(dict_quotes, col_locators):
+    """standardize_quotes before the row parsers: cells at fixed positions"""
+    dict_quotes_sc = {}
+    for name, li in dict_quotes.items():
+        cols = [f"{name}_{i}" for i in ["home", "away", "1", "X", "2"]]
+        li = [[j for j in i if j != "EN DIRECT"] for i in li]
+        df = pd.DataFrame(li)
+        try:
+            df_temp = df.iloc[:, col_locators[name]].copy()
+            df_temp.columns = cols
+        # The whole website is lost
+        except IndexError:
+            df_temp = pd.DataFrame(columns=cols)
+        df_temp = df_temp[df_temp.notna().all(axis=1)]
+        df_odds = parse_odds(df_temp[cols[2:]])
+        df_temp = pd.concat([df_temp[cols[:2]], df_odds], axis=1)
+        dict_quotes_sc[name] = df_temp[df_odds.notna().all(axis=1)]
+    return dict_quotes_sc
+
+
+def best_of(func, repeat, *args):
+    """Return the result and the best time of `repeat` calls"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the row parsers")
+    parser.add_argument(
+        "--copies", type=int, default=500, help="copies of the recorded rows"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(ROOT / "config.json") as f:
+        config = json.load(f)
+    with open(ROWS_PATH) as f:
+        recorded = json.load(f)
+    col_locators = {
+        i: j.col_locators for i, j in get_adapters(recorded, config).items()
+    }
+    dict_quotes = {
+        site: [split_row(text) for text in texts] * args.copies
+        for site, texts in recorded.items()
+    }
+    n_rows = sum(len(i) for i in dict_quotes.values())
+    print(f"{n_rows} rows - {args.copies} copies of the rows of {len(recorded)} sites")
+
+    std_old, t_old = best_of(
+        legacy_standardize_quotes, args.repeat, dict_quotes, col_locators
+    )
+    std_new, t_new = best_of(
+        standardize_quotes, args.repeat, dict_quotes, col_locators, RECORDED
+    )
+    n_quarantined = len(QUARANTINE.rows)
+    QUARANTINE.rows.clear()
+
+    print(f"{'site':<12}{'rows':>8}{'legacy':>8}{'parsed':>8}")
+    for site, li in dict_quotes.items():
+        print(
+            f"{site:<12}{len(li):>8}{std_old[site].shape[0]:>8}"
+            f"{std_new[site].shape[0]:>8}"
+        )
+    print(f"{n_quarantined} rows quarantined (bounded to {QUARANTINE.rows.maxlen})")
+    print(f"{'':<12}{'time (ms)':>12}{'rows/s':>12}")
+    for stage, elapsed in [("legacy", t_old), ("row parser", t_new)]:
+        print(f"{stage:<12}{elapsed * 1000:>12.1f}{n_rows / elapsed:>12.0f}")
@@ -0,0 +1,174 @@
+"""
+Serve the saved bookmaker pages of benchmarks/fixtures from a local HTTP server
+so that the extraction can be measured without reaching the real websites.
+"""
+
+import random
+import struct
+import threading
+import time
+import zlib
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Static file handler which does not print one line per request"""
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Heavy resources added to the saved pages by AssetsHandler, as on the real websites:
+# pictures, a web font, a video banner and a tracker. The urls carry a version in
+# their query string as most websites do
+ASSETS_HTML = """
+<style>
+  @font-face { font-family: bench; src: url("/assets/font.woff2?v=3"); }
+  body { font-family: bench, sans-serif; }
+</style>
+<div class="banners">
+  {images}
+  <video src="/assets/promo.mp4?v=3" autoplay muted loop></video>
+</div>
+<script src="/assets/www.googletagmanager.com/gtm.js"></script>
+<script src="/assets/connect.facebook.net/fbevents.js"></script>
+"""
+N_IMAGES = 8
+# Latency of each asset request (in seconds)
+ASSET_LATENCY = 0.05
+
+
+def make_png(width, height, seed=0):
+    """A valid RGB picture - small to send but large once decoded by the browser"""
+    rng = random.Random(seed)
+    rows = b"".join(
+        b"\x00" + bytes([rng.randrange(256)] * 3) * width for _ in range(height)
+    )
+
+    def chunk(kind, data):
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+        )
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+# A tracker keeps the main thread and the memory busy
+TRACKER_JS = b"""
+window.__bench_tracker = [];
+for (var i = 0; i < 200000; i++) { window.__bench_tracker.push({id: i, t: Date.now()}); }
+setInterval(function () { window.__bench_tracker.push(Date.now()); }, 100);
+"""
+
+
+class AssetsHandler(QuietHandler):
+    """
+    Serve the saved pages with the heavy resources of ASSETS_HTML and generate
+    these resources, each one after ASSET_LATENCY seconds.
+    """
+
+    cache = {}
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path.endswith(".html"):
+            return self.send_page(path)
+        if path.startswith("/assets/"):
+            return self.send_asset(path)
+        return super().do_GET()
+
+    def send_page(self, path):
+        file = Path(self.directory) / path.lstrip("/")
+        if not file.exists():
+            return self.send_error(404)
+        images = "\n  ".join(
+            f'<img src="/assets/banner-{i}.{"jpg" if i % 2 else "png"}?v=3" width="600">'
+            for i in range(N_IMAGES)
+        )
+        html = file.read_text(encoding="utf-8").replace(
+            "</body>", ASSETS_HTML.replace("{images}", images) + "</body>"
+        )
+        self.send_body(html.encode("utf-8"), "text/html; charset=utf-8")
+
+    def send_asset(self, path):
+        time.sleep(ASSET_LATENCY)
+        if path.endswith((".png", ".jpg")):
+            body = self.generate(path, lambda: make_png(1600, 900, hash(path)))
+            content_type = "image/png"
+        elif path.endswith(".woff2"):
+            body = self.generate(path, lambda: random.randbytes(120_000))
+            content_type = "font/woff2"
+        elif path.endswith(".mp4"):
+            body = self.generate(path, lambda: random.randbytes(2_000_000))
+            content_type = "video/mp4"
+        elif path.endswith(".js"):
+            body, content_type = TRACKER_JS, "application/javascript"
+        else:
+            return self.send_error(404)
+        self.send_body(body, content_type)
+
+    def generate(self, path, func):
+        if path not in self.cache:
+            self.cache[path] = func()
+        return self.cache[path]
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_fixtures(directory=FIXTURES_DIR, port=0, handler=QuietHandler):
+    """
+    Start a threaded HTTP server on localhost serving `directory`.
+
+    Args:
+        directory (Path): The directory to serve.
+        port (int): The port to listen to, 0 picks a free one.
+        handler: The request handler class.
+
+    Returns:
+        tuple: (server, base url) - call server.shutdown() when done
+    """
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", port), partial(handler, directory=str(directory))
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def fixture_urls(base_url, directory=FIXTURES_DIR):
+    """Map each bookmaker having a saved page to its local url"""
+    return {
+        path.stem: f"{base_url}/{path.name}"
+        for path in sorted(directory.glob("*.html"))
+    }
+
+
+if __name__ == "__main__":
+    import time
+
+    server, base_url = serve_fixtures(port=8000)
+    for name, url in fixture_urls(base_url).items():
+        print(f"{name}: {url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,560 @@
+"""
+Benchmark suite of the extraction pipeline. Every measure is appended as one JSON
+line to a results file so the runs can be compared over time.
+
+Suites:
+    data: synthetic quotes of 1k to 100k events on 7 to 50 websites, timing
+        standardize_quotes, concatenate_quotes, the arbitrage kernel, the odds book
+        and the writes of the quotes (csv, sqlite and parquet) with the peak memory
+        of each stage.
+    extract: the saved bookmaker pages of benchmarks/fixtures served from a local
+        HTTP server, read end to end by get_all_quotes in headless Chrome.
+    blocking: the same pages with pictures, a font, a video and trackers added,
+        loaded with and without the blocked urls of config.json, timing the page
+        loads and measuring the transferred bytes and the browser memory.
+    startup: the wall-clock time of "cli.py analyze" on a store of synthetic
+        quotes, against importing main.py as the scrape path does, and the
+        modules each of them imports - analyze must not import Selenium.
+
+Run from the root of the repository:
+    python benchmarks/run_benchmarks.py data --events 1000 10000 --sites 7 20
+    python benchmarks/run_benchmarks.py extract --repeat 10
+    python benchmarks/run_benchmarks.py blocking --repeat 3
+    python benchmarks/run_benchmarks.py startup --events 1000 --repeat 10
+    python benchmarks/run_benchmarks.py compare
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "bet_arbitrages"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from bench_data_handling import make_quotes
+from data_handling import standardize_quotes, concatenate_quotes
+from arbitrage import DEFAULT_MARKETS, MAIN_MARKET, evaluate_market
+from team_index import TeamIndex
+from odds_book import OddsBook
+
+PATH_CONFIG = ROOT / "config.json"
+PATH_RESULTS = ROOT / "benchmarks" / "results.jsonl"
+PATH_CHROME_DRIVER = (
+    "chromedriver.exe" if os.name == "nt" else "/usr/local/bin/chromedriver"
+)
+DEFAULT_EVENTS = [1000, 10000, 100000]
+DEFAULT_SITES = [7, 20, 50]
+
+
+def environment():
+    """Describe the code and the machine the benchmark runs on"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def measure(func, *args, repeat=3):
+    """
+    Time `repeat` calls of func, then measure its peak memory in one more call
+    under tracemalloc - tracing slows the calls down so it is not timed.
+
+    Returns:
+        tuple: (result, dict with the best and median time and the peak memory)
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, {
+        "best_s": min(timings),
+        "median_s": float(np.median(timings)),
+        "repeat": repeat,
+        "peak_mb": peak / 2**20,
+    }
+
+
+class Results:
+    """Append the measures of one run to a JSON lines file"""
+
+    def __init__(self, path, suite):
+        self.path = Path(path)
+        self.suite = suite
+        self.run = {
+            "run_id": uuid.uuid4().hex[:12],
+            "date": datetime.now().isoformat(timespec="seconds"),
+            **environment(),
+        }
+
+    def add(self, stage, params, rows, measures):
+        record = {
+            **self.run,
+            "suite": self.suite,
+            "stage": stage,
+            "params": params,
+            "rows": rows,
+            **measures,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        print(
+            f"{stage:<24}{json.dumps(params):<32}{rows:>9}"
+            f"{measures['best_s'] * 1000:>12.1f}{measures.get('peak_mb', 0):>10.1f}"
+        )
+
+
+def write_csv(df, directory):
+    df.to_csv(Path(directory) / "all_quotes.csv", index=False)
+
+
+def write_store(store_class, df_long, directory):
+    with store_class(Path(directory) / store_class.__name__) as store:
+        store.append(df_long)
+
+
+def fill_book(dict_quotes_std, team_index):
+    book = OddsBook(team_index=team_index)
+    for name, df in dict_quotes_std.items():
+        book.update_frame("bench", name, df)
+    return book
+
+
+def refresh_tab(book, dict_quotes_std, name):
+    """Re-read one tab of a filled book and export the quotes, as a daemon sweep"""
+    book.update_frame("bench", name, dict_quotes_std[name])
+    return book.to_frame("bench", list(dict_quotes_std))
+
+
+def run_data(args, results):
+    """Time the data handling stages and the writes on synthetic quotes"""
+    from storage import melt_quotes, SQLiteStore, ParquetStore
+
+    stores = [SQLiteStore]
+    try:
+        import pyarrow  # noqa: F401
+
+        stores.append(ParquetStore)
+    except ImportError:
+        print("pyarrow is not installed - parquet writes skipped")
+
+    for n_sites in args.sites:
+        for n_events in args.events:
+            params = {"events": n_events, "sites": n_sites}
+            dict_quotes, col_locators, df_keys = make_quotes(n_events, n_sites)
+            n_rows = sum(len(i) for i in dict_quotes.values())
+
+            team_index, measures = measure(TeamIndex, df_keys, repeat=1)
+            results.add("team_index", params, df_keys.shape[0], measures)
+            std, measures = measure(
+                standardize_quotes, dict_quotes, col_locators, repeat=args.repeat
+            )
+            results.add("standardize_quotes", params, n_rows, measures)
+            df_quotes, measures = measure(
+                concatenate_quotes, std, team_index, repeat=args.repeat
+            )
+            results.add("concatenate_quotes", params, df_quotes.shape[0], measures)
+            _, measures = measure(
+                evaluate_market,
+                df_quotes,
+                list(std),
+                DEFAULT_MARKETS[MAIN_MARKET],
+                repeat=args.repeat,
+            )
+            results.add("arbitrage_kernel", params, df_quotes.shape[0], measures)
+            # The same quotes fed to the resident book, then exported
+            book, measures = measure(
+                lambda: fill_book(std, team_index), repeat=args.repeat
+            )
+            results.add("odds_book_update_frame", params, n_rows, measures)
+            _, measures = measure(book.to_frame, "bench", repeat=args.repeat)
+            results.add("odds_book_to_frame", params, len(book), measures)
+            # A sweep re-reading one tab, against concatenate_quotes
+            name = next(iter(std))
+            _, measures = measure(refresh_tab, book, std, name, repeat=args.repeat)
+            results.add("odds_book_refresh_tab", params, len(std[name]), measures)
+            df_quotes.insert(0, "competition", "bench")
+            now = datetime.now()
+            df_long, measures = measure(melt_quotes, df_quotes, now, repeat=args.repeat)
+            results.add("melt_quotes", params, df_long.shape[0], measures)
+
+            # Each write goes to a new directory so it does not grow over the repeats
+            with tempfile.TemporaryDirectory() as directory:
+                _, measures = measure(
+                    lambda: write_csv(df_quotes, tempfile.mkdtemp(dir=directory)),
+                    repeat=args.repeat,
+                )
+                results.add("write_csv", params, df_quotes.shape[0], measures)
+                for store_class in stores:
+                    _, measures = measure(
+                        lambda: write_store(
+                            store_class, df_long, tempfile.mkdtemp(dir=directory)
+                        ),
+                        repeat=args.repeat,
+                    )
+                    results.add(
+                        f"write_{store_class.__name__}",
+                        params,
+                        df_long.shape[0],
+                        measures,
+                    )
+
+
+def open_tabs(driver, dict_url, dict_blocked=None):
+    """Open one tab per url, in the order of dict_url as init_driver does"""
+    from driver_init import block_urls
+
+    dict_blocked = dict_blocked or {}
+    for index, (name, url) in enumerate(dict_url.items()):
+        if index > 0:
+            driver.execute_script("window.open('');")
+            driver.switch_to.window(driver.window_handles[-1])
+        block_urls(driver, dict_blocked.get(name))
+        driver.get(url)
+
+
+def run_extract(args, results, config):
+    """Time get_all_quotes on the saved pages in headless Chrome"""
+    from selenium import webdriver
+    from driver_init import set_chrome_properties
+    from driver_extract import get_all_quotes
+    from fixtures_server import serve_fixtures, fixture_urls
+    from readiness import ReadinessTracker
+    from sites import get_adapters
+
+    server, base_url = serve_fixtures()
+    dict_url = fixture_urls(base_url)
+    css_selectors = {
+        i: j.css_selector for i, j in get_adapters(dict_url, config).items()
+    }
+    driver = webdriver.Chrome(
+        args.chromedriver, options=set_chrome_properties(headless=True)
+    )
+    try:
+        start = time.perf_counter()
+        open_tabs(driver, dict_url)
+        results.add(
+            "open_tabs",
+            {"tabs": len(dict_url)},
+            len(dict_url),
+            {"best_s": time.perf_counter() - start, "repeat": 1},
+        )
+        for bulk in [False, True]:
+            for readiness in [None, ReadinessTracker.from_config(config)]:
+                params = {
+                    "tabs": len(dict_url),
+                    "bulk": bulk,
+                    "readiness": readiness is not None,
+                }
+                dict_quotes, measures = measure(
+                    lambda: get_all_quotes(
+                        driver,
+                        dict_url,
+                        css_selectors,
+                        max_wait=5,
+                        bulk=bulk,
+                        readiness=readiness,
+                    ),
+                    repeat=args.repeat,
+                )
+                empty = [name for name, rows in dict_quotes.items() if not rows]
+                if empty:
+                    print(f"no rows extracted for {', '.join(empty)}")
+                results.add(
+                    "get_all_quotes",
+                    params,
+                    sum(len(i) for i in dict_quotes.values()),
+                    measures,
+                )
+                # The time of each page in the same conditions
+                for name, url in dict_url.items():
+                    _, measures = measure(
+                        lambda: get_all_quotes(
+                            driver,
+                            dict_url,
+                            css_selectors,
+                            max_wait=5,
+                            bulk=bulk,
+                            names=[name],
+                            readiness=readiness,
+                        ),
+                        repeat=args.repeat,
+                    )
+                    results.add(
+                        f"get_quotes.{name}",
+                        params,
+                        len(dict_quotes.get(name, [])),
+                        measures,
+                    )
+    finally:
+        driver.quit()
+        server.shutdown()
+
+
+# Load time of the page and bytes transferred by the tab
+PAGE_STATS_SCRIPT = """
+var nav = performance.getEntriesByType("navigation")[0];
+var bytes = nav.transferSize;
+performance.getEntriesByType("resource").forEach(function (r) {
+    bytes += r.transferSize;
+});
+return {load: nav.loadEventEnd, bytes: bytes};
+"""
+
+
+def browser_memory(driver):
+    """
+    Resident memory of chromedriver and all the chrome processes it launched (in MB),
+    None if psutil is not installed.
+    """
+    try:
+        import psutil
+    except ImportError:
+        return None
+    process = psutil.Process(driver.service.process.pid)
+    rss = 0
+    for i in [process] + process.children(recursive=True):
+        try:
+            rss += i.memory_info().rss
+        except psutil.NoSuchProcess:
+            continue
+    return rss / 2**20
+
+
+def js_heap(driver):
+    """Used JavaScript heap of the current tab (in MB)"""
+    metrics = driver.execute_cdp_cmd("Performance.getMetrics", {})["metrics"]
+    return {i["name"]: i["value"] for i in metrics}["JSHeapUsedSize"] / 2**20
+
+
+def run_blocking(args, results, config):
+    """Load the pages with their heavy resources, with and without blocking"""
+    from selenium import webdriver
+    from driver_init import set_chrome_properties, get_blocked_urls
+    from fixtures_server import serve_fixtures, fixture_urls, AssetsHandler
+
+    server, base_url = serve_fixtures(handler=AssetsHandler)
+    dict_url = fixture_urls(base_url)
+    config_blocking = {**config, "BLOCKING": {**config.get("BLOCKING", {})}}
+    config_blocking["BLOCKING"]["enabled"] = True
+    try:
+        for blocking in [False, True]:
+            dict_blocked = {
+                name: get_blocked_urls(config_blocking, name) if blocking else []
+                for name in dict_url
+            }
+            params = {"tabs": len(dict_url), "blocking": blocking}
+            for _ in range(args.repeat):
+                # A new browser each time so the memory of the runs do not add up
+                driver = webdriver.Chrome(
+                    args.chromedriver, options=set_chrome_properties(headless=True)
+                )
+                try:
+                    start = time.perf_counter()
+                    open_tabs(driver, dict_url, dict_blocked)
+                    elapsed = time.perf_counter() - start
+                    # Let the video and the trackers run a little
+                    time.sleep(2)
+                    loads, transferred, heap = [], 0, 0
+                    for index, name in enumerate(dict_url):
+                        driver.switch_to.window(driver.window_handles[index])
+                        stats = driver.execute_script(PAGE_STATS_SCRIPT)
+                        loads.append(stats["load"] / 1000)
+                        transferred += stats["bytes"]
+                        heap += js_heap(driver)
+                    results.add(
+                        "open_tabs",
+                        params,
+                        len(dict_url),
+                        {
+                            "best_s": elapsed,
+                            "repeat": 1,
+                            "page_load_median_s": float(np.median(loads)),
+                            "page_load_max_s": max(loads),
+                            "transferred_mb": transferred / 2**20,
+                            "js_heap_mb": heap,
+                            "browser_rss_mb": browser_memory(driver),
+                        },
+                    )
+                finally:
+                    driver.quit()
+    finally:
+        server.shutdown()
+
+
+def run_command(command, repeat):
+    """
+    Time `repeat` runs of a python command from the root of the repository, then
+    list the modules it imports with -X importtime.
+
+    Returns:
+        tuple: (list of the imported modules, dict with the best and median time)
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + command,
+            cwd=ROOT,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        timings.append(time.perf_counter() - start)
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime"] + command,
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    # "import time: self [us] | cumulative | imported package" lines
+    modules = [
+        i.rsplit("|", 1)[1].strip()
+        for i in process.stderr.splitlines()
+        if i.startswith("import time:") and i.count("|") == 2
+    ][1:]
+    return modules, {
+        "best_s": min(timings),
+        "median_s": float(np.median(timings)),
+        "repeat": repeat,
+    }
+
+
+def run_startup(args, results):
+    """Time the startup of the analysis path against the import of the scraper"""
+    from storage import melt_quotes, SQLiteStore
+
+    n_events = args.events[0]
+    params = {"events": n_events}
+    dict_quotes, col_locators, df_keys = make_quotes(n_events, 7)
+    std = standardize_quotes(dict_quotes, col_locators)
+    df_quotes = concatenate_quotes(std, TeamIndex(df_keys))
+    df_quotes.insert(0, "competition", "bench")
+    with tempfile.TemporaryDirectory() as directory:
+        path_store = Path(directory) / "odds.sqlite"
+        with SQLiteStore(path_store) as store:
+            store.append(melt_quotes(df_quotes, datetime.now()))
+        path_config = Path(directory) / "config.json"
+        with open(path_config, "w") as f:
+            json.dump(
+                {
+                    "URLS": {},
+                    "STORAGE": {"format": "sqlite", "path": str(path_store)},
+                    "LOGGING": {"directory": directory, "console": False},
+                },
+                f,
+            )
+        cli = ["bet_arbitrages/cli.py", "--config", str(path_config), "analyze"]
+        commands = {
+            "cli_analyze": cli,
+            # The modules loaded before anything is scraped
+            "import_main": [
+                "-c",
+                "import sys; sys.path.insert(0, 'bet_arbitrages'); import main",
+            ],
+        }
+        for stage, command in commands.items():
+            try:
+                modules, measures = run_command(command, args.repeat)
+            except subprocess.CalledProcessError as e:
+                print(f"{stage} failed - {e.stderr.strip().splitlines()[-1]}")
+                continue
+            selenium = any(i.split(".")[0] == "selenium" for i in modules)
+            results.add(
+                stage,
+                params,
+                df_quotes.shape[0],
+                {**measures, "modules": len(modules), "selenium": selenium},
+            )
+            if stage == "cli_analyze" and selenium:
+                print("cli analyze imported selenium")
+
+
+def compare(path, baseline=None):
+    """
+    Compare the best time and the peak memory of the last run of each suite with
+    a previous run - the run before it, or the run_id given as baseline.
+    """
+    df = pd.read_json(path, lines=True)
+    df["key"] = df["stage"] + " " + df["params"].map(json.dumps)
+    for suite, df_suite in df.groupby("suite", sort=False):
+        runs = list(dict.fromkeys(df_suite["run_id"]))
+        if baseline is None and len(runs) < 2:
+            print(f"{suite}: only one run")
+            continue
+        old = baseline if baseline is not None else runs[-2]
+        new = runs[-1]
+        columns = ["best_s", "peak_mb"]
+        df_old = df_suite[df_suite["run_id"] == old].set_index("key")[columns]
+        df_new = df_suite[df_suite["run_id"] == new].set_index("key")[columns]
+        df_cmp = df_old.join(df_new, lsuffix="_old", rsuffix="_new", how="inner")
+        df_cmp["time_ratio"] = df_cmp["best_s_new"] / df_cmp["best_s_old"]
+        print(f"{suite}: run {new} against {old}")
+        print(df_cmp.to_string(float_format=lambda x: f"{x:.3f}"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the extraction pipeline")
+    parser.add_argument(
+        "suite", choices=["data", "extract", "blocking", "startup", "compare"]
+    )
+    parser.add_argument("--events", type=int, nargs="+", default=DEFAULT_EVENTS)
+    parser.add_argument("--sites", type=int, nargs="+", default=DEFAULT_SITES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--chromedriver", default=PATH_CHROME_DRIVER)
+    parser.add_argument("--output", default=PATH_RESULTS, help="JSON lines file")
+    parser.add_argument("--baseline", help="run_id to compare with")
+    args = parser.parse_args()
+
+    if args.suite == "compare":
+        compare(args.output, args.baseline)
+        raise SystemExit(0)
+
+    with open(PATH_CONFIG) as f:
+        config = json.load(f)
+    results = Results(args.output, args.suite)
+    print(f"run {results.run['run_id']} - results appended to {args.output}")
+    print(f"{'stage':<24}{'params':<32}{'rows':>9}{'best (ms)':>12}{'peak (MB)':>10}")
+    if args.suite == "data":
+        run_data(args, results)
+    elif args.suite == "extract":
+        run_extract(args, results, config)
+    elif args.suite == "startup":
+        run_startup(args, results)
+    else:
+        run_blocking(args, results, config)
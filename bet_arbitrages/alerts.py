@@ -0,0 +1,353 @@
+import json
+import math
+import queue
+import socket
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+
+import logger as log
+import metrics
+from arbitrage import DEFAULT_MARKETS, MAIN_MARKET
+
+logger = log.get_logger("alerts")
+
+# The websites only quote the main market
+OUTCOMES = DEFAULT_MARKETS[MAIN_MARKET]
+# An event is an arbitrage below this margin
+DEFAULT_THRESHOLD = 1.0
+# Amount split between the outcomes of an arbitrage
+DEFAULT_BANKROLL = 100
+# An ongoing arbitrage is sent again if its margin drops by more than this
+DEFAULT_IMPROVEMENT = 0.005
+# Prices read longer ago are not used anymore (in seconds)
+DEFAULT_MAX_AGE = 300
+DEFAULT_TIMEOUT = 5
+DEFAULT_ALERTS_PATH = "data/alerts.jsonl"
+
+
+def stake_split(prices, bankroll=DEFAULT_BANKROLL):
+    """
+    Split a bankroll between the outcomes so every outcome returns the same amount:
+    the stake of an outcome is proportional to the inverse of its price.
+
+    Args:
+        prices (list): The best price of each outcome.
+        bankroll (float): The total amount staked.
+
+    Returns:
+        tuple: (list of stakes, amount returned whatever the outcome)
+    """
+    margin = sum(1 / i for i in prices)
+    stakes = [bankroll / (price * margin) for price in prices]
+    return stakes, bankroll / margin
+
+
+class FileSink:
+    """Append the alerts as JSON lines to a file"""
+
+    def __init__(self, path=DEFAULT_ALERTS_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def send(self, alert):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(alert) + "\n")
+
+    def close(self):
+        pass
+
+
+class WebhookSink:
+    """POST the alerts as JSON to an url, e.g. a local webhook of a chat bot"""
+
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+
+    def send(self, alert):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(alert).encode(),
+            headers=self.headers,
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+    def close(self):
+        pass
+
+
+class UnixSocketSink:
+    """
+    Write the alerts as JSON lines to a Unix stream socket. The connection is kept
+    open and re-opened once if the listener went away.
+    """
+
+    def __init__(self, path, timeout=DEFAULT_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.socket = None
+
+    def _connect(self):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(self.timeout)
+        self.socket.connect(self.path)
+
+    def send(self, alert):
+        data = (json.dumps(alert) + "\n").encode()
+        for retry in (False, True):
+            try:
+                if self.socket is None:
+                    self._connect()
+                self.socket.sendall(data)
+                return
+            except OSError:
+                self.close()
+                if retry:
+                    raise
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+SINKS = {"file": FileSink, "webhook": WebhookSink, "unix": UnixSocketSink}
+
+
+def get_sinks(config_sinks):
+    """
+    Instantiate the sinks of the ALERTS section of config.json, e.g.
+    [{"type": "file", "path": ...}, {"type": "webhook", "url": ...},
+    {"type": "unix", "path": ...}]
+    """
+    sinks = []
+    for config_sink in config_sinks:
+        params = dict(config_sink)
+        sink_type = params.pop("type")
+        if sink_type not in SINKS:
+            raise ValueError(f"Unknown alert sink {sink_type}")
+        sinks.append(SINKS[sink_type](**params))
+    return sinks
+
+
+class AlertEngine:
+    """
+    Evaluate the margin of the events each time the prices of one bookmaker are
+    read, instead of after the whole sweep. The last prices of every bookmaker are
+    kept per competition and only the events the new prices touch are evaluated.
+
+    An arbitrage is sent once when it opens, then again only if its best
+    bookmakers change or its margin drops by more than improvement. It is
+    forgotten when it closes so a new opening is sent. The alerts are delivered
+    to the sinks by a background thread so a slow sink never delays the
+    extraction.
+
+    Args:
+        team_index (TeamIndex): The index of the team names of every website.
+        sinks (list): The sinks the alerts are sent to (see get_sinks).
+        threshold (float): An event is an arbitrage below this margin.
+        bankroll (float): Amount split between the outcomes in the alerts.
+        improvement (float): Drop of the margin sending an ongoing arbitrage again.
+        max_age (float): Prices read longer ago are ignored (in seconds).
+    """
+
+    def __init__(
+        self,
+        team_index,
+        sinks,
+        threshold=DEFAULT_THRESHOLD,
+        bankroll=DEFAULT_BANKROLL,
+        improvement=DEFAULT_IMPROVEMENT,
+        max_age=DEFAULT_MAX_AGE,
+    ):
+        self.team_index = team_index
+        self.sinks = sinks
+        self.threshold = threshold
+        self.bankroll = bankroll
+        self.improvement = improvement
+        self.max_age = max_age
+        # competition -> (home_id, away_id) -> bookmaker -> (prices, read time)
+        self.books = {}
+        # (competition, home_id, away_id) -> (margin, bookmakers, opening time)
+        self.active = {}
+        self._lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._deliver, name="alerts", daemon=True
+        )
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config, team_index):
+        """Instantiate the engine with the ALERTS section of config.json"""
+        config_alerts = config.get("ALERTS", {})
+        return cls(
+            team_index,
+            get_sinks(config_alerts.get("sinks", [{"type": "file"}])),
+            threshold=config_alerts.get("threshold", DEFAULT_THRESHOLD),
+            bankroll=config_alerts.get("bankroll", DEFAULT_BANKROLL),
+            improvement=config_alerts.get("improvement", DEFAULT_IMPROVEMENT),
+            max_age=config_alerts.get("max_age", DEFAULT_MAX_AGE),
+        )
+
+    def update(self, competition, bookmaker, df_quotes, read_time=None):
+        """
+        Replace the prices of a bookmaker for a competition and evaluate the events
+        they touch.
+
+        Args:
+            competition (str): Name of the competition.
+            bookmaker (str): Name of the website.
+            df_quotes (DataFrame): The standardized quotes of the website, None or
+                empty if its page failed.
+            read_time (float, optional): time.time() of the page read.
+
+        Returns:
+            list: The alerts sent.
+        """
+        read_time = time.time() if read_time is None else read_time
+        events = {}
+        if df_quotes is not None and df_quotes.shape[0]:
+            home_id = self.team_index.resolve_many(
+                bookmaker, df_quotes[f"{bookmaker}_home"]
+            ).to_numpy()
+            away_id = self.team_index.resolve_many(
+                bookmaker, df_quotes[f"{bookmaker}_away"]
+            ).to_numpy()
+            prices = df_quotes[[f"{bookmaker}_{i}" for i in OUTCOMES]].to_numpy(
+                dtype=float
+            )
+            for home, away, row in zip(home_id, away_id, prices):
+                if not (math.isnan(home) or math.isnan(away)):
+                    events.setdefault((int(home), int(away)), tuple(row))
+
+        alerts = []
+        with self._lock:
+            book = self.books.setdefault(competition, {})
+            touched = set(events)
+            for event, quotes in list(book.items()):
+                if bookmaker in quotes and event not in events:
+                    del quotes[bookmaker]
+                    touched.add(event)
+                    if not quotes:
+                        del book[event]
+            for event, prices in events.items():
+                book.setdefault(event, {})[bookmaker] = (prices, read_time)
+            for event in touched:
+                alert = self.evaluate(competition, event, bookmaker, read_time)
+                if alert is not None:
+                    alerts.append(alert)
+        for alert in alerts:
+            self._queue.put(alert)
+        return alerts
+
+    def evaluate(self, competition, event, trigger, read_time):
+        """
+        Compute the margin of an event with the best fresh price of each outcome,
+        return the alert to send or None.
+        """
+        now = time.time()
+        best = [(0.0, None)] * len(OUTCOMES)
+        quotes = self.books[competition].get(event, {})
+        for bookmaker, (prices, price_time) in quotes.items():
+            if now - price_time > self.max_age:
+                continue
+            for index, price in enumerate(prices):
+                # NaN and prices of 1 or less can not be part of an arbitrage
+                if price > best[index][0] and price > 1:
+                    best[index] = (float(price), bookmaker)
+        key = (competition, *event)
+        if any(bookmaker is None for _, bookmaker in best):
+            margin = math.inf
+        else:
+            margin = sum(1 / price for price, _ in best)
+
+        previous = self.active.get(key)
+        if margin >= self.threshold:
+            if previous is not None:
+                del self.active[key]
+                logger.info(
+                    f"{competition} - arbitrage {event} closed after "
+                    f"{now - previous[2]:.1f}s"
+                )
+            return None
+        bookmakers = tuple(bookmaker for _, bookmaker in best)
+        if previous is None:
+            kind = "open"
+            opened = now
+        elif bookmakers != previous[1]:
+            kind = "bookmakers"
+            opened = previous[2]
+        elif margin < previous[0] - self.improvement:
+            kind = "improved"
+            opened = previous[2]
+        # Ongoing and unchanged, already sent
+        else:
+            return None
+        self.active[key] = (margin, bookmakers, opened)
+
+        prices = [price for price, _ in best]
+        stakes, returned = stake_split(prices, self.bankroll)
+        latency = now - read_time
+        alert = {
+            "time": datetime.fromtimestamp(now).isoformat(timespec="milliseconds"),
+            "kind": kind,
+            "competition": competition,
+            "home_id": event[0],
+            "away_id": event[1],
+            "home": self.team_index.names[event[0]],
+            "away": self.team_index.names[event[1]],
+            "margin": round(margin, 6),
+            "profit": round(returned - self.bankroll, 2),
+            "bankroll": self.bankroll,
+            "outcomes": [
+                {
+                    "outcome": outcome,
+                    "bookmaker": bookmaker,
+                    "price": price,
+                    "stake": round(stake, 2),
+                }
+                for outcome, (price, bookmaker), stake in zip(OUTCOMES, best, stakes)
+            ],
+            "trigger": trigger,
+            "latency_s": round(latency, 4),
+        }
+        metrics.inc("alerts_total", kind=kind)
+        metrics.observe("alert_latency_seconds", latency)
+        logger.warning(
+            f"{competition} - arbitrage {alert['home']} - {alert['away']} "
+            f"margin {margin:.4f} ({kind}) {latency * 1000:.0f}ms after the read"
+        )
+        return alert
+
+    def _deliver(self):
+        while True:
+            alert = self._queue.get()
+            if alert is None:
+                return
+            for sink in self.sinks:
+                try:
+                    sink.send(alert)
+                # A broken sink must not stop the others
+                except Exception:
+                    logger.exception(f"alert not sent to {type(sink).__name__}")
+                    metrics.inc("alert_sink_errors_total", sink=type(sink).__name__)
+
+    def close(self):
+        """Send the queued alerts then close the sinks"""
+        self._queue.put(None)
+        self._thread.join()
+        for sink in self.sinks:
+            sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
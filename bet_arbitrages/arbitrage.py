@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+
+# Outcomes of each market, overridden by the MARKETS section of config.json. An
+# outcome name is the suffix of the quote columns "<bookmaker>_<outcome>" so it is
+# unique across the markets and has no "_".
+DEFAULT_MARKETS = {"1X2": ["1", "X", "2"]}
+# The market of the "margin" column, the other ones go to "margin_<market>"
+MAIN_MARKET = "1X2"
+
+
+def get_markets(config):
+    """Return the outcomes of each market declared in the MARKETS section of config"""
+    return config.get("MARKETS", DEFAULT_MARKETS)
+
+
+def margin_column(market):
+    return "margin" if market == MAIN_MARKET else f"margin_{market}"
+
+
+def price_cube(df, bookmakers, outcomes):
+    """
+    Gather the quotes of a market in one array. The columns are the declared
+    "<bookmaker>_<outcome>" ones, a bookmaker not quoting an outcome is NaN.
+
+    Args:
+        df (DataFrame): The wide quotes.
+        bookmakers (list): Names of the bookmakers.
+        outcomes (list): The mutually exclusive outcomes of the market.
+
+    Returns:
+        numpy.ndarray: The quotes as float, shaped (events, bookmakers, outcomes).
+    """
+    cube = np.full((len(df), len(bookmakers), len(outcomes)), np.nan)
+    for i, bookmaker in enumerate(bookmakers):
+        for j, outcome in enumerate(outcomes):
+            column = f"{bookmaker}_{outcome}"
+            if column in df.columns:
+                cube[:, i, j] = df[column].to_numpy(dtype=float)
+    return cube
+
+
+def arbitrage_kernel(prices):
+    """
+    Find the best quote of each outcome, the margin and the stake split of every
+    event in one pass. The margin is the sum over the outcomes of the inverse of
+    the best quote, below 1 the event is an arbitrage. The stake of an outcome is
+    proportional to the inverse of its best quote so every outcome returns the
+    same amount: bankroll / margin.
+
+    Args:
+        prices (numpy.ndarray): The quotes shaped (events, bookmakers, outcomes),
+            NaN where a bookmaker does not quote an outcome.
+
+    Returns:
+        tuple: (best quotes (events, outcomes), index of the bookmaker of each best
+        quote (events, outcomes), margins (events,), fraction of the bankroll
+        staked on each outcome (events, outcomes)). An event missing an outcome
+        has a NaN margin and NaN stakes.
+    """
+    if prices.shape[1] == 0:
+        # No bookmaker at all
+        prices = np.full((prices.shape[0], 1, prices.shape[2]), np.nan)
+    missing = np.isnan(prices)
+    # NaN never wins the argmax
+    best_index = np.where(missing, -np.inf, prices).argmax(axis=1)
+    best = np.take_along_axis(prices, best_index[:, None, :], axis=1)[:, 0, :]
+    inverse = 1 / best
+    margin = inverse.sum(axis=1)
+    stakes = inverse / margin[:, None]
+    return best, best_index, margin, stakes
+
+
+def evaluate_market(df, bookmakers, outcomes, bankroll=None):
+    """
+    Evaluate one market of wide quotes with arbitrage_kernel.
+
+    Args:
+        df (DataFrame): The wide quotes.
+        bookmakers (list): Names of the bookmakers.
+        outcomes (list): The mutually exclusive outcomes of the market.
+        bankroll (float, optional): Amount split between the outcomes, the
+            stakes are fractions of 1 if None.
+
+    Returns:
+        DataFrame: On the index of df, "best_<outcome>", "book_<outcome>" and
+        "stake_<outcome>" for each outcome and the "margin".
+    """
+    best, best_index, margin, stakes = arbitrage_kernel(
+        price_cube(df, bookmakers, outcomes)
+    )
+    if bankroll is not None:
+        stakes = stakes * bankroll
+    names = np.array(bookmakers, dtype=object)
+    columns = {}
+    for j, outcome in enumerate(outcomes):
+        columns[f"best_{outcome}"] = best[:, j]
+        book = names[best_index[:, j]] if len(names) else np.full(len(df), None)
+        columns[f"book_{outcome}"] = np.where(np.isnan(best[:, j]), None, book)
+    for j, outcome in enumerate(outcomes):
+        columns[f"stake_{outcome}"] = stakes[:, j]
+    columns["margin"] = margin
+    return pd.DataFrame(columns, index=df.index)
+
+
+def add_margins(df, bookmakers, markets=None):
+    """
+    Add the margin of every market quoted by at least one bookmaker to wide
+    quotes: "margin" for the main market and "margin_<market>" for the others.
+
+    Args:
+        df (DataFrame): The wide quotes, updated.
+        bookmakers (list): Names of the bookmakers.
+        markets (dict, optional): The outcomes of each market, DEFAULT_MARKETS if
+            None.
+    """
+    markets = DEFAULT_MARKETS if markets is None else markets
+    for market, outcomes in markets.items():
+        quoted = any(f"{b}_{o}" in df.columns for b in bookmakers for o in outcomes)
+        if market != MAIN_MARKET and not quoted:
+            continue
+        _, _, margin, _ = arbitrage_kernel(price_cube(df, bookmakers, outcomes))
+        df[margin_column(market)] = margin
+    return df
@@ -0,0 +1,217 @@
+import pandas as pd
+
+import logger as log
+from data_handling import compute_margin
+from storage import COLUMNS, OUTCOMES
+
+logger = log.get_logger("changelog")
+
+# A quote is identified by its event, its bookmaker and its outcome
+KEY = ["event", "bookmaker", "outcome"]
+# Rows holding the full state of a competition
+FULL_KINDS = ["checkpoint", "snapshot"]
+DEFAULT_CHECKPOINT_EVERY = 20
+# How far back to look for a checkpoint (in days)
+DEFAULT_LOOKBACK_DAYS = 31
+
+
+class OddsChangeLog:
+    """
+    Change-log of the quotes on top of an OddsStore. Each snapshot is compared with
+    the last known quote of every (event, bookmaker, outcome) of its competition and
+    only the differences are written: "insert" for a new quote, "update" for a new
+    price and "delete" for a quote which has disappeared. Every checkpoint_every
+    snapshots the full state is written as "checkpoint" rows so any point in time
+    can be rebuilt from the closest checkpoint (see reconstruct).
+
+    It exposes the same append / flush / read / close methods as the stores.
+
+    Args:
+        store (OddsStore): The storage where the changes are written.
+        checkpoint_every (int): Number of snapshots between two checkpoints.
+        lookback_days (int): How far back to look for a checkpoint.
+    """
+
+    def __init__(
+        self,
+        store,
+        checkpoint_every=DEFAULT_CHECKPOINT_EVERY,
+        lookback_days=DEFAULT_LOOKBACK_DAYS,
+    ):
+        self.store = store
+        self.checkpoint_every = checkpoint_every
+        self.lookback_days = lookback_days
+        # Last quotes of each competition indexed by KEY
+        self.state = {}
+        # Number of snapshots since the last checkpoint of each competition
+        self.since_checkpoint = {}
+
+    def append(self, df_long):
+        """
+        Record snapshots in the long layout of melt_quotes. A snapshot is the set of
+        rows sharing a timestamp and a competition.
+        """
+        for (timestamp, competition), df in df_long.groupby(
+            ["timestamp", "competition"], sort=True
+        ):
+            self.store.append(self.record(df, competition, timestamp))
+
+    def record(self, df, competition, timestamp):
+        """
+        Compare one snapshot of a competition with its last state.
+
+        Returns:
+            DataFrame: The rows to write with the COLUMNS of the storage.
+        """
+        df = df.drop_duplicates(KEY).set_index(KEY)[["home", "away", "price"]]
+        if competition not in self.state:
+            # Start from the stored state so a restart does not write a checkpoint
+            self.state[competition] = self.state_at(competition, timestamp)
+            self.since_checkpoint[competition] = 0
+        previous = self.state[competition]
+
+        count = self.since_checkpoint[competition]
+        if previous is None or count >= self.checkpoint_every:
+            rows = df.assign(kind="checkpoint")
+            self.since_checkpoint[competition] = 0
+            logger.info(f"{competition} - checkpoint of {df.shape[0]} quotes")
+        else:
+            is_new = ~df.index.isin(previous.index)
+            df_common = df[~is_new]
+            is_updated = (
+                df_common["price"] != previous["price"].reindex(df_common.index)
+            ).to_numpy()
+            df_deleted = previous[~previous.index.isin(df.index)]
+            rows = pd.concat(
+                [
+                    df[is_new].assign(kind="insert"),
+                    df_common[is_updated].assign(kind="update"),
+                    df_deleted.assign(price=float("nan"), kind="delete"),
+                ]
+            )
+            self.since_checkpoint[competition] += 1
+            logger.info(
+                f"{competition} - {is_new.sum()} inserted, {is_updated.sum()} updated, "
+                f"{df_deleted.shape[0]} deleted out of {df.shape[0]} quotes"
+            )
+        self.state[competition] = df
+
+        rows = rows.reset_index().assign(
+            timestamp=pd.Timestamp(timestamp), competition=competition
+        )
+        return rows[COLUMNS]
+
+    def checkpoint_time(self, competition, at):
+        """
+        Return the date of the last full state of a competition before at,
+        None if there is none in the last lookback_days days.
+        """
+        self.store.flush()
+        day = at.normalize()
+        for _ in range(self.lookback_days):
+            df = self.store.read(
+                start=day,
+                end=min(at, day + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)),
+                competitions=[competition],
+                kinds=FULL_KINDS,
+            )
+            if df.shape[0] > 0:
+                return df["timestamp"].max()
+            day -= pd.Timedelta(days=1)
+        return None
+
+    def state_at(self, competition, at=None):
+        """
+        Rebuild the quotes of one competition at a given date from the closest
+        checkpoint and the changes written after it.
+
+        Returns:
+            DataFrame: The quotes indexed by KEY with home, away and price columns,
+            None if no checkpoint was found.
+        """
+        at = pd.Timestamp.now() if at is None else pd.Timestamp(at)
+        checkpoint = self.checkpoint_time(competition, at)
+        if checkpoint is None:
+            return None
+        df = self.store.read(start=checkpoint, end=at, competitions=[competition])
+        # The rows are sorted by timestamp - keep the last version of each quote
+        df = df[(df["timestamp"] > checkpoint) | df["kind"].isin(FULL_KINDS)]
+        df = df.drop_duplicates(KEY, keep="last")
+        df = df[df["kind"] != "delete"]
+        return df.set_index(KEY)[["home", "away", "price"]]
+
+    def reconstruct(self, at=None, competitions=None):
+        """
+        Rebuild the quotes at a given date in the layout of concatenate_quotes.
+
+        Args:
+            at (datetime, optional): The date to rebuild, now if None.
+            competitions (list, optional): The competitions to rebuild, all the
+                competitions having a checkpoint in the last lookback_days days if None.
+
+        Returns:
+            DataFrame: The columns "competition", "home_id", "away_id", "home", "away",
+            "<name>_1", "<name>_X", "<name>_2" for each bookmaker and "margin".
+        """
+        at = pd.Timestamp.now() if at is None else pd.Timestamp(at)
+        if competitions is None:
+            self.store.flush()
+            competitions = self.store.read(
+                start=at.normalize() - pd.Timedelta(days=self.lookback_days),
+                end=at,
+                kinds=FULL_KINDS,
+            )["competition"].unique()
+
+        list_quotes = []
+        for competition in competitions:
+            df = self.state_at(competition, at)
+            if df is None or df.shape[0] == 0:
+                logger.warning(f"no quotes to rebuild for {competition} at {at}")
+                continue
+            list_quotes.append(df.reset_index().assign(competition=competition))
+        if not list_quotes:
+            return pd.DataFrame(
+                columns=["competition", "home_id", "away_id", "home", "away", "margin"]
+            )
+        df_long = pd.concat(list_quotes, axis=0, ignore_index=True)
+
+        # Back to one column per bookmaker and outcome
+        bookmakers = list(dict.fromkeys(df_long["bookmaker"]))
+        df_long["column"] = df_long["bookmaker"] + "_" + df_long["outcome"]
+        df_quotes = df_long.pivot_table(
+            index=["competition", "event", "home", "away"],
+            columns="column",
+            values="price",
+            aggfunc="last",
+        )
+        outcomes_cols = [
+            [f"{b}_{o}" for b in bookmakers if f"{b}_{o}" in df_quotes.columns]
+            for o in OUTCOMES
+        ]
+        columns = [f"{b}_{o}" for b in bookmakers for o in OUTCOMES]
+        df_quotes = df_quotes[[i for i in columns if i in df_quotes]].reset_index()
+        ids = df_quotes["event"].str.split("-", n=1, expand=True).astype(int)
+        df_quotes.insert(1, "home_id", ids[0])
+        df_quotes.insert(2, "away_id", ids[1])
+        df_quotes = df_quotes.drop(columns="event")
+        df_quotes.columns.name = None
+        df_quotes["margin"] = compute_margin(df_quotes, outcomes_cols)
+        return df_quotes
+
+    def flush(self):
+        self.store.flush()
+
+    def read(self, *args, **kwargs):
+        return self.store.read(*args, **kwargs)
+
+    def days(self, *args, **kwargs):
+        return self.store.days(*args, **kwargs)
+
+    def close(self):
+        self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
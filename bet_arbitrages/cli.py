@@ -0,0 +1,483 @@
+"""
+Command line entry point of the project.
+
+    python bet_arbitrages/cli.py init-drivers --competitions ligue1
+    python bet_arbitrages/cli.py scrape --competitions ligue1 laliga --bookmakers betfirst
+    python bet_arbitrages/cli.py daemon
+    python bet_arbitrages/cli.py coordinator --listen 0.0.0.0:8765
+    python bet_arbitrages/cli.py worker --connect coordinator-host:8765
+    python bet_arbitrages/cli.py analyze --at "2023-03-01 18:00" --max-margin 1.01
+    python bet_arbitrages/cli.py replay --start 2023-02-01 --legacy --workers 4
+
+Only the modules needed by a subcommand are imported: analyze and replay read the
+stored quotes with pandas and never import Selenium.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+# Start of the process as seen by the command line, to measure the startup time
+START = time.perf_counter()
+
+import logger as log
+
+logger = log.get_logger("cli")
+
+CONFIG_PATH = "config.json"
+PATH_DRIVER_LOCATION = "driver_location.json"
+# Number of arbitrages printed by analyze
+DEFAULT_TOP = 20
+
+
+def load_config(path=CONFIG_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def select(config, competitions=None, bookmakers=None):
+    """
+    Restrict the config to some competitions and bookmakers: the tabs of the other
+    bookmakers are not opened at all.
+
+    Args:
+        config (dict): The parsed config.json.
+        competitions (list, optional): The competitions, config["COMPETITIONS"] or
+            all the competitions of config["URLS"] if None.
+        bookmakers (list, optional): The bookmakers, all of them if None.
+
+    Returns:
+        tuple: (config restricted to the selection, list of competitions)
+    """
+    if competitions is None:
+        competitions = config.get("COMPETITIONS", list(config["URLS"]))
+    unknown = [i for i in competitions if i not in config["URLS"]]
+    if unknown:
+        raise SystemExit(f"unknown competitions: {', '.join(unknown)}")
+    if bookmakers is not None:
+        known = {i for competition in competitions for i in config["URLS"][competition]}
+        unknown = [i for i in bookmakers if i not in known]
+        if unknown:
+            raise SystemExit(f"unknown bookmakers: {', '.join(unknown)}")
+    urls = {
+        competition: {
+            name: url
+            for name, url in config["URLS"][competition].items()
+            if bookmakers is None or name in bookmakers
+        }
+        for competition in competitions
+    }
+    return {**config, "URLS": urls}, competitions
+
+
+def log_startup(command):
+    logger.info(f"startup - {command}: {time.perf_counter() - START:.3f}s")
+
+
+def init_drivers(args, config, competitions):
+    """
+    Launch a driver per competition and register it in driver_location.json. The
+    sessions stay open after the command, scrape, daemon and worker adopt them.
+    The live sessions already registered are kept.
+    """
+    from driver_pool import DriverPool
+
+    log_startup("init-drivers")
+    config_pool = {
+        **config.get("DRIVER_POOL", {}),
+        "driver_location": args.driver_location,
+        "persist": True,
+    }
+    pool = DriverPool.from_config({**config, "DRIVER_POOL": config_pool})
+    dict_driver = pool.get_all(competitions)
+    logger.info(f"{len(dict_driver)} drivers registered in {args.driver_location}")
+    pool.close()
+
+
+def scrape(args, config, competitions, daemon=False):
+    """Extract the quotes of the competitions once, or forever with daemon"""
+    from datetime import datetime
+    import pandas as pd
+
+    import metrics
+    from main import (
+        KEY_PATH,
+        UNRESOLVED_PATH,
+        extract_all_competitions,
+        get_kambi_fetcher,
+        write_quotes,
+    )
+    from team_index import TeamIndex
+    from sites import site_names
+    from storage import get_store
+    from driver_pool import DriverPool
+    from readiness import ReadinessTracker
+    from health import SiteHealth
+    from row_parser import QUARANTINE
+
+    log_startup("daemon" if daemon else "scrape")
+    # Local endpoint of the per stage timings, a no-op if disabled
+    metrics.configure(config)
+    # Get the dataframe with the keys
+    team_index = TeamIndex(pd.read_csv(KEY_PATH), sites=site_names(config))
+    pool = DriverPool.from_config(config)
+    supervise = config.get("SUPERVISOR", {}).get("enabled", False)
+    if supervise:
+        from supervisor import BrowserSupervisor, reap_orphans
+
+        # Free the memory held by the browsers of crashed runs, the registered
+        # sessions are adopted by the pool
+        reap_orphans(path_driver_location=pool.path_driver_location)
+    # Adopt the registered drivers, launch the others in parallel
+    dict_driver = pool.get_all(competitions)
+    store = get_store(config)
+    kambi = get_kambi_fetcher(config)
+    readiness = ReadinessTracker.from_config(config)
+    # The backoff of the failing tabs goes on from the previous runs
+    health = SiteHealth.from_config(config)
+    alerts = None
+    if config.get("ALERTS", {}).get("enabled", False):
+        from alerts import AlertEngine
+
+        alerts = AlertEngine.from_config(config, team_index)
+
+    if daemon:
+        from daemon import PollingDaemon
+        from fingerprint import ChangeTracker
+
+        supervisor = BrowserSupervisor.from_config(pool, config) if supervise else None
+        with pool, store, health:
+            if supervisor is not None:
+                supervisor.start()
+            PollingDaemon(
+                config,
+                pool,
+                competitions,
+                team_index,
+                store,
+                kambi,
+                readiness,
+                alerts,
+                ChangeTracker.from_config(config),
+                health,
+            ).run_forever()
+            if supervisor is not None:
+                supervisor.stop()
+                supervisor.memory().to_csv("data/browser_memory.csv", index=False)
+        if alerts is not None:
+            alerts.close()
+        return
+
+    # First get the date of the extraction
+    now = datetime.now()
+    # For all competitions - Extract the quote
+    sweep_start = time.perf_counter()
+    all_quotes, df_failed, timings = extract_all_competitions(
+        dict_driver,
+        config,
+        team_index,
+        now,
+        kambi=kambi,
+        readiness=readiness,
+        alerts=alerts,
+        health=health,
+    )
+    sweep_elapsed = time.perf_counter() - sweep_start
+    # Report the wall-clock time of the sweep
+    logger.info(f"timing - pool warm-up: {pool.warm_up_time:.2f}s")
+    for competition, elapsed in sorted(timings.items(), key=lambda x: -x[1]):
+        logger.info(f"timing - {competition}: {elapsed:.2f}s")
+    logger.info(
+        f"timing - sweep: {sweep_elapsed:.2f}s for {len(timings)} competitions "
+        f"(sum {sum(timings.values()):.2f}s)"
+    )
+    logger.info(f"driver sessions\n{pool.stats().to_string(index=False)}")
+    logger.info(f"time-to-ready\n{readiness.stats().to_string(index=False)}")
+    # The failures are logged in the health file
+    df_health = health.stats()
+    if df_failed.shape[0] or df_health["failures"].any():
+        logger.warning(
+            f"{df_failed.shape[0]} urls failed\n"
+            f"{df_health[df_health['failures'] > 0].to_string(index=False)}"
+        )
+    health.close()
+    pool.close()
+    if kambi is not None:
+        kambi.close()
+    if alerts is not None:
+        alerts.close()
+
+    # Finally write the quotes to the store
+    if all_quotes:
+        # Concatenate all dataframes into one
+        df_all_quotes = pd.concat(all_quotes, axis=0)
+        with store:
+            write_quotes(store, df_all_quotes, now)
+    else:
+        logger.error("no quotes extracted, nothing written to the store")
+    # Write the rows the parsers could not read
+    QUARANTINE.write()
+    # Write the team names to add to the keys
+    team_index.write_unresolved(UNRESOLVED_PATH)
+
+
+def coordinator(args, config, competitions):
+    """
+    Submit the sweeps to the workers, then standardize, concatenate and store
+    their quotes. The coordinator does not launch any browser.
+    """
+    import pandas as pd
+
+    import metrics
+    from main import KEY_PATH
+    from team_index import TeamIndex
+    from sites import site_names
+    from storage import get_store
+    from cluster import TaskQueue, QueueServer, Coordinator
+    from health import SiteHealth
+
+    log_startup("coordinator")
+    metrics.configure(config)
+    team_index = TeamIndex(pd.read_csv(KEY_PATH), sites=site_names(config))
+    store = get_store(config)
+    alerts = None
+    if config.get("ALERTS", {}).get("enabled", False):
+        from alerts import AlertEngine
+
+        alerts = AlertEngine.from_config(config, team_index)
+    listen = args.listen or config.get("CLUSTER", {}).get("listen")
+    with TaskQueue.from_config(config) as queue, store, SiteHealth.from_config(
+        config
+    ) as health:
+        server = QueueServer(queue, listen).start() if listen else None
+        run = Coordinator.from_config(
+            config, queue, competitions, team_index, store, alerts, health
+        )
+        if args.once:
+            run.sweep()
+        else:
+            run.run_forever()
+        if server is not None:
+            server.stop()
+    if alerts is not None:
+        alerts.close()
+
+
+def worker(args, config):
+    """Read the tabs of the tasks of the coordinator on the local browsers"""
+    import metrics
+    from cluster import ClusterWorker, get_queue
+
+    log_startup("worker")
+    metrics.configure(config)
+    queue = get_queue(config, args.connect)
+    ClusterWorker.from_config(config, queue, name=args.name).run_forever()
+    queue.close()
+
+
+def analyze(args, config, competitions, bookmakers=None):
+    """
+    Rebuild the stored quotes at a date and print the events whose margin is below
+    max_margin, the best arbitrages first.
+    """
+    import pandas as pd
+
+    from storage import get_store, OUTCOMES
+    from changelog import OddsChangeLog
+    from arbitrage import evaluate_market
+
+    log_startup("analyze")
+    store = get_store(config)
+    # A snapshot store rebuilds the same way, from its last full snapshot
+    if not isinstance(store, OddsChangeLog):
+        store = OddsChangeLog(store)
+    with store:
+        df = store.reconstruct(at=args.at, competitions=competitions)
+    stored = list(
+        dict.fromkeys(
+            i.rsplit("_", 1)[0]
+            for i in df.columns
+            if "_" in i and i.rsplit("_", 1)[1] in OUTCOMES
+        )
+    )
+    if bookmakers is not None:
+        # The margin is computed again over the selected bookmakers only
+        df = df.drop(
+            columns=[
+                f"{b}_{o}" for b in stored if b not in bookmakers for o in OUTCOMES
+            ],
+            errors="ignore",
+        )
+        stored = [i for i in stored if i in bookmakers]
+        if not stored:
+            raise SystemExit("no quotes stored for these bookmakers")
+    # Best quote, bookmaker and stake of each outcome
+    df_best = evaluate_market(df, stored, OUTCOMES, args.bankroll)
+    df = pd.concat([df.drop(columns="margin", errors="ignore"), df_best], axis=1)
+    # An event not quoted by the selected bookmakers has no margin
+    df = df[df["margin"].notna()]
+    df_arbitrages = df[df["margin"] < args.max_margin].sort_values("margin")
+    logger.info(
+        f"{df_arbitrages.shape[0]} events below a margin of {args.max_margin} "
+        f"out of {df.shape[0]}"
+    )
+    if args.output:
+        df_arbitrages.to_csv(args.output, index=False)
+    print(df_arbitrages.head(args.top).to_string(index=False))
+    log_startup("analyze done")
+
+
+def replay(args, config, competitions):
+    """
+    Replay the stored quotes and print the arbitrages per day and per combination
+    of bookmakers.
+    """
+    from replay import replay as run_replay, pair_frequency, summary, LEGACY_PATTERN
+
+    log_startup("replay")
+    legacy = LEGACY_PATTERN if args.legacy == "default" else args.legacy
+    df = run_replay(
+        None if args.no_store else config,
+        start=args.start,
+        end=args.end,
+        competitions=competitions,
+        legacy=legacy,
+        threshold=args.max_margin,
+        max_workers=args.workers,
+    )
+    logger.info(f"{df.shape[0]} arbitrages replayed")
+    if args.output:
+        df.to_csv(args.output, index=False)
+    print(summary(df, args.bankroll).to_string(index=False))
+    print(pair_frequency(df).to_string(index=False))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Detect the arbitrages between the betting websites"
+    )
+    parser.add_argument("--config", default=CONFIG_PATH, help="path of config.json")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    # The selection is given after the subcommand
+    selection = argparse.ArgumentParser(add_help=False)
+    selection.add_argument(
+        "--competitions",
+        nargs="+",
+        help="competitions of config URLS, config COMPETITIONS if not set",
+    )
+    selection.add_argument(
+        "--bookmakers", nargs="+", help="bookmakers to use, all of them if not set"
+    )
+
+    parser_init = subparsers.add_parser(
+        "init-drivers",
+        parents=[selection],
+        help="launch and register a driver per competition, adopted by the next runs",
+    )
+    parser_init.add_argument(
+        "--driver-location",
+        default=PATH_DRIVER_LOCATION,
+        help="file where the coordinates of the drivers are written",
+    )
+    subparsers.add_parser(
+        "scrape", parents=[selection], help="extract the quotes once and store them"
+    )
+    subparsers.add_parser(
+        "daemon",
+        parents=[selection],
+        help="keep the drivers open and refresh each website on its interval",
+    )
+    parser_coordinator = subparsers.add_parser(
+        "coordinator",
+        parents=[selection],
+        help="hand out the tabs to the workers and store their quotes",
+    )
+    parser_coordinator.add_argument(
+        "--listen", help="host:port serving the queue to the workers of other hosts"
+    )
+    parser_coordinator.add_argument(
+        "--once", action="store_true", help="run a single sweep"
+    )
+    parser_worker = subparsers.add_parser(
+        "worker", help="read the tabs handed out by the coordinator"
+    )
+    parser_worker.add_argument(
+        "--connect", help="host:port of the coordinator, its local queue if not set"
+    )
+    parser_worker.add_argument("--name", help="name of the worker, host-pid if not set")
+    parser_analyze = subparsers.add_parser(
+        "analyze",
+        parents=[selection],
+        help="find the arbitrages in the stored quotes, without a browser",
+    )
+    parser_analyze.add_argument("--at", help="date to rebuild, now if not set")
+    parser_analyze.add_argument(
+        "--max-margin",
+        type=float,
+        default=1.0,
+        help="print the events below this margin, 1 for the arbitrages only",
+    )
+    parser_analyze.add_argument(
+        "--top", type=int, default=DEFAULT_TOP, help="number of events printed"
+    )
+    parser_analyze.add_argument(
+        "--bankroll", type=float, default=100, help="amount split between the outcomes"
+    )
+    parser_analyze.add_argument("--output", help="write all the events to this csv")
+    parser_replay = subparsers.add_parser(
+        "replay",
+        parents=[selection],
+        help="list the arbitrages of the stored history, without a browser",
+    )
+    parser_replay.add_argument("--start", help="replay from this date")
+    parser_replay.add_argument("--end", help="replay until this date")
+    parser_replay.add_argument(
+        "--legacy",
+        nargs="?",
+        const="default",
+        help="also replay legacy csv files, data/all_quotes_*.csv if no pattern",
+    )
+    parser_replay.add_argument(
+        "--no-store", action="store_true", help="only replay the legacy csv files"
+    )
+    parser_replay.add_argument(
+        "--max-margin", type=float, default=1.0, help="arbitrages below this margin"
+    )
+    parser_replay.add_argument(
+        "--bankroll", type=float, default=100, help="amount staked per arbitrage"
+    )
+    parser_replay.add_argument(
+        "--workers", type=int, help="number of processes, 1 to replay in this one"
+    )
+    parser_replay.add_argument("--output", help="write the arbitrages to this csv")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config = load_config(args.config)
+    # Rebuild the log handlers with the LOGGING section
+    log.configure(config)
+    if args.command == "analyze":
+        # The stored competitions are all read unless some are selected
+        analyze(args, config, args.competitions, args.bookmakers)
+        return
+    if args.command == "replay":
+        replay(args, config, args.competitions)
+        return
+    if args.command == "worker":
+        # A worker reads the tabs of any competition it is handed
+        worker(args, config)
+        return
+    config, competitions = select(config, args.competitions, args.bookmakers)
+    if args.command == "init-drivers":
+        init_drivers(args, config, competitions)
+    elif args.command == "coordinator":
+        coordinator(args, config, competitions)
+    else:
+        scrape(args, config, competitions, daemon=args.command == "daemon")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
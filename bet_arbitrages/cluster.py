@@ -0,0 +1,827 @@
+"""
+Coordinator / worker mode: the tabs are read by worker processes, possibly on
+other hosts, and the quotes are standardized, concatenated and stored by one
+coordinator.
+
+The coordinator submits the tasks of a sweep - one per competition, or one per
+competition and bookmaker - to a TaskQueue in a SQLite file. A worker claims a
+task with a lease, reads the tabs on its own DriverPool and sends back the raw
+rows. The lease is renewed by the heartbeat of the worker: if the worker dies its
+lease expires and the task is handed to another worker. Workers on other hosts
+reach the queue through the QueueServer of the coordinator, a JSON lines protocol
+over TCP.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+
+import logger as log
+import metrics
+
+logger = log.get_logger("cluster")
+
+DEFAULT_QUEUE_PATH = "data/cluster.db"
+# Time a task stays leased without heartbeat (in seconds)
+DEFAULT_LEASE = 120
+# A task failing or leased this many times is given up
+DEFAULT_MAX_ATTEMPTS = 3
+# Time between two sweeps of the coordinator (in seconds)
+DEFAULT_INTERVAL = 60
+# Tasks not done after this time are cancelled (in seconds)
+DEFAULT_SWEEP_TIMEOUT = 600
+# Time between two checks of the queue (in seconds)
+DEFAULT_POLL = 1.0
+# Maximum number of chrome sessions of a worker
+DEFAULT_MAX_SESSIONS = 2
+# Number of sweeps kept in the queue
+DEFAULT_KEEP_SWEEPS = 10
+# Tasks per competition, or per competition and bookmaker with "tab"
+SPLITS = ("competition", "tab")
+# States of a task
+PENDING, LEASED, DONE, FAILED, CANCELLED = (
+    "pending",
+    "leased",
+    "done",
+    "failed",
+    "cancelled",
+)
+
+
+class TaskQueue:
+    """
+    Queue of the extraction tasks in a SQLite file, shared by the processes of the
+    host. A claim runs in an immediate transaction so a task is only leased to one
+    worker.
+
+    Args:
+        path (str): Location of the SQLite file.
+        lease (float): Time a task stays leased without heartbeat (in seconds).
+        max_attempts (int): A task failing or leased this many times is given up.
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_QUEUE_PATH,
+        lease=DEFAULT_LEASE,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # Transactions are opened explicitly
+        self.connection = sqlite3.connect(
+            str(self.path), timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sweep INTEGER NOT NULL,
+                competition TEXT NOT NULL,
+                bookmakers TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                result TEXT,
+                collected INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                done REAL
+            );
+            CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, sweep);
+            CREATE TABLE IF NOT EXISTS workers (
+                name TEXT PRIMARY KEY,
+                heartbeat REAL NOT NULL,
+                sessions TEXT,
+                tasks_done INTEGER NOT NULL DEFAULT 0
+            );
+            """
+        )
+
+    @classmethod
+    def from_config(cls, config):
+        """Instantiate the queue with the CLUSTER section of config.json"""
+        config_cluster = config.get("CLUSTER", {})
+        return cls(
+            config_cluster.get("queue", DEFAULT_QUEUE_PATH),
+            lease=config_cluster.get("lease", DEFAULT_LEASE),
+            max_attempts=config_cluster.get("max_attempts", DEFAULT_MAX_ATTEMPTS),
+        )
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def submit(self, tasks):
+        """
+        Add the tasks of a new sweep.
+
+        Args:
+            tasks (list): (competition, list of bookmakers) of every task.
+
+        Returns:
+            int: The number of the sweep.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            last = connection.execute("SELECT MAX(sweep) FROM tasks").fetchone()[0]
+            sweep = (last or 0) + 1
+            connection.executemany(
+                "INSERT INTO tasks (sweep, competition, bookmakers, created) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (sweep, competition, json.dumps(bookmakers), now)
+                    for competition, bookmakers in tasks
+                ],
+            )
+        metrics.inc("cluster_tasks_total", len(tasks), state="submitted")
+        return sweep
+
+    def claim(self, worker, held=()):
+        """
+        Lease the next task to a worker: a pending task, or a leased one whose
+        worker stopped its heartbeat. The tasks whose session the worker already
+        holds come first.
+
+        Args:
+            worker (str): Name of the worker.
+            held (list): The keys of the sessions of the worker, a competition or
+                the tabs of a competition (see driver_pool.session_key).
+
+        Returns:
+            dict: id, sweep, competition and bookmakers of the task, None if there
+            is nothing to do.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            self._beat(connection, worker, now, held)
+            rows = connection.execute(
+                "SELECT id, competition, bookmakers, state, worker, attempts "
+                "FROM tasks WHERE state = ? OR (state = ? AND lease_until < ?) "
+                "ORDER BY id",
+                (PENDING, LEASED, now),
+            ).fetchall()
+            # A task leased too many times kills its workers, give it up
+            given_up = [i for i in rows if i[5] >= self.max_attempts]
+            for task_id, competition, _, _, _, attempts in given_up:
+                connection.execute(
+                    "UPDATE tasks SET state = ?, error = ? WHERE id = ?",
+                    (FAILED, f"given up after {attempts} attempts", task_id),
+                )
+                logger.error(f"{competition} - task {task_id} given up")
+            rows = [i for i in rows if i[5] < self.max_attempts]
+            if not rows:
+                return None
+            row = next(
+                (
+                    i
+                    for i in rows
+                    if i[1] in held or f"{i[1]}.{'+'.join(json.loads(i[2]))}" in held
+                ),
+                rows[0],
+            )
+            task_id, competition, bookmakers, state, previous, _ = row
+            connection.execute(
+                "UPDATE tasks SET state = ?, worker = ?, lease_until = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (LEASED, worker, now + self.lease, task_id),
+            )
+            sweep = connection.execute(
+                "SELECT sweep FROM tasks WHERE id = ?", (task_id,)
+            ).fetchone()[0]
+        if given_up:
+            metrics.inc("cluster_tasks_total", len(given_up), state=FAILED)
+        if state == LEASED:
+            logger.warning(
+                f"{competition} - task {task_id} reassigned from {previous} to {worker}"
+            )
+            metrics.inc("cluster_tasks_reassigned_total", competition=competition)
+        return {
+            "id": task_id,
+            "sweep": sweep,
+            "competition": competition,
+            "bookmakers": json.loads(bookmakers),
+        }
+
+    def _beat(self, connection, worker, now, held):
+        connection.execute(
+            "INSERT INTO workers (name, heartbeat, sessions) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET heartbeat = excluded.heartbeat, "
+            "sessions = excluded.sessions",
+            (worker, now, json.dumps(list(held))),
+        )
+
+    def heartbeat(self, worker, task_id=None, held=()):
+        """
+        Tell the queue a worker is alive and renew the lease of its task.
+
+        Returns:
+            bool: False if the task was reassigned in the meantime.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            self._beat(connection, worker, now, held)
+            if task_id is None:
+                return True
+            cursor = connection.execute(
+                "UPDATE tasks SET lease_until = ? "
+                "WHERE id = ? AND worker = ? AND state = ?",
+                (now + self.lease, task_id, worker, LEASED),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, task_id, worker, quotes):
+        """
+        Store the raw quotes read by a worker.
+
+        Args:
+            task_id (int): The task.
+            worker (str): Name of the worker.
+            quotes (dict): The raw quotes of each bookmaker of the task.
+
+        Returns:
+            bool: False if the task was reassigned, its quotes are dropped.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE tasks SET state = ?, result = ?, done = ? "
+                "WHERE id = ? AND worker = ? AND state = ?",
+                (DONE, json.dumps(quotes), now, task_id, worker, LEASED),
+            )
+            if cursor.rowcount == 1:
+                connection.execute(
+                    "UPDATE workers SET tasks_done = tasks_done + 1 WHERE name = ?",
+                    (worker,),
+                )
+        if cursor.rowcount != 1:
+            logger.warning(f"task {task_id} of {worker} was reassigned - dropped")
+            return False
+        metrics.inc("cluster_tasks_total", state=DONE)
+        return True
+
+    def fail(self, task_id, worker, error):
+        """Put a task back in the queue, or give it up after max_attempts"""
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "worker = NULL, lease_until = NULL, error = ? "
+                "WHERE id = ? AND worker = ? AND state = ?",
+                (self.max_attempts, FAILED, PENDING, error, task_id, worker, LEASED),
+            )
+        metrics.inc("cluster_task_errors_total")
+
+    def remaining(self, sweep):
+        """Return the number of tasks of a sweep not done yet"""
+        with self._lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM tasks WHERE sweep = ? AND state IN (?, ?)",
+                (sweep, PENDING, LEASED),
+            ).fetchone()[0]
+
+    def collect(self, sweep):
+        """
+        Return the finished tasks of a sweep not collected yet, with their state
+        and the raw quotes of the done ones.
+        """
+        with self._transaction() as connection:
+            rows = connection.execute(
+                "SELECT id, competition, bookmakers, state, result FROM tasks "
+                "WHERE sweep = ? AND state IN (?, ?, ?) AND collected = 0 "
+                "ORDER BY id",
+                (sweep, DONE, FAILED, CANCELLED),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE tasks SET collected = 1 WHERE id = ?", [(i[0],) for i in rows]
+            )
+        return [
+            {
+                "id": task_id,
+                "competition": competition,
+                "bookmakers": json.loads(bookmakers),
+                "state": state,
+                "quotes": json.loads(result) if result else {},
+            }
+            for task_id, competition, bookmakers, state, result in rows
+        ]
+
+    def cancel(self, sweep):
+        """Cancel the tasks of a sweep not done yet, return their number"""
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE tasks SET state = ? WHERE sweep = ? AND state IN (?, ?)",
+                (CANCELLED, sweep, PENDING, LEASED),
+            )
+        if cursor.rowcount:
+            metrics.inc("cluster_tasks_total", cursor.rowcount, state=CANCELLED)
+        return cursor.rowcount
+
+    def purge(self, sweep, keep=DEFAULT_KEEP_SWEEPS):
+        """Delete the tasks - and their quotes - of the sweeps before the last ones"""
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM tasks WHERE sweep <= ?", (sweep - keep,))
+
+    def workers(self):
+        """Return the workers with the age of their heartbeat and their sessions"""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT name, heartbeat, sessions, tasks_done FROM workers"
+            ).fetchall()
+        now = time.time()
+        return pd.DataFrame(
+            [
+                [name, now - heartbeat, now - heartbeat < self.lease, sessions, done]
+                for name, heartbeat, sessions, done in rows
+            ],
+            columns=["worker", "heartbeat_age", "alive", "sessions", "tasks_done"],
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Methods of the queue the workers call over the network
+REMOTE_METHODS = ("claim", "heartbeat", "complete", "fail")
+
+
+def parse_address(address):
+    """Split "host:port" into (host, port)"""
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+class QueueServer:
+    """
+    Serve the claim, heartbeat, complete and fail methods of a TaskQueue to the
+    workers of other hosts: one JSON request per line,
+    {"method": "claim", "args": [...]}, answered by {"result": ...} or
+    {"error": ...}.
+
+    Args:
+        queue (TaskQueue): The queue of the coordinator.
+        address (str): "host:port" to listen on.
+    """
+
+    def __init__(self, queue, address):
+        self.queue = queue
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(handler):
+                for line in handler.rfile:
+                    handler.wfile.write((self.answer(line) + "\n").encode())
+
+        self.server = socketserver.ThreadingTCPServer(
+            parse_address(address), Handler, bind_and_activate=False
+        )
+        self.server.daemon_threads = True
+        self.server.allow_reuse_address = True
+        self.server.server_bind()
+        self.server.server_activate()
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def answer(self, line):
+        try:
+            request = json.loads(line)
+            if request.get("method") not in REMOTE_METHODS:
+                raise ValueError(f"unknown method {request.get('method')}")
+            method = getattr(self.queue, request["method"])
+            return json.dumps({"result": method(*request.get("args", []))})
+        # The error goes back to the worker
+        except Exception as err:
+            logger.exception("queue request failed")
+            return json.dumps({"error": f"{type(err).__name__}: {err}"})
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="queue server", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"queue served on {self.address}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class RemoteQueue:
+    """
+    The TaskQueue of a coordinator seen from a worker of another host, through
+    its QueueServer. A connection is opened per call so a restart of the
+    coordinator is transparent.
+
+    Args:
+        address (str): "host:port" of the QueueServer.
+        timeout (float): Timeout of a call (in seconds).
+    """
+
+    def __init__(self, address, timeout=30):
+        self.address = parse_address(address)
+        self.timeout = timeout
+
+    def _call(self, method, *args):
+        with socket.create_connection(self.address, timeout=self.timeout) as sock:
+            sock.sendall((json.dumps({"method": method, "args": args}) + "\n").encode())
+            with sock.makefile("rb") as f:
+                answer = json.loads(f.readline())
+        if "error" in answer:
+            raise RuntimeError(f"queue {method} failed - {answer['error']}")
+        return answer["result"]
+
+    def claim(self, worker, held=()):
+        return self._call("claim", worker, list(held))
+
+    def heartbeat(self, worker, task_id=None, held=()):
+        return self._call("heartbeat", worker, task_id, list(held))
+
+    def complete(self, task_id, worker, quotes):
+        return self._call("complete", task_id, worker, quotes)
+
+    def fail(self, task_id, worker, error):
+        return self._call("fail", task_id, worker, error)
+
+    def close(self):
+        pass
+
+
+def get_queue(config, connect=None):
+    """Return the queue of the CLUSTER section, or the one served at connect"""
+    if connect is not None:
+        return RemoteQueue(connect)
+    return TaskQueue.from_config(config)
+
+
+class ClusterWorker:
+    """
+    Claim the tasks of the queue, read their tabs on a local DriverPool and send
+    the raw rows back. The worker keeps at most max_sessions chrome sessions: the
+    tasks of the sessions it already holds come first, and the least recently
+    used session is released before a new one is launched. With the "tab" split a
+    session only opens the tabs of its task. A heartbeat thread renews the lease
+    of the running task.
+
+    Args:
+        config (dict): The parsed config.json.
+        queue (TaskQueue or RemoteQueue): The queue of the coordinator.
+        name (str, optional): Name of the worker, "<host>-<pid>" if None.
+        max_sessions (int): Maximum number of chrome sessions.
+        poll (float): Time between two claims when the queue is empty (in seconds).
+        lease (float): Lease of the queue, the heartbeat runs 3 times per lease.
+        split (str): The split of the coordinator, "tab" to open a session per
+            task instead of per competition.
+    """
+
+    def __init__(
+        self,
+        config,
+        queue,
+        name=None,
+        max_sessions=DEFAULT_MAX_SESSIONS,
+        poll=DEFAULT_POLL,
+        lease=DEFAULT_LEASE,
+        split="competition",
+    ):
+        # The browser is only needed by the workers
+        from driver_pool import DriverPool
+        from main import get_kambi_fetcher
+        from readiness import ReadinessTracker
+
+        self.config = config
+        self.queue = queue
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.max_sessions = max_sessions
+        self.poll = poll
+        self.lease = lease
+        if split not in SPLITS:
+            raise ValueError(f"Unknown split {split}, expected one of {SPLITS}")
+        self.split = split
+        # The sessions of a worker are its own: adopting the ones registered in
+        # driver_location.json would quit the browsers of other processes once
+        # released to make room
+        config_pool = {**config.get("DRIVER_POOL", {}), "driver_location": None}
+        self.pool = DriverPool.from_config({**config, "DRIVER_POOL": config_pool})
+        self.kambi = get_kambi_fetcher(config)
+        self.readiness = ReadinessTracker.from_config(config)
+        # session key -> time.monotonic() of its last task
+        self.last_used = {}
+        self.task_id = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_config(cls, config, queue, name=None):
+        """Instantiate the worker with the CLUSTER section of config.json"""
+        config_cluster = config.get("CLUSTER", {})
+        return cls(
+            config,
+            queue,
+            name=name,
+            max_sessions=config_cluster.get("max_sessions", DEFAULT_MAX_SESSIONS),
+            poll=config_cluster.get("poll", DEFAULT_POLL),
+            lease=config_cluster.get("lease", DEFAULT_LEASE),
+            split=config_cluster.get("split", "competition"),
+        )
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease / 3):
+            try:
+                task_id = self.task_id
+                if not self.queue.heartbeat(
+                    self.name, task_id, list(self.pool.sessions)
+                ):
+                    logger.warning(f"task {task_id} lost its lease")
+            # The next beat may go through
+            except Exception:
+                logger.exception("heartbeat failed")
+
+    def make_room(self, key):
+        """Release the least recently used sessions above max_sessions"""
+        held = [i for i in self.pool.sessions if i != key]
+        while held and len(held) >= self.max_sessions:
+            oldest = min(held, key=lambda i: self.last_used.get(i, 0))
+            self.pool.release(oldest)
+            held.remove(oldest)
+
+    def run_task(self, task):
+        """Read the tabs of a task and send their raw rows to the queue"""
+        from main import get_competition_quotes
+        from driver_pool import session_key
+
+        competition = task["competition"]
+        # With the "tab" split the session only holds the tabs of the task
+        names = task["bookmakers"] if self.split == "tab" else None
+        key = session_key(competition, names)
+        self.task_id = task["id"]
+        start = time.perf_counter()
+        try:
+            self.make_room(key)
+            driver = self.pool.get(competition, names)
+            # The tabs are located by their position in the urls of the session
+            urls = {
+                **self.config["URLS"],
+                competition: self.pool.urls(competition, names),
+            }
+            with metrics.labels(competition=competition):
+                dict_quotes = get_competition_quotes(
+                    competition,
+                    driver,
+                    {**self.config, "URLS": urls},
+                    self.kambi,
+                    names=task["bookmakers"],
+                    readiness=self.readiness,
+                )
+            self.last_used[key] = time.monotonic()
+            self.queue.complete(task["id"], self.name, dict_quotes)
+            logger.info(
+                f"{competition} - task {task['id']} done in "
+                f"{time.perf_counter() - start:.2f}s"
+            )
+        # The task goes back to the queue for another attempt
+        except Exception as err:
+            logger.exception(f"{competition} - task {task['id']} failed")
+            self.queue.fail(task["id"], self.name, f"{type(err).__name__}: {err}")
+        finally:
+            self.task_id = None
+
+    def run_forever(self):
+        """Claim and run the tasks until stop() is called or the process is interrupted"""
+        heartbeat = threading.Thread(
+            target=self._heartbeat, name="heartbeat", daemon=True
+        )
+        heartbeat.start()
+        logger.info(f"worker {self.name} started")
+        try:
+            while not self._stop.is_set():
+                try:
+                    task = self.queue.claim(self.name, list(self.pool.sessions))
+                # The coordinator may be restarting
+                except (OSError, RuntimeError, sqlite3.Error) as err:
+                    logger.warning(f"claim failed - {err}")
+                    task = None
+                if task is None:
+                    self._stop.wait(self.poll)
+                    continue
+                self.run_task(task)
+        except KeyboardInterrupt:
+            logger.info("worker interrupted")
+        self._stop.set()
+        self.pool.close()
+        if self.kambi is not None:
+            self.kambi.close()
+        logger.info(f"worker {self.name} stopped")
+
+    def stop(self):
+        self._stop.set()
+
+
+class Coordinator:
+    """
+    Submit a sweep of tasks every interval seconds and gather the raw rows of the
+    workers. Each bookmaker is standardized - and passed to the alerts - as soon as
+    its task is done, then the competitions are concatenated and stored at the end
+    of the sweep, as extract_all_competitions does on a single host. The tasks not
+    done after sweep_timeout are cancelled and their bookmakers reported as failed.
+    With a SiteHealth the tabs waiting for their backoff are not submitted and the
+    reads of the others are recorded.
+
+    Args:
+        config (dict): The parsed config.json.
+        queue (TaskQueue): The queue of the tasks.
+        competitions (list): The competitions to extract.
+        team_index (TeamIndex): The index of the team names of every website.
+        store (OddsStore): The storage of the quotes.
+        alerts (AlertEngine, optional): The engine evaluating the arbitrages.
+        interval (float): Time between the start of two sweeps (in seconds).
+        sweep_timeout (float): Maximum time of a sweep (in seconds).
+        split (str): "competition" for a task per competition, "tab" for a task
+            per competition and bookmaker.
+        poll (float): Time between two checks of the queue (in seconds).
+        health (SiteHealth, optional): The backoff and circuit breaker of every tab.
+    """
+
+    def __init__(
+        self,
+        config,
+        queue,
+        competitions,
+        team_index,
+        store,
+        alerts=None,
+        interval=DEFAULT_INTERVAL,
+        sweep_timeout=DEFAULT_SWEEP_TIMEOUT,
+        split="competition",
+        poll=DEFAULT_POLL,
+        health=None,
+    ):
+        if split not in SPLITS:
+            raise ValueError(f"Unknown split {split}, expected one of {SPLITS}")
+        self.config = config
+        self.queue = queue
+        self.competitions = competitions
+        self.team_index = team_index
+        self.store = store
+        self.alerts = alerts
+        self.interval = interval
+        self.sweep_timeout = sweep_timeout
+        self.split = split
+        self.poll = poll
+        self.health = health
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_config(
+        cls, config, queue, competitions, team_index, store, alerts=None, health=None
+    ):
+        """Instantiate the coordinator with the CLUSTER section of config.json"""
+        config_cluster = config.get("CLUSTER", {})
+        return cls(
+            config,
+            queue,
+            competitions,
+            team_index,
+            store,
+            alerts=alerts,
+            interval=config_cluster.get("interval", DEFAULT_INTERVAL),
+            sweep_timeout=config_cluster.get("sweep_timeout", DEFAULT_SWEEP_TIMEOUT),
+            split=config_cluster.get("split", "competition"),
+            poll=config_cluster.get("poll", DEFAULT_POLL),
+            health=health,
+        )
+
+    def tasks(self):
+        """Return the (competition, bookmakers) of the tasks of a sweep"""
+        urls = {}
+        for competition in self.competitions:
+            names = list(self.config["URLS"][competition])
+            if self.health is not None:
+                # The workers read a probed tab as any other one
+                names = [i for i in names if self.health.allow(competition, i)]
+            if names:
+                urls[competition] = names
+        if self.split == "tab":
+            return [(i, [name]) for i, names in urls.items() for name in names]
+        return list(urls.items())
+
+    def gather(self, sweep, dict_quotes, dict_quotes_std):
+        """Standardize the quotes of the tasks finished since the last call"""
+        from main import standardize_on_read
+
+        for task in self.queue.collect(sweep):
+            competition = task["competition"]
+            if task["state"] != DONE:
+                logger.warning(
+                    f"{competition} - task {task['id']} {task['state']} - "
+                    f"{', '.join(task['bookmakers'])} not extracted"
+                )
+                for name in task["bookmakers"]:
+                    dict_quotes[competition][name] = []
+                continue
+            on_quotes = standardize_on_read(
+                competition, self.config, dict_quotes_std[competition], self.alerts
+            )
+            for name, quotes in task["quotes"].items():
+                dict_quotes[competition][name] = quotes
+                with metrics.labels(competition=competition):
+                    on_quotes(name, quotes)
+
+    def sweep(self):
+        """Run one sweep: submit, wait for the workers, concatenate and store"""
+        from data_handling import concatenate_quotes
+        from arbitrage import get_markets
+        from main import UNRESOLVED_PATH, write_quotes
+        from row_parser import QUARANTINE
+
+        now = datetime.now()
+        start = time.perf_counter()
+        tasks = self.tasks()
+        sweep = self.queue.submit(tasks)
+        dict_quotes = {i: {} for i in self.competitions}
+        dict_quotes_std = {i: {} for i in self.competitions}
+        deadline = time.monotonic() + self.sweep_timeout
+        while True:
+            remaining = self.queue.remaining(sweep)
+            self.gather(sweep, dict_quotes, dict_quotes_std)
+            if remaining == 0:
+                break
+            if time.monotonic() > deadline or self._stop.is_set():
+                cancelled = self.queue.cancel(sweep)
+                logger.warning(f"sweep {sweep} - {cancelled} tasks cancelled")
+                self.gather(sweep, dict_quotes, dict_quotes_std)
+                break
+            self._stop.wait(self.poll)
+
+        if self.health is not None:
+            for competition, names in tasks:
+                self.health.record(competition, names, dict_quotes[competition])
+        list_quotes = []
+        for competition in self.competitions:
+            # Keep the order of the config so the columns keep the same order
+            names = list(self.config["URLS"][competition])
+            std = dict_quotes_std[competition]
+            with metrics.labels(competition=competition):
+                df_quotes = concatenate_quotes(
+                    {i: std[i] for i in names if i in std},
+                    self.team_index,
+                    get_markets(self.config),
+                )
+            df_quotes.insert(0, "competition", competition)
+            list_quotes.append(df_quotes)
+
+        write_quotes(self.store, pd.concat(list_quotes, axis=0), now)
+        QUARANTINE.write()
+        self.team_index.write_unresolved(UNRESOLVED_PATH)
+        self.queue.purge(sweep)
+        elapsed = time.perf_counter() - start
+        metrics.observe("sweep_seconds", elapsed)
+        logger.info(f"timing - sweep {sweep}: {elapsed:.2f}s")
+        return sweep
+
+    def run_forever(self):
+        """Run the sweeps until stop() is called or the process is interrupted"""
+        logger.info(f"coordinator started with {len(self.competitions)} competitions")
+        try:
+            while not self._stop.is_set():
+                start = time.monotonic()
+                self.sweep()
+                workers = self.queue.workers()
+                metrics.set_gauge("cluster_workers_alive", int(workers["alive"].sum()))
+                logger.info(f"workers\n{workers.to_string(index=False)}")
+                self._stop.wait(max(self.interval - (time.monotonic() - start), 0))
+        except KeyboardInterrupt:
+            logger.info("coordinator interrupted")
+        logger.info("coordinator stopped")
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,293 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import pandas as pd
+
+import logger as log
+import metrics
+from arbitrage import get_markets
+from odds_book import OddsBook
+from row_parser import QUARANTINE
+from main import (
+    DEFAULT_MAX_WORKERS,
+    UNRESOLVED_PATH,
+    get_competition_quotes,
+    standardize_on_read,
+    keep_on_unchanged,
+    write_quotes,
+)
+
+logger = log.get_logger("daemon")
+
+# Refresh interval of a tab if nothing is set in config (in seconds)
+DEFAULT_INTERVAL = 60
+
+
+def get_interval(intervals, competition, bookmaker, default=DEFAULT_INTERVAL):
+    """
+    Get the refresh interval of one tab from the DAEMON.intervals config.
+    "<competition>.<bookmaker>" takes precedence over "<bookmaker>" which takes
+    precedence over "<competition>".
+    """
+    for key in (f"{competition}.{bookmaker}", bookmaker, competition):
+        if key in intervals:
+            return intervals[key]
+    return default
+
+
+class PollingDaemon:
+    """
+    Resident extraction loop. The drivers, the config and the keys are loaded
+    once, then each (competition, bookmaker) tab is re-extracted on its own
+    interval. All the tabs which are due are read in one sweep, a sweep never
+    starts while another one is running.
+
+    Args:
+        config (dict): The parsed config.json.
+        pool (DriverPool): The pool handing out the driver of each competition.
+        competitions (list): The competitions to extract.
+        team_index (TeamIndex): The index of the team names of every website.
+        store (OddsStore): The storage where the quotes of each sweep are appended.
+        kambi (KambiFetcher, optional): The fetcher of the Kambi websites.
+        readiness (ReadinessTracker, optional): The time-to-ready of every website,
+            its timeouts are learned over the sweeps.
+        alerts (AlertEngine, optional): The engine alerting on the arbitrages as
+            soon as the prices of a tab are read.
+        changes (ChangeTracker, optional): Skip the tabs whose rows did not change
+            since their last full read, their cached quotes are reused.
+        health (SiteHealth, optional): Skip the failing tabs until their backoff
+            is over and probe the ones whose circuit is open.
+    """
+
+    def __init__(
+        self,
+        config,
+        pool,
+        competitions,
+        team_index,
+        store,
+        kambi=None,
+        readiness=None,
+        alerts=None,
+        changes=None,
+        health=None,
+    ):
+        self.config = config
+        self.pool = pool
+        self.competitions = competitions
+        self.team_index = team_index
+        self.store = store
+        self.kambi = kambi
+        self.readiness = readiness
+        self.alerts = alerts
+        self.changes = changes
+        self.health = health
+
+        config_daemon = config.get("DAEMON", {})
+        default = config_daemon.get("default_interval", DEFAULT_INTERVAL)
+        intervals = config_daemon.get("intervals", {})
+        self.max_workers = config.get("EXTRACTION", {}).get(
+            "max_workers", DEFAULT_MAX_WORKERS
+        )
+
+        # Interval and next due time (time.monotonic) of every tab
+        self.intervals = {}
+        self.next_due = {}
+        start = time.monotonic()
+        for competition in competitions:
+            for bookmaker in config["URLS"][competition]:
+                key = (competition, bookmaker)
+                self.intervals[key] = get_interval(
+                    intervals, competition, bookmaker, default
+                )
+                self.next_due[key] = start
+
+        # Last standardized quotes of every tab, a tab is standardized once read
+        self.std_quotes = {competition: {} for competition in competitions}
+        # Prices of every tab, the quotes of a competition are exported from it
+        # instead of concatenating the standardized quotes of all its tabs
+        self.book = OddsBook(get_markets(config), team_index)
+        # Last concatenated quotes of every competition
+        self.df_quotes = {}
+        self._sweep_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def due_tabs(self, now):
+        """Return the tabs to extract grouped by competition"""
+        due = {}
+        for (competition, bookmaker), next_due in self.next_due.items():
+            if next_due <= now:
+                due.setdefault(competition, []).append(bookmaker)
+        return due
+
+    def reschedule(self, competition, bookmaker, now):
+        """
+        Set the next due time of a tab. If the sweep has overrun one or more
+        intervals the missed runs are not replayed: the tab is due right away
+        and keeps its cadence afterwards.
+        """
+        key = (competition, bookmaker)
+        next_due = self.next_due[key] + self.intervals[key]
+        if next_due <= now:
+            missed = int((now - next_due) // self.intervals[key]) + 1
+            logger.warning(
+                f"{competition} - {bookmaker} overrun, {missed} refresh skipped"
+            )
+            next_due = now
+        self.next_due[key] = next_due
+
+    def extract_tabs(self, competition, bookmakers, now):
+        """
+        Extract some tabs of a competition then export its quotes from the book,
+        which still holds the prices of the other tabs.
+
+        Returns:
+            tuple: (DataFrame of all quotes, DataFrame of the failed urls, elapsed seconds)
+        """
+        start = time.perf_counter()
+        # The pool recycles the driver if it is dead or wedged
+        with metrics.labels(competition=competition):
+            dict_quotes = get_competition_quotes(
+                competition,
+                self.pool.get(competition),
+                self.config,
+                self.kambi,
+                names=bookmakers,
+                readiness=self.readiness,
+                on_quotes=standardize_on_read(
+                    competition,
+                    self.config,
+                    self.std_quotes[competition],
+                    self.alerts,
+                    self.book,
+                ),
+                changes=self.changes,
+                on_unchanged=keep_on_unchanged(
+                    competition, self.std_quotes[competition], self.alerts
+                ),
+                health=self.health,
+                cached=self.std_quotes[competition],
+            )
+        failed_urls = [
+            [competition, name, now]
+            for name, quotes in dict_quotes.items()
+            if len(quotes) == 0
+        ]
+        df_failed = pd.DataFrame(
+            failed_urls, columns=["competition", "website", "date"]
+        )
+
+        # No tab changed, the quotes of the last sweep are still valid
+        if not dict_quotes and competition in self.df_quotes:
+            return self.df_quotes[competition], df_failed, time.perf_counter() - start
+
+        # Keep the order of the config so the columns keep the same order
+        df_quotes = self.book.to_frame(
+            competition, bookmakers=list(self.config["URLS"][competition])
+        )
+        df_quotes.insert(0, "competition", competition)
+        self.df_quotes[competition] = df_quotes
+
+        return df_quotes, df_failed, time.perf_counter() - start
+
+    def sweep(self, due):
+        """
+        Extract all the due tabs, one worker per competition, and write the result.
+        Returns False without doing anything if a sweep is already running.
+        """
+        if not self._sweep_lock.acquire(blocking=False):
+            logger.warning("a sweep is already running")
+            return False
+        try:
+            now = datetime.now()
+            sweep_start = time.perf_counter()
+            failed = 0
+            list_quotes = []
+            with ThreadPoolExecutor(
+                max_workers=max(1, min(self.max_workers, len(due)))
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        self.extract_tabs, competition, bookmakers, now
+                    ): competition
+                    for competition, bookmakers in due.items()
+                }
+                for future in as_completed(futures):
+                    competition = futures[future]
+                    try:
+                        df_quotes, df_failed, elapsed = future.result()
+                    except Exception:
+                        logger.exception(f"extraction failed for {competition}")
+                        continue
+                    list_quotes.append(df_quotes)
+                    failed += df_failed.shape[0]
+                    logger.info(
+                        f"timing - {competition}: {elapsed:.2f}s "
+                        f"for {len(due[competition])} tabs"
+                    )
+
+            # The tabs are scheduled from the end of the sweep
+            end = time.monotonic()
+            for competition, bookmakers in due.items():
+                for bookmaker in bookmakers:
+                    self.reschedule(competition, bookmaker, end)
+            sweep_elapsed = time.perf_counter() - sweep_start
+            metrics.observe("sweep_seconds", sweep_elapsed)
+            logger.info(
+                f"timing - sweep: {sweep_elapsed:.2f}s "
+                f"for {sum(len(i) for i in due.values())} tabs, {failed} failed"
+            )
+
+            # Only the competitions extracted in this sweep are appended
+            if list_quotes:
+                write_quotes(self.store, pd.concat(list_quotes, axis=0), now)
+            QUARANTINE.write()
+            self.team_index.write_unresolved(UNRESOLVED_PATH)
+        finally:
+            self._sweep_lock.release()
+        return True
+
+    def run_forever(self, max_sleep=1.0):
+        """
+        Run the sweeps until stop() is called or the process is interrupted.
+
+        Args:
+            max_sleep (float): Maximum time between two checks of the schedule (in seconds).
+        """
+        if not self.next_due:
+            logger.error("no tab to extract - daemon not started")
+            return
+        logger.info(f"daemon started with {len(self.next_due)} tabs")
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                due = self.due_tabs(now)
+                if due:
+                    self.sweep(due)
+                    continue
+                # Sleep until the next tab is due
+                wait = min(self.next_due.values()) - now
+                self._stop.wait(min(max(wait, 0), max_sleep))
+        except KeyboardInterrupt:
+            logger.info("daemon interrupted")
+        logger.info(f"driver sessions\n{self.pool.stats().to_string(index=False)}")
+        if self.readiness is not None:
+            logger.info(
+                f"time-to-ready\n{self.readiness.stats().to_string(index=False)}"
+            )
+        if self.health is not None:
+            df_health = self.health.stats()
+            logger.info(
+                f"failing tabs\n"
+                f"{df_health[df_health['failures'] > 0].to_string(index=False)}"
+            )
+        if self.changes is not None:
+            logger.info(
+                f"unchanged tabs\n{self.changes.stats().to_string(index=False)}"
+            )
+        logger.info("daemon stopped")
+
+    def stop(self):
+        """Ask run_forever to return after the running sweep"""
+        self._stop.set()
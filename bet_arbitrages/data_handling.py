@@ -1,25 +1,78 @@
+import time
 import pandas as pd
 import numpy as np
 import logger as log
+import metrics
+from team_index import TeamIndex
+from row_parser import get_parser
+from arbitrage import DEFAULT_MARKETS, add_margins, arbitrage_kernel
 
 logger = log.get_logger("data handling")
 
-def standardize_quotes(dict_quotes, col_locators):
+
+def parse_odds(df):
+    """
+    Convert columns of quotes as text ("1.45", "1,45", None...) to float.
+    Anything which is not a number becomes NaN.
+
+    Args:
+        df (DataFrame): The quote columns.
+
+    Returns:
+        DataFrame: The same columns as float.
+    """
+    # Fast path - every quote is already a valid number
+    try:
+        return df.astype(float)
+    except (TypeError, ValueError):
+        pass
+    # Comma as decimal separator or text instead of a quote
+    return df.apply(
+        lambda col: pd.to_numeric(
+            col.astype(str).str.replace(",", ".", regex=False), errors="coerce"
+        )
+    ).astype(float)
+
+
+def compute_margin(df, outcomes_cols):
+    """
+    Compute the margin of a surebet for each row: the sum over the outcomes of the
+    inverse of the best quote. A margin below 1 is an arbitrage.
+
+    Args:
+        df (DataFrame): The quotes as float.
+        outcomes_cols (list): One list of quote columns for each outcome.
+
+    Returns:
+        numpy.ndarray: The margin of each row.
+    """
+    # Each outcome can be quoted by a different number of bookmakers
+    width = max([len(cols) for cols in outcomes_cols] + [1])
+    prices = np.full((len(df), width, len(outcomes_cols)), np.nan)
+    for j, cols in enumerate(outcomes_cols):
+        prices[:, : len(cols), j] = df[cols].to_numpy(dtype=float)
+    _, _, margin, _ = arbitrage_kernel(prices)
+    return margin
+
+
+def standardize_quotes(dict_quotes, col_locators, now=None):
     """
-    Standardizes a dictionary of raw quote (lists) by selecting and renaming columns according to
-    the specified locators in `col_locators`. The resulting dataframes will have standardized column
-    names of the form "<name>_<colname>" and will only include rows with valid quotes.
+    Standardizes a dictionary of raw quote (lists) with the row parser of each website.
+    The resulting dataframes will have standardized column names of the form
+    "<name>_<colname>" and will only include rows with valid quotes. The rows which can
+    not be read are quarantined with their raw text instead of dropping the website.
 
     Args:
-        dict_quotes (dict): A dictionary of raw quote dataframes, where the keys are website names and
-            the values are the corresponding dataframes.
+        dict_quotes (dict): A dictionary of raw quotes, where the keys are website names and
+            the values are the rows split in cells.
         col_locators (dict): A dictionary of column locators, where the keys are website names and the
-            values are lists of integer indices representing the columns to select from the corresponding
-            raw dataframes.
+            values are the positions of home, away and the 3 quotes in the expected layout.
+        now (datetime, optional): Date of the read, to date the events.
 
     Returns:
         dict: A dictionary of standardized quote dataframes, where the keys are website names and the
-        values are the corresponding standardized dataframes.
+        values are the corresponding standardized dataframes. The quotes are parsed as float, the
+        "<name>_start" and "<name>_live" columns give the start of the event and if it is live.
     """
     # Create new dict to not alter the first one
     dict_quotes_sc = {}
@@ -27,91 +80,83 @@ def standardize_quotes(dict_quotes, col_locators):
     for name, li in dict_quotes.items():
 
         logger.info(f"dataframe transformation for {name}")
+        start = time.perf_counter()
         if len(li) == 0:
             logger.error(f"No data for {name}")
             continue
 
-        cols = ["home", "away", "1", "X", "2"]
-        cols = [f"{name}_{i}" for i in cols]
-
-        # Transformation to dataFrame - starcasino remove "Endirect"
-        df = pd.DataFrame([[j for j in i if j != "EN DIRECT"] for i in li])
-        # rename columns
-        try:
-            df_temp = df.iloc[:, col_locators[name]].copy()
-            df_temp.columns = cols
-        # Some websites can include the game but the quotes are not available yet
-        # Insert copy of the DF in the log to investigate
-        except IndexError as err:
-            logger.error("Data has not been parse correctly")
-            logger.error("dataframe head\n{}".format(df.head().to_string()))
-            # For now return an empty DataFrame
-            df_temp = pd.DataFrame(columns=["home", "away", "1", "X", "2"])
-
-        # drop columns without Quotes
-        del_row = df_temp[df_temp.applymap(lambda x: x is None).sum(axis=1) > 0].index
-        df_temp.drop(index=del_row, inplace=True)
-        dict_quotes_sc[name] = df_temp
+        parser = get_parser(name, col_locators.get(name))
+        dict_quotes_sc[name] = parser.parse_frame(li, now)
+        metrics.observe(
+            "standardize_seconds", time.perf_counter() - start, bookmaker=name
+        )
 
     return dict_quotes_sc
 
 
-def concatenate_quotes(dict_quotes_sc, df_keys):
+def concatenate_quotes(dict_quotes_sc, team_index, markets=None):
     """
     Gather all quotes from a dictionary of standardized quote dataframes with names as keys
     and dataframes as values into one dataframe. This function is used to merge quote data
-    from multiple sources for the same event.
+    from multiple sources for the same event. The events are matched on the canonical ids
+    of their home and away teams so no website is used as a reference.
 
     Args:
         dict_quotes_sc (dict): A dictionary of standardized quote dataframes, where the keys are
             website names and the values are the corresponding dataframes.
-        df_keys (DataFrame): A dataframe that contains the home and away team names for each
-            event, with one row for each event.
+        team_index (TeamIndex): The index mapping the team names of each website to a team id.
+            A DataFrame of the team names correspondancy is also accepted.
+        markets (dict, optional): The outcomes of each market (see get_markets),
+            DEFAULT_MARKETS if None.
 
     Returns:
         DataFrame: A dataframe that contains all quotes for all events from all sources, with
-        columns of the form "<name>_home", "<name>_away", "<name>_1", "<name>_X", "<name>_2",
-        where "<name>" is the name of the website that the quote came from.
+        columns "home_id", "away_id", "home", "away" then "<name>_<outcome>" for each declared
+        outcome, e.g. "<name>_1", "<name>_X", "<name>_2", where "<name>" is the name of the
+        website that the quote came from, and "margin" (and "margin_<market>" for the other
+        markets).
     """
-    # Go trough each dataframes in dict_quotes
-    for index, (name, df) in enumerate(dict_quotes_sc.items()):
-        # USe the first one as a basis
-        if index == 0:
-            df_allquotes = df.copy()
-            ref = name
-        elif df.shape[0] == 0:
+    markets = DEFAULT_MARKETS if markets is None else markets
+    outcomes = [outcome for market in markets.values() for outcome in market]
+    if isinstance(team_index, pd.DataFrame):
+        team_index = TeamIndex(team_index)
+    start = time.perf_counter()
+
+    # Index the quotes of each website by the ids of the teams
+    list_quotes = []
+    names = []
+    for name, df in dict_quotes_sc.items():
+        if df.shape[0] == 0:
             logger.warning(f"No quotes for {name}")
             continue
-        else:
-            # Add the Keys for home away regarding the first dataframe
-            df_temp = df.merge(
-                df_keys[[name, ref]].dropna(),
-                left_on=[name + "_home"],
-                right_on=name,
-                how="left",
-            )
-            df_temp.drop(columns=name, inplace=True)
-            df_temp = df_temp.merge(
-                df_keys[[name, ref]].dropna(),
-                left_on=[name + "_away"],
-                right_on=name,
-                suffixes=["_home", "_away"],
-                how="left",
+        home_id = team_index.resolve_many(name, df[name + "_home"])
+        away_id = team_index.resolve_many(name, df[name + "_away"])
+        resolved = (home_id.notna() & away_id.notna()).to_numpy()
+        if not resolved.all():
+            logger.warning(f"{(~resolved).sum()} events of {name} with unknown teams")
+            metrics.inc(
+                "unresolved_events_total", int((~resolved).sum()), bookmaker=name
             )
-            # Merge this dataframe with the first one
-            df_temp.drop(columns=[name, name + "_home", name + "_away"], inplace=True)
-            df_allquotes = df_allquotes.merge(df_temp, how="outer")
-
-    # Remove None
-    df_allquotes = df_allquotes.applymap(lambda x: np.NaN if x is None else x)
-    # Define cols
-    col_win = [i for i in df_allquotes.columns if "_1" in i]
-    col_drawn = [i for i in df_allquotes.columns if "_X" in i]
-    col_loose = [i for i in df_allquotes.columns if "_2" in i]
-    # Compute the min Margin if you do surebet valuation
-    df_allquotes["margin"] = (
-        1 / np.nanmax(df_allquotes[col_win].astype(float), axis=1)
-        + 1 / np.nanmax(df_allquotes[col_drawn].astype(float), axis=1)
-        + 1 / np.nanmax(df_allquotes[col_loose].astype(float), axis=1)
-    )
+        # Only the declared outcome columns are quotes
+        odds_cols = [f"{name}_{i}" for i in outcomes if f"{name}_{i}" in df.columns]
+        df_temp = df.loc[resolved, odds_cols]
+        df_temp.index = pd.MultiIndex.from_arrays(
+            [home_id[resolved].astype(int), away_id[resolved].astype(int)],
+            names=["home_id", "away_id"],
+        )
+        # The same event can only be listed once by a website
+        list_quotes.append(df_temp[~df_temp.index.duplicated()])
+        names.append(name)
+
+    if not list_quotes:
+        return pd.DataFrame(columns=["home_id", "away_id", "home", "away", "margin"])
+
+    df_allquotes = pd.concat(list_quotes, axis=1, join="outer").reset_index()
+    df_allquotes.insert(2, "home", team_index.names[df_allquotes["home_id"].to_numpy()])
+    df_allquotes.insert(3, "away", team_index.names[df_allquotes["away_id"].to_numpy()])
+
+    # Compute the min Margin of each market if you do surebet valuation
+    add_margins(df_allquotes, names, markets)
+    metrics.observe("concatenate_seconds", time.perf_counter() - start)
+    metrics.set_gauge("events", df_allquotes.shape[0])
     return df_allquotes
@@ -1,6 +1,6 @@
-import re
 from selenium import webdriver
 from selenium.webdriver.common.by import By
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.remote.errorhandler import (
     NoSuchElementException,
     TimeoutException,
@@ -11,29 +11,59 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.chrome.options import Options
 import logger as log
+import metrics
+from readiness import wait_ready
+from row_parser import ROW_SPLIT, split_row
+from fingerprint import page_fingerprint
 
 logger = log.get_logger("driver extract")
 
+# Read the text of every matching row in one WebDriver call
+BULK_TEXT_SCRIPT = """
+return Array.prototype.map.call(
+    document.querySelectorAll(arguments[0]),
+    function (el) { return el.innerText; }
+);
+"""
 
-def get_quotes(driver, url, css_selector, max_wait=15):
+
+def get_rows_bulk(driver, css_selector):
     """
-    Extracts quotes from one web page using a Selenium WebDriver.
+    Extracts the split text of every element matching css_selector in a single
+    script call. Nothing is held on the python side between the reads so a row
+    re-rendered by the website can not raise a StaleElementReferenceException.
 
     Args:
         driver (selenium.webdriver): A Selenium WebDriver object.
-        url: URL of the website to get the quote
         css_selector: the CSS Selector allowing to get the quote
-        max_wait : The maximum amount of time to wait for each page to load before giving up (in seconds).
-    
+
     Returns:
-        list of all quotes with team name etc... from the url  
+        list of all quotes split by cells
     """
-    logger.info(f"get quotes for {url}")
-    if url != driver.current_url:
-        logger.error(f"URL - {url} is not active on the driver")
-        logger.info(f"{url} - {driver.current_url}")
-        raise ValueError("URL is not active on the driver")
+    texts = driver.execute_script(BULK_TEXT_SCRIPT, css_selector)
+    return [split_row(text) for text in texts]
+
+
+def get_rows_by_element(driver, css_selector):
+    """
+    Extracts the split text of every element matching css_selector, reading
+    each element with its own WebDriver call.
+    """
+    elements = driver.find_elements_by_css_selector(css_selector)
+    return [ROW_SPLIT.split(i.text) for i in elements]
+
+
+def wait_presence(driver, url, css_selector, max_wait=15, enlarge=True):
+    """
+    Wait for the first element matching css_selector, enlarging the window if it
+    does not show up within max_wait seconds.
 
+    Args:
+        enlarge (bool): Try again for 5 seconds with a larger window.
+
+    Returns:
+        bool: True if an element was found.
+    """
     # Ensure that the element exist on the webpage - wait max_wait seconds
     try:
         driver.set_window_size(1800, 1000)
@@ -41,6 +71,9 @@ def get_quotes(driver, url, css_selector, max_wait=15):
             EC.presence_of_element_located((By.CSS_SELECTOR, css_selector))
         )
     except TimeoutException:
+        if not enlarge:
+            logger.error(f"TimeoutException")
+            return False
         logger.warning("Can not get the quote - Change window size")
         driver.set_window_size(3000, 2000)
         try:
@@ -50,16 +83,149 @@ def get_quotes(driver, url, css_selector, max_wait=15):
         except TimeoutException:
             # raise NoSuchElementException(f"Unable to get the quotes for {url}")
             logger.error(f"TimeoutException")
-            return []
+            return False
         except Exception as err:
             logger.exception(f"{err}")
-            return []
+            return False
+    return True
 
-    # find all elements regarding their CSS_SELECTORS
-    elements = driver.find_elements_by_css_selector(css_selector)
 
+def wait_rows_ready(driver, url, css_selector, readiness, site, max_wait=15):
+    """
+    Wait until the rows of the page stop changing, with the timeout learned for the
+    site. A page still showing the rows of its last read is not waited for. If no
+    row shows up the window is enlarged and the page watched once more.
+    Falls back on wait_presence if the browser can not run the script.
+
+    Returns:
+        bool: True if some rows were found.
+    """
     try:
-        return [re.split(r" - |\n", i.text) for i in elements]
+        driver.set_window_size(1800, 1000)
+        result = wait_ready(
+            driver,
+            css_selector,
+            readiness.timeout(site),
+            readiness.settle,
+            layout=readiness.layout(url),
+        )
+        if result["rows"] == 0:
+            logger.warning("Can not get the quote - Change window size")
+            driver.set_window_size(3000, 2000)
+            result = wait_ready(
+                driver, css_selector, readiness.min_timeout, readiness.settle
+            )
+    except WebDriverException as err:
+        logger.warning(f"readiness script failed for {url} - {err.msg}")
+        return wait_presence(driver, url, css_selector, max_wait)
+
+    readiness.record(
+        site,
+        result["elapsed"],
+        result["ready"],
+        url=url,
+        layout=result["layout"],
+        known=result["known"],
+    )
+    if result["rows"] == 0:
+        logger.error(f"TimeoutException")
+        return False
+    if not result["ready"]:
+        # Better some quotes than none, the next sweep reads the page again
+        logger.warning(f"{url} - rows still changing, {result['rows']} rows extracted")
+    return True
+
+
+def get_quotes(
+    driver,
+    url,
+    css_selector,
+    max_wait=15,
+    bulk=True,
+    readiness=None,
+    site=None,
+    changes=None,
+    probe=False,
+):
+    """
+    Extracts quotes from one web page using a Selenium WebDriver.
+
+    Args:
+        driver (selenium.webdriver): A Selenium WebDriver object.
+        url: URL of the website to get the quote
+        css_selector: the CSS Selector allowing to get the quote
+        max_wait : The maximum amount of time to wait for each page to load before giving up (in seconds).
+        bulk : Read all the rows in one script call, fall back on one call per element if it fails.
+        readiness (ReadinessTracker, optional): Wait until the rows stop changing
+            with the timeout learned for the site, instead of waiting for the
+            first row up to max_wait seconds.
+        site (str, optional): Name of the website, to learn its timeout.
+        changes (ChangeTracker, optional): Skip the read of the rows if their
+            fingerprint did not change since the last full read.
+
+    Returns:
+        list of all quotes with team name etc... from the url, None if the rows did
+        not change since the last full read
+    """
+    logger.info(f"get quotes for {url}")
+    if url != driver.current_url:
+        logger.error(f"URL - {url} is not active on the driver")
+        logger.info(f"{url} - {driver.current_url}")
+        raise ValueError("URL is not active on the driver")
+
+    bookmaker = site or url
+    with metrics.timer("wait_seconds", bookmaker=bookmaker):
+        if probe:
+            found = wait_presence(driver, url, css_selector, max_wait, enlarge=False)
+        elif readiness is not None:
+            found = wait_rows_ready(
+                driver, url, css_selector, readiness, bookmaker, max_wait
+            )
+        else:
+            found = wait_presence(driver, url, css_selector, max_wait)
+    if not found:
+        metrics.inc("wait_timeouts_total", bookmaker=bookmaker)
+        # The quotes of the tab are dropped, its next read must not be skipped
+        if changes is not None:
+            changes.forget(url)
+        return []
+
+    fingerprint = None
+    if changes is not None:
+        try:
+            fingerprint = page_fingerprint(driver, css_selector)
+        except WebDriverException as err:
+            logger.warning(f"fingerprint failed for {url} - {err.msg}")
+        if changes.unchanged(bookmaker, url, fingerprint):
+            return None
+
+    with metrics.timer("read_seconds", bookmaker=bookmaker):
+        rows = read_rows(driver, url, css_selector, bulk)
+    metrics.inc("rows_extracted_total", len(rows), bookmaker=bookmaker)
+    if changes is not None:
+        # A failed read is not a reference
+        if rows and fingerprint is not None:
+            changes.record(url, fingerprint)
+        else:
+            changes.forget(url)
+    return rows
+
+
+def read_rows(driver, url, css_selector, bulk=True):
+    """
+    Read the rows of a loaded page, in one script call if bulk is True with a
+    fallback on one call per element.
+    """
+    # Get all the rows in one round trip
+    if bulk:
+        try:
+            return get_rows_bulk(driver, css_selector)
+        except WebDriverException as err:
+            logger.warning(f"bulk extraction failed for {url} - {err.msg}")
+
+    # find all elements regarding their CSS_SELECTORS
+    try:
+        return get_rows_by_element(driver, css_selector)
     except StaleElementReferenceException:
         # You should refresh the driver, let's try after
         # Make it recursive maybe - or max_try = 3
@@ -67,7 +233,21 @@ def get_quotes(driver, url, css_selector, max_wait=15):
         return []
 
 
-def get_all_quotes(driver, dict_url, dict_selectors, max_wait=15):
+def get_all_quotes(
+    driver,
+    dict_url,
+    dict_selectors,
+    max_wait=15,
+    bulk=True,
+    names=None,
+    readiness=None,
+    on_quotes=None,
+    changes=None,
+    on_unchanged=None,
+    probes=None,
+    retry_stale=True,
+    cached=None,
+):
     """
     Extracts quotes from web pages using a Selenium WebDriver.
 
@@ -76,13 +256,33 @@ def get_all_quotes(driver, dict_url, dict_selectors, max_wait=15):
         dict_url (dict): A dictionary mapping page names to their URLs.
         dict_selectors (dict): A dictionary mapping page names to CSS selectors for the desired quote elements.
         max_wait (int, optional): The maximum amount of time to wait for each page to load before giving up (in seconds).
+        bulk (bool, optional): Read all the rows of a page in one script call.
+        names (iterable, optional): Only extract these page names, all of them if None.
+            The tabs are still located by the position of the page in dict_url.
+        readiness (ReadinessTracker, optional): Wait until the rows of each page stop
+            changing, with a timeout learned per page name.
+        on_quotes (callable, optional): Called with the page name and its quotes as
+            soon as a page is read, before the next page.
+        changes (ChangeTracker, optional): Skip the pages whose rows did not change
+            since their last full read.
+        on_unchanged (callable, optional): Called with the name of a skipped page.
+        probes (dict, optional): The pages to probe after some failures, mapped to
+            their maximum wait (see get_quotes).
+        retry_stale (bool, optional): Refresh and read again a page whose rows went
+            stale. If False the page is refreshed and returns no quotes, its retry
+            is left to the caller.
+        cached (container, optional): The page names whose last quotes are kept by
+            the caller. The other pages are read in full even if unchanged.
 
     Returns:
         dict: A dictionary mapping page names to DataFrames containing the extracted quotes.
+        The skipped pages are not included.
     """
     dict_quotes = {}
 
     for index, (name, url) in enumerate(dict_url.items()):
+        if names is not None and name not in names:
+            continue
         # Go to the correct window
         driver.switch_to.window(driver.window_handles[index])
         # Get the CSS selector for each url
@@ -91,19 +291,50 @@ def get_all_quotes(driver, dict_url, dict_selectors, max_wait=15):
         else:
             logger.error(f"{name} doesnt have any selector parametrized")
             continue
-        # get the quotes
-        try:
-            quotes = get_quotes(driver, url, css_selector, max_wait)
-        # refresh the page and retry if StaleElementReferenceException
-        except StaleElementReferenceException:
-            driver.refresh()
-            logger.warning("refreshing the driver")
-            quotes = get_quotes(driver, url, css_selector, max_wait)
+        probe = probes is not None and name in probes
+        # Nothing to reuse for this page, its fingerprint can not skip the read
+        if changes is not None and cached is not None and name not in cached:
+            changes.forget(url)
+        wait = probes[name] if probe else max_wait
+        # get the quotes - the log records are tagged with the website
+        with log.context(bookmaker=name):
+            try:
+                quotes = get_quotes(
+                    driver,
+                    url,
+                    css_selector,
+                    wait,
+                    bulk,
+                    readiness,
+                    name,
+                    changes,
+                    probe,
+                )
+            # refresh the page and retry if StaleElementReferenceException
+            except StaleElementReferenceException:
+                driver.refresh()
+                logger.warning("refreshing the driver")
+                metrics.inc("stale_retries_total", bookmaker=name)
+                quotes = []
+                if retry_stale:
+                    quotes = get_quotes(
+                        driver,
+                        url,
+                        css_selector,
+                        wait,
+                        bulk,
+                        readiness,
+                        name,
+                        changes,
+                        probe,
+                    )
 
         if quotes is not None:
             dict_quotes[name] = quotes
-        else:
-            logger.error(f"error while getting the quotes for {name}")
+            if on_quotes is not None:
+                on_quotes(name, quotes)
+        # The page did not change, its last quotes are still valid
+        elif on_unchanged is not None:
+            on_unchanged(name)
 
     return dict_quotes
-
@@ -1,11 +1,13 @@
+import contextlib
 import json
 import pathlib
 import os
+import time
 from urllib3.exceptions import MaxRetryError
 from selenium import webdriver
 from selenium.webdriver.chrome.webdriver import WebDriver as ChromeWebDriver
 from selenium.webdriver.common.by import By
-from selenium.common.exceptions import InvalidSessionIdException
+from selenium.common.exceptions import InvalidSessionIdException, WebDriverException
 from selenium.webdriver.remote.errorhandler import (
     NoSuchElementException,
     TimeoutException,
@@ -17,38 +19,95 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.chrome.options import Options
 import logger as log
+from supervisor import marker_flag, pid_alive
+from sites import get_adapters
 
 logger = log.get_logger("driver init")
 
+# Default location of chromedriver
+PATH_CHROME_DRIVER = "chromedriver.exe"
+if os.name != "nt":
+    PATH_CHROME_DRIVER = "/usr/local/bin/chromedriver"
 
-def expand_starcasino(driver):
+# Requests the quotes do not need: pictures, fonts, videos and trackers.
+# Style sheets and scripts are kept since the websites render the quotes with them.
+BLOCKED_EXTENSIONS = [
+    # Pictures - svg are kept, some websites draw their buttons with them
+    "png",
+    "jpg",
+    "jpeg",
+    "gif",
+    "webp",
+    "avif",
+    "ico",
+    # Fonts
+    "woff",
+    "woff2",
+    "ttf",
+    "otf",
+    "eot",
+    # Videos
+    "mp4",
+    "webm",
+    "m3u8",
+]
+# Each extension ends the url or comes before its query string (e.g. banner.png?v=3):
+# "*.gif*" would also block "/api/gifts". Some Chrome versions do not anchor the end
+# of a pattern, the query one is exact with all of them.
+DEFAULT_BLOCKED_URLS = [
+    *(j for i in BLOCKED_EXTENSIONS for j in [f"*.{i}", f"*.{i}?*"]),
+    # Ads and trackers
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*googlesyndication.com*",
+    "*facebook.net*",
+    "*connect.facebook.com*",
+    "*hotjar.com*",
+    "*criteo.com*",
+    "*criteo.net*",
+    "*taboola.com*",
+    "*outbrain.com*",
+    "*adnxs.com*",
+    "*scorecardresearch.com*",
+    "*clarity.ms*",
+    "*bing.com/bat*",
+    "*tiktok.com*",
+]
+
+
+def get_blocked_urls(config, name):
     """
-    Expend all dates on starcasino to display all quotes
+    Get the url patterns blocked on a website from the BLOCKING section of config:
+    {"enabled": true, "patterns": [... default DEFAULT_BLOCKED_URLS],
+     "sites": {"<name>": {"enabled": false, "extra": [...], "allow": [...]}}}
+    "extra" patterns are added to the default ones and "allow" patterns removed.
+
+    Returns:
+        list: The url patterns, empty if nothing is blocked on the website.
     """
-    # Go to the French Language Page
-    logger.info("Starcasino - get the french page")
-    driver.implicitly_wait(2)
-    language_button = driver.find_element_by_css_selector(
-        ".css-pe3ddf.css-pe3ddf.css-pe3ddf"
-    )
-    if language_button.text != "FR":
-        language_button.click()
-        driver.find_element_by_xpath('//li[@data-value="FR"]').click()
-
-    logger.info("expand dates on starcasino")
-    driver.implicitly_wait(2)
-    selector = "._asb_events-tree-table-node-CH--expansion-panel-title, ._asb_events-tree-table-node-DT--expansion-panel-title, ._asb_events-tree-table-node-SP--expansion-panel-title, ._asb_results-table--expansion-panel-title, ._asb_toto-jackpots-tree--expansion-panel-header"
-    els = driver.find_elements(By.CSS_SELECTOR, value=selector)
-    for i in els:
-        try:
-            i.find_element_by_css_selector(".asb-icon-arrow-down").click()
-            logger.info("found 1 elements to drag down")
-        except NoSuchElementException:
-            logger.warning("did not find any element to drag down")
-        except ElementClickInterceptedException:
-            logger.warning("Impossible to click on the element")
-        except StaleElementReferenceException:
-            logger.warning("It seems all data have been expanded - Double Check after")
+    config_blocking = config.get("BLOCKING", {})
+    config_site = config_blocking.get("sites", {}).get(name, {})
+    if not config_site.get("enabled", config_blocking.get("enabled", False)):
+        return []
+    patterns = config_blocking.get("patterns", DEFAULT_BLOCKED_URLS)
+    patterns = patterns + config_site.get("extra", [])
+    return [i for i in patterns if i not in config_site.get("allow", [])]
+
+
+def block_urls(driver, patterns):
+    """
+    Block the requests matching the url patterns ("*" wildcard) on the current tab
+    with the Chrome DevTools Protocol. It has to be done before the page is loaded.
+    """
+    if not patterns:
+        return
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    # Remote drivers do not expose the DevTools Protocol
+    except (AttributeError, WebDriverException) as err:
+        logger.warning(f"unable to block the urls - {err}")
 
 
 def set_chrome_properties(headless):
@@ -69,21 +128,29 @@ def set_chrome_properties(headless):
     # chrome_options.add_argument("--remote-debugging-port=9222")
     # Make sure it doesn't close windows when code is executed
     chrome_options.add_experimental_option("detach", True)
+    # Tag the processes with the owner so the supervisor can find the orphans
+    chrome_options.add_argument(marker_flag())
 
     return chrome_options
 
 
 def init_driver(
-    dict_url, dict_cookies, headless=False, path_chromedriver="chrome_driver.exe"
+    dict_url,
+    dict_adapters,
+    headless=False,
+    path_chromedriver="chrome_driver.exe",
+    dict_blocked=None,
 ):
     """
     Initializes a Selenium driver and opens all URLs from a dictionary in separate tabs.
-    If dict_cookies is not empty the driver will click automatically on the cookies button on the website to accept all cookies
-    If the website is "starcasino", the page will be expanded to show all available sports.
+    Each tab is then prepared by the adapter of its website in one script call: the
+    cookies are accepted and, e.g. on starcasino, the page is expanded to show all the
+    events.
 
     Args:
     - dict_url (dict): A dictionary containing the names of websites as keys and their corresponding URLs as values.
-    - dict_cookies (dict): A dictionary containing the names of websites as keys and their corresponding cookie IDs as values.
+    - dict_adapters (dict): A dictionary containing the names of websites as keys and their SiteAdapter as values (see sites.get_adapters).
+    - dict_blocked (dict, optional): A dictionary containing the names of websites as keys and the url patterns not to load on their tab as values (see get_blocked_urls).
 
     Returns:
     - driver (webdriver.Chrome): A Selenium Chrome driver object.
@@ -99,8 +166,11 @@ def init_driver(
         service_args=["--verbose", "--log-path=test.log"],
     )
 
+    dict_blocked = dict_blocked or {}
     for name, url in dict_url.items():
         logger.info(f"get {name}")
+        # The blocking is set on each tab before its page loads
+        block_urls(driver, dict_blocked.get(name))
         # Get the URL
         driver.get(url)
         # open a new tab
@@ -112,14 +182,9 @@ def init_driver(
     driver.close()
 
     for index, (name, url) in enumerate(dict_url.items()):
-        if dict_cookies.get(name) is not None:
-            logger.info(f"accept cookies {name}")
+        if name in dict_adapters:
             driver.switch_to.window(driver.window_handles[index])
-            driver.find_element(by=By.ID, value=dict_cookies[name]).click()
-
-        if name == "starcasino":
-            driver.switch_to.window(driver.window_handles[index])
-            expand_starcasino(driver)
+            dict_adapters[name].prepare(driver)
 
     logger.info(f"driver instanciated with all urls")
 
@@ -168,6 +233,150 @@ def get_driver(competition, path_driver_location="driver_location.json"):
     return driver
 
 
+@contextlib.contextmanager
+def lock_driver_location(path_driver_location="driver_location.json", timeout=10):
+    """
+    Hold the lock file of driver_location.json so one process at a time reads
+    and writes it. The lock of a process which died is taken over.
+    """
+    path_lock = f"{path_driver_location}.lock"
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path_lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                with open(path_lock) as f:
+                    holder = int(f.read() or 0)
+                age = time.time() - os.path.getmtime(path_lock)
+            except (FileNotFoundError, ValueError):
+                holder, age = 0, 0
+            # An empty file is a lock being written, the pid comes right after
+            # unless its process died in between
+            if (holder and not pid_alive(holder)) or (not holder and age > timeout):
+                logger.warning(f"stale lock of process {holder} removed")
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path_lock)
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{path_lock} held by process {holder}")
+            time.sleep(0.05)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path_lock)
+
+
+def read_driver_location(path_driver_location="driver_location.json"):
+    """Return the coordinates of the registered drivers, empty if there is no file"""
+    try:
+        with open(path_driver_location, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _dump_driver_location(dict_location, path_driver_location):
+    with open(path_driver_location, "w") as f:
+        json.dump(dict_location, f, indent=4)
+
+
+def remove_driver_location(competition, path_driver_location="driver_location.json"):
+    """Remove the coordinates of the driver of a competition, e.g. once it is closed"""
+    with lock_driver_location(path_driver_location):
+        dict_location = read_driver_location(path_driver_location)
+        if dict_location.pop(competition, None) is not None:
+            _dump_driver_location(dict_location, path_driver_location)
+
+
+def claim_driver_location(competition, path_driver_location="driver_location.json"):
+    """
+    Claim the registered driver of a competition for this process. A driver is
+    driven by one process at a time: the claim fails while the "holder" of the
+    driver is another process still running.
+
+    Returns:
+        bool: True if this process holds the driver, False if another one does or
+        if it is not registered.
+    """
+    with lock_driver_location(path_driver_location):
+        dict_location = read_driver_location(path_driver_location)
+        location = dict_location.get(competition)
+        if location is None:
+            return False
+        holder = location.get("holder")
+        if holder not in (None, os.getpid()) and pid_alive(holder):
+            logger.info(f"{competition} - driver held by process {holder}")
+            return False
+        location["holder"] = os.getpid()
+        _dump_driver_location(dict_location, path_driver_location)
+    return True
+
+
+def unclaim_driver_location(competition, path_driver_location="driver_location.json"):
+    """Give up the claim of this process on a registered driver, which stays open"""
+    with lock_driver_location(path_driver_location):
+        dict_location = read_driver_location(path_driver_location)
+        location = dict_location.get(competition)
+        if location is not None and location.get("holder") == os.getpid():
+            location["holder"] = None
+            _dump_driver_location(dict_location, path_driver_location)
+
+
+def write_driver_location(
+    competition, driver, path_driver_location="driver_location.json"
+):
+    """
+    Write the coordinates of the driver of a competition into driver_location.json
+    so get_driver can recover it from another python process. The pid of the
+    process writing it is kept as the owner of the browser, the supervisor does
+    not reap it, and as its holder, the only process driving it until it gives it
+    up (see claim_driver_location).
+
+    Returns:
+        bool: True if the driver is registered, False if the competition already
+        has a driver held by another running process.
+    """
+    # get the information from the driver and copy them to the driver_location.json
+    command_executor = driver.command_executor._url
+    session_id = driver.session_id
+    # Process of chromedriver, None for a remote driver
+    service = getattr(driver, "service", None)
+    pid = service.process.pid if service is not None else None
+
+    # Write driver coordinates into json path_driver_location
+    logger.info("Writing driver coordinates")
+    with lock_driver_location(path_driver_location):
+        try:
+            with open(path_driver_location, "r") as f:
+                dict_location = json.load(f)
+        except FileNotFoundError:
+            logger.error("Driver Location File does not exist")
+            dict_location = {}
+
+        holder = dict_location.get(competition, {}).get("holder")
+        if holder not in (None, os.getpid()) and pid_alive(holder):
+            logger.info(f"{competition} - driver held by process {holder}, not written")
+            return False
+        dict_location[competition] = {
+            "command_executor": command_executor,
+            "session_id": session_id,
+            "status": "active",
+            # The supervisor does not reap the browsers of this process
+            "owner": os.getpid(),
+            "pid": pid,
+            # The process driving the browser, see claim_driver_location
+            "holder": os.getpid(),
+        }
+        _dump_driver_location(dict_location, path_driver_location)
+    logger.info("Driver coordinates written")
+    return True
+
+
 if __name__ == "__main__":
     # when you instantiate more than 1 driver in a loop, only the last one created
     # can be recovered from another python terminal
@@ -177,9 +386,6 @@ if __name__ == "__main__":
     # Get the path of config and driver_location
     PATH_CONFIG = "config.json"
     PATH_DRIVER_LOCATION = "driver_location.json"
-    PATH_CHROME_DRIVER = "chromedriver.exe"
-    if os.name != "nt":
-        PATH_CHROME_DRIVER = "/usr/local/bin/chromedriver"
 
     # Instantiate parser
     parser = argparse.ArgumentParser(description="Launch selenium webdriver")
@@ -195,32 +401,16 @@ if __name__ == "__main__":
     # Get the parameters from config
     with open(PATH_CONFIG) as f:
         config = json.load(f)
+    log.configure(config)
     dict_url = config["URLS"][args.competition]
-    dict_cookies = config["COOKIES_REF"]
 
     # Instantiate the driver
     logger.info(f"Instantiate driver for {args.competition}")
     driver = init_driver(
-        dict_url, dict_cookies, headless=True, path_chromedriver=PATH_CHROME_DRIVER
+        dict_url,
+        get_adapters(dict_url, config),
+        headless=True,
+        path_chromedriver=PATH_CHROME_DRIVER,
+        dict_blocked={name: get_blocked_urls(config, name) for name in dict_url},
     )
-    # get the information from the driver and copy them to the driver_location.json
-    command_executor = driver.command_executor._url
-    session_id = driver.session_id
-
-    # Write driver coordinates into json PATH_DRIVER_LOCATION
-    logger.info("Writing driver coordinates")
-    try:
-        with open(PATH_DRIVER_LOCATION, "r") as f:
-            dict_location = json.load(f)
-    except FileNotFoundError:
-        logger.error("Driver Location File does not exist")
-        dict_location = {}
-
-    dict_location[args.competition] = {
-        "command_executor": command_executor,
-        "session_id": session_id,
-        "status": "active",
-    }
-    with open(PATH_DRIVER_LOCATION, "w") as f:
-        json.dump(dict_location, f, indent=4)
-    logger.info("Driver coordinates written")
+    write_driver_location(args.competition, driver, PATH_DRIVER_LOCATION)
@@ -0,0 +1,432 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from selenium.common.exceptions import WebDriverException
+from urllib3.exceptions import MaxRetryError
+
+import logger as log
+from driver_init import (
+    init_driver,
+    get_blocked_urls,
+    get_driver,
+    read_driver_location,
+    claim_driver_location,
+    unclaim_driver_location,
+    remove_driver_location,
+    write_driver_location,
+    PATH_CHROME_DRIVER,
+)
+from sites import get_adapters
+
+logger = log.get_logger("driver pool")
+
+# Maximum time of a health check before the session is considered wedged (in seconds)
+DEFAULT_HEALTH_TIMEOUT = 5
+DEFAULT_MAX_WORKERS = 4
+# Coordinates of the sessions kept open between the runs
+DEFAULT_DRIVER_LOCATION = "driver_location.json"
+
+
+def session_key(competition, names=None):
+    """
+    Key of a session in the pool: the competition for all its tabs, else the
+    competition and the bookmakers of the tabs, e.g. "ligue1.betfirst".
+    """
+    if names is None:
+        return competition
+    return f"{competition}.{'+'.join(names)}"
+
+
+class Session:
+    """One driver of the pool with its usage statistics"""
+
+    def __init__(
+        self, competition, driver, launch_time, pid=None, detached=False, names=None
+    ):
+        self.competition = competition
+        # The bookmakers of the tabs, None for all the tabs of the competition
+        self.names = names
+        self.driver = driver
+        self.launch_time = launch_time
+        self.created = time.monotonic()
+        self.reuse_count = 0
+        self.recycle_count = 0
+        # Process of chromedriver, None for a remote driver unless registered
+        service = getattr(driver, "service", None)
+        self.pid = service.process.pid if service is not None else pid
+        # Registered in driver_location.json, the session outlives the pool
+        self.detached = detached
+        # Reason given by the supervisor to recycle the session
+        self.retire = None
+
+    @property
+    def age(self):
+        return time.monotonic() - self.created
+
+    @property
+    def key(self):
+        return session_key(self.competition, self.names)
+
+
+class DriverPool:
+    """
+    Hold one driver per competition in the running process - or per group of tabs
+    of a competition, see session_key - and hand it out. The live sessions
+    registered in driver_location.json - by init-drivers or a previous run - are
+    adopted first, the missing drivers are launched in parallel, each one opening
+    the tabs of its competition, and a driver is health-checked each time it is
+    handed out: a dead or wedged session is closed and launched again without
+    touching the other ones. A registered session is only adopted if no other
+    running process holds it, and the adopted sessions are left open and given
+    up on close.
+
+    Args:
+        config (dict): The parsed config.json.
+        headless (bool): Launch chrome without window.
+        path_chromedriver (str): Location of chromedriver.
+        max_workers (int): Maximum number of drivers launched at the same time.
+        health_timeout (float): Maximum time of a health check (in seconds).
+        path_driver_location (str, optional): The file of the registered sessions,
+            None to always launch new ones.
+        persist (bool): Register the launched sessions too, so the next runs
+            adopt them.
+    """
+
+    def __init__(
+        self,
+        config,
+        headless=True,
+        path_chromedriver=PATH_CHROME_DRIVER,
+        max_workers=DEFAULT_MAX_WORKERS,
+        health_timeout=DEFAULT_HEALTH_TIMEOUT,
+        path_driver_location=DEFAULT_DRIVER_LOCATION,
+        persist=False,
+    ):
+        self.config = config
+        self.headless = headless
+        self.path_chromedriver = path_chromedriver
+        self.max_workers = max_workers
+        self.health_timeout = health_timeout
+        self.path_driver_location = path_driver_location
+        self.persist = persist and path_driver_location is not None
+        self.sessions = {}
+        self.warm_up_time = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Instantiate the pool with the DRIVER_POOL section of config.json"""
+        config_pool = config.get("DRIVER_POOL", {})
+        return cls(
+            config,
+            headless=config_pool.get("headless", True),
+            path_chromedriver=config_pool.get("path_chromedriver", PATH_CHROME_DRIVER),
+            max_workers=config_pool.get("max_workers", DEFAULT_MAX_WORKERS),
+            health_timeout=config_pool.get("health_timeout", DEFAULT_HEALTH_TIMEOUT),
+            path_driver_location=config_pool.get(
+                "driver_location", DEFAULT_DRIVER_LOCATION
+            ),
+            persist=config_pool.get("persist", False),
+        )
+
+    def urls(self, competition, names=None):
+        """Return the urls of the tabs of a session, in the order of config"""
+        dict_url = self.config["URLS"][competition]
+        if names is None:
+            return dict_url
+        return {i: j for i, j in dict_url.items() if i in names}
+
+    def launch(self, competition, names=None):
+        """
+        Launch a new driver with the tabs of a competition, only the ones of names
+        if given.
+        """
+        start = time.perf_counter()
+        dict_url = self.urls(competition, names)
+        key = session_key(competition, names)
+        driver = init_driver(
+            dict_url,
+            get_adapters(dict_url, self.config),
+            headless=self.headless,
+            path_chromedriver=self.path_chromedriver,
+            dict_blocked={i: get_blocked_urls(self.config, i) for i in dict_url},
+        )
+        launch_time = time.perf_counter() - start
+        logger.info(f"{key} - driver launched in {launch_time:.2f}s")
+        # Only the sessions of whole competitions are registered
+        detached = self.persist and names is None
+        if detached:
+            # The drivers are launched in parallel, one writer at a time
+            with self._lock:
+                detached = write_driver_location(
+                    competition, driver, self.path_driver_location
+                )
+        return Session(competition, driver, launch_time, detached=detached, names=names)
+
+    def adopt(self, competition):
+        """
+        Take over the session of a competition registered in driver_location.json.
+        A session held by another running process is left to it, one which does
+        not answer anymore is unregistered, one with other tabs (e.g. launched for
+        other bookmakers) is left alone.
+
+        Returns:
+            Session: The adopted session, None if there is none to adopt.
+        """
+        if self.path_driver_location is None:
+            return None
+        location = read_driver_location(self.path_driver_location).get(competition)
+        if location is None:
+            return None
+        # Two processes driving the same browser would switch each other's tabs
+        if not claim_driver_location(competition, self.path_driver_location):
+            return None
+        start = time.perf_counter()
+        try:
+            driver = get_driver(competition, self.path_driver_location)
+        except (ImportError, WebDriverException, MaxRetryError, ConnectionError) as err:
+            logger.warning(f"{competition} - registered session lost - {err}")
+            self._unregister(competition)
+            return None
+        session = Session(
+            competition,
+            driver,
+            time.perf_counter() - start,
+            pid=location.get("pid"),
+            detached=True,
+        )
+        healthy = self.check(session)
+        if healthy is None:
+            self._unregister(competition)
+            return None
+        if not healthy:
+            logger.info(f"{competition} - registered session has other tabs")
+            unclaim_driver_location(competition, self.path_driver_location)
+            return None
+        logger.info(f"{competition} - registered session adopted")
+        return session
+
+    def _unregister(self, competition):
+        with self._lock:
+            remove_driver_location(competition, self.path_driver_location)
+
+    def warm_up(self, competitions):
+        """
+        Adopt the registered sessions of the competitions which do not have one,
+        then launch the missing drivers in parallel.
+
+        Returns:
+            float: The wall-clock time of the warm-up (in seconds).
+        """
+        start = time.perf_counter()
+        missing = []
+        adopted = 0
+        for competition in competitions:
+            if competition in self.sessions:
+                continue
+            session = self.adopt(competition)
+            if session is None:
+                missing.append(competition)
+                continue
+            with self._lock:
+                self.sessions[competition] = session
+            adopted += 1
+        if missing:
+            with ThreadPoolExecutor(
+                max_workers=max(1, min(self.max_workers, len(missing)))
+            ) as executor:
+                futures = {executor.submit(self.launch, i): i for i in missing}
+                for future in as_completed(futures):
+                    competition = futures[future]
+                    try:
+                        session = future.result()
+                    except Exception:
+                        logger.exception(f"{competition} - unable to launch the driver")
+                        continue
+                    with self._lock:
+                        self.sessions[competition] = session
+        self.warm_up_time = time.perf_counter() - start
+        logger.info(
+            f"pool warmed up in {self.warm_up_time:.2f}s - {adopted} drivers adopted, "
+            f"{len(missing)} launched"
+        )
+        return self.warm_up_time
+
+    def _ping(self, session):
+        """Cheap check of a session: list its tabs without touching the pages"""
+        handles = session.driver.window_handles
+        return len(handles) == len(self.urls(session.competition, session.names))
+
+    def check(self, session):
+        """
+        Ping a session on its own thread: Selenium has no timeout on its requests,
+        a wedged ping is left behind without holding the later checks.
+
+        Returns:
+            bool: True if the session has one tab per website, False if some are
+            missing, None if it is dead or does not answer within health_timeout.
+        """
+        result = {}
+
+        def ping():
+            try:
+                result["healthy"] = self._ping(session)
+            except Exception as err:
+                result["error"] = err
+
+        thread = threading.Thread(
+            target=ping, name=f"health-{session.key}", daemon=True
+        )
+        thread.start()
+        thread.join(self.health_timeout)
+        if thread.is_alive():
+            logger.warning(f"{session.key} - session wedged")
+            return None
+        if "error" in result:
+            logger.warning(f"{session.key} - session dead - {result['error']}")
+            return None
+        return result["healthy"]
+
+    def is_healthy(self, competition, names=None):
+        """
+        Return True if the session of a competition - of the tabs of names if
+        given - answers within health_timeout and still has one tab per website.
+        """
+        key = session_key(competition, names)
+        session = self.sessions.get(key)
+        if session is None:
+            return False
+        healthy = self.check(session)
+        if healthy is False:
+            logger.warning(f"{key} - tabs missing")
+        return bool(healthy)
+
+    def recycle(self, competition, names=None):
+        """
+        Close the session of a competition - of the tabs of names if given - and
+        launch a new one. A competition without session adopts its registered one
+        if it is still alive.
+        """
+        key = session_key(competition, names)
+        old = self.sessions.get(key)
+        if old is None:
+            session = self.adopt(competition) if names is None else None
+            if session is not None:
+                with self._lock:
+                    self.sessions[key] = session
+                return session
+        else:
+            # A wedged driver can hang on quit, do not wait for it
+            threading.Thread(target=self._quit, args=(old,), daemon=True).start()
+            if old.detached and not self.persist:
+                self._unregister(competition)
+        session = self.launch(competition, names)
+        if old is not None:
+            session.recycle_count = old.recycle_count + 1
+        with self._lock:
+            self.sessions[key] = session
+        logger.info(f"{key} - session recycled")
+        return session
+
+    def get(self, competition, names=None):
+        """
+        Hand out the driver of a competition, launching or recycling it if needed.
+        With names, a session holding the tabs of these bookmakers only.
+        """
+        key = session_key(competition, names)
+        session = self.sessions.get(key)
+        if session is not None and session.retire is not None:
+            logger.info(f"{key} - recycling a retired session")
+            self.recycle(competition, names)
+        elif not self.is_healthy(competition, names):
+            self.recycle(competition, names)
+        session = self.sessions[key]
+        session.reuse_count += 1
+        return session.driver
+
+    def get_all(self, competitions):
+        """Warm up the pool and return a dictionary mapping competitions to drivers"""
+        self.warm_up(competitions)
+        dict_driver = {}
+        for competition in competitions:
+            try:
+                dict_driver[competition] = self.get(competition)
+            except Exception:
+                logger.exception(f"{competition} - no driver available")
+        return dict_driver
+
+    def stats(self):
+        """
+        Return the age, reuse count and recycle count of every session.
+        """
+        return pd.DataFrame(
+            [
+                [i.key, i.age, i.launch_time, i.reuse_count, i.recycle_count]
+                for i in self.sessions.values()
+            ],
+            columns=[
+                "session",
+                "age",
+                "launch_time",
+                "reuse_count",
+                "recycle_count",
+            ],
+        )
+
+    @staticmethod
+    def _quit(session):
+        # List the chrome processes before chromedriver exits and they are orphaned
+        processes = []
+        if session.pid is not None:
+            try:
+                from supervisor import process_tree
+
+                processes = process_tree(session.pid)
+            except ImportError:
+                pass
+        try:
+            session.driver.quit()
+        except Exception as err:
+            logger.warning(f"{session.key} - unable to quit the driver - {err}")
+        # Kill what a wedged or detached browser left behind
+        alive = [i for i in processes if i.is_running()]
+        if alive:
+            from supervisor import kill_processes
+
+            logger.warning(f"{session.key} - {len(alive)} processes killed")
+            kill_processes(alive)
+
+    def release(self, key):
+        """
+        Quit the driver of a session (see session_key) to free its memory, even
+        if registered.
+        """
+        with self._lock:
+            session = self.sessions.pop(key, None)
+        if session is not None:
+            self._quit(session)
+            if session.detached:
+                self._unregister(session.competition)
+            logger.info(f"{key} - session released")
+
+    def close(self):
+        """Quit all the drivers but the registered ones, left for the next run"""
+        detached = [i for i in self.sessions.values() if i.detached]
+        for session in self.sessions.values():
+            if not session.detached:
+                self._quit(session)
+            else:
+                unclaim_driver_location(session.competition, self.path_driver_location)
+        if detached:
+            logger.info(
+                f"{len(detached)} registered sessions left open: "
+                f"{', '.join(i.key for i in detached)}"
+            )
+        self.sessions = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
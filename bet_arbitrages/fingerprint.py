@@ -0,0 +1,109 @@
+import threading
+import pandas as pd
+
+import logger as log
+import metrics
+
+logger = log.get_logger("fingerprint")
+
+# Number of reads of a tab after which it is read in full even if unchanged
+DEFAULT_REFRESH_EVERY = 10
+
+# Hash the text of the rows matching arguments[0] in the browser, only the
+# fingerprint crosses the WebDriver connection. Two 32 bits hashes - a polynomial
+# one and FNV-1a - with the number of rows.
+FINGERPRINT_SCRIPT = """
+var rows = document.querySelectorAll(arguments[0]);
+var h1 = 0, h2 = 2166136261;
+for (var i = 0; i < rows.length; i++) {
+    var text = rows[i].textContent;
+    for (var j = 0; j < text.length; j++) {
+        var c = text.charCodeAt(j);
+        h1 = (h1 * 31 + c) | 0;
+        h2 = Math.imul(h2 ^ c, 16777619);
+    }
+}
+return rows.length + ":" + (h1 >>> 0).toString(16) + ":" + (h2 >>> 0).toString(16);
+"""
+
+
+def page_fingerprint(driver, css_selector):
+    """Return the fingerprint of the rows of the active tab, computed in the browser"""
+    return driver.execute_script(FINGERPRINT_SCRIPT, css_selector)
+
+
+class ChangeTracker:
+    """
+    Remember the fingerprint of the rows of every tab at its last full read. A tab
+    whose fingerprint did not change is not read again: its cached standardized
+    quotes are reused. Every refresh_every reads the tab is read in full anyway,
+    so a change the fingerprint misses does not leave stale quotes for long.
+
+    Args:
+        refresh_every (int): Number of reads of a tab between two forced full reads.
+    """
+
+    def __init__(self, refresh_every=DEFAULT_REFRESH_EVERY):
+        self.refresh_every = refresh_every
+        # tab -> (fingerprint of the last full read, reads skipped since)
+        self.tabs = {}
+        # site -> [hits, misses, forced]
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Instantiate the tracker with the EXTRACTION.change_detection section of
+        config, None if it is not enabled.
+        """
+        config_changes = config.get("EXTRACTION", {}).get("change_detection", {})
+        if not config_changes.get("enabled", False):
+            return None
+        return cls(
+            refresh_every=config_changes.get("refresh_every", DEFAULT_REFRESH_EVERY)
+        )
+
+    def unchanged(self, site, tab, fingerprint):
+        """
+        Return True if the tab can be skipped: its fingerprint is the one of its
+        last full read and no forced read is due.
+
+        Args:
+            site (str): Name of the website, for the hit rate.
+            tab (str): Key of the tab, e.g. its url.
+            fingerprint (str): The current fingerprint, None if unknown.
+        """
+        with self._lock:
+            counts = self.counts.setdefault(site, [0, 0, 0])
+            previous, skipped = self.tabs.get(tab, (None, 0))
+            if fingerprint is None or fingerprint != previous:
+                counts[1] += 1
+                result = "miss"
+            elif skipped + 1 >= self.refresh_every:
+                counts[2] += 1
+                result = "forced"
+            else:
+                self.tabs[tab] = (previous, skipped + 1)
+                counts[0] += 1
+                result = "hit"
+        metrics.inc("fingerprint_checks_total", bookmaker=site, result=result)
+        return result == "hit"
+
+    def record(self, tab, fingerprint):
+        """Remember the fingerprint of a full read of a tab"""
+        with self._lock:
+            self.tabs[tab] = (fingerprint, 0)
+
+    def forget(self, tab):
+        """Read the tab in full next time, e.g. after a failed read"""
+        with self._lock:
+            self.tabs.pop(tab, None)
+
+    def stats(self):
+        """Return the number of hits, misses, forced reads and the hit rate per site"""
+        with self._lock:
+            rows = [[site, *counts] for site, counts in sorted(self.counts.items())]
+        df = pd.DataFrame(rows, columns=["site", "hits", "misses", "forced"])
+        df["hit_rate"] = df["hits"] / df[["hits", "misses", "forced"]].sum(axis=1)
+        return df
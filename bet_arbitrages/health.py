@@ -0,0 +1,320 @@
+"""
+Health of every (competition, bookmaker) tab: the failures are retried with an
+exponential backoff and a tab failing too many times in a row is skipped by a
+circuit breaker.
+
+A tab whose read failed is not read again before its backoff is over. After
+threshold failures in a row its circuit opens: the tab is skipped until its backoff
+is over, then probed with a short wait. A probe returning quotes closes the circuit,
+a failed one opens it again for twice as long.
+
+The state of the tabs and the log of the failures are kept in a SQLite file, so a
+new run starts from the state of the previous one.
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+
+import logger as log
+import metrics
+
+logger = log.get_logger("health")
+
+DEFAULT_HEALTH_PATH = "data/health.db"
+# Failures in a row which open the circuit of a tab
+DEFAULT_THRESHOLD = 3
+# Backoff after the first failure, doubled at each failure (in seconds)
+DEFAULT_BASE_BACKOFF = 30
+DEFAULT_MAX_BACKOFF = 1800
+# Maximum wait for the rows of a probed tab (in seconds)
+DEFAULT_PROBE_WAIT = 3
+# States of the circuit of a tab
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+# Answers of SiteHealth.allow, None when the tab is skipped
+READ, PROBE = "read", "probe"
+
+COLUMNS = [
+    "competition",
+    "bookmaker",
+    "state",
+    "failures",
+    "total_failures",
+    "total_successes",
+    "last_success",
+    "last_failure",
+    "last_error",
+    "retry_at",
+]
+
+
+class SiteHealth:
+    """
+    Backoff and circuit breaker of every (competition, bookmaker) tab, held in
+    memory and written through to a SQLite file.
+
+    Args:
+        path (str): Location of the SQLite file.
+        threshold (int): Failures in a row which open the circuit of a tab.
+        base_backoff (float): Backoff after the first failure (in seconds).
+        max_backoff (float): Maximum backoff (in seconds).
+        probe_wait (float): Maximum wait for the rows of a probed tab (in seconds).
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_HEALTH_PATH,
+        threshold=DEFAULT_THRESHOLD,
+        base_backoff=DEFAULT_BASE_BACKOFF,
+        max_backoff=DEFAULT_MAX_BACKOFF,
+        probe_wait=DEFAULT_PROBE_WAIT,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.threshold = threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.probe_wait = probe_wait
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            str(self.path), timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sites (
+                competition TEXT NOT NULL,
+                bookmaker TEXT NOT NULL,
+                state TEXT NOT NULL,
+                failures INTEGER NOT NULL,
+                total_failures INTEGER NOT NULL,
+                total_successes INTEGER NOT NULL,
+                last_success TEXT,
+                last_failure TEXT,
+                last_error TEXT,
+                retry_at REAL,
+                PRIMARY KEY (competition, bookmaker)
+            );
+            CREATE TABLE IF NOT EXISTS failures (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                competition TEXT NOT NULL,
+                bookmaker TEXT NOT NULL,
+                date TEXT NOT NULL,
+                reason TEXT,
+                state TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS failures_date ON failures (date);
+            """
+        )
+        # (competition, bookmaker) -> state of the tab, as the columns of sites
+        self.sites = {
+            (row[0], row[1]): dict(zip(COLUMNS, row))
+            for row in self.connection.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM sites"
+            )
+        }
+        for site in self.sites.values():
+            self._set_gauge(site)
+
+    @classmethod
+    def from_config(cls, config):
+        """Instantiate the tracker with the HEALTH section of config.json"""
+        config_health = config.get("HEALTH", {})
+        return cls(
+            config_health.get("path", DEFAULT_HEALTH_PATH),
+            threshold=config_health.get("threshold", DEFAULT_THRESHOLD),
+            base_backoff=config_health.get("base_backoff", DEFAULT_BASE_BACKOFF),
+            max_backoff=config_health.get("max_backoff", DEFAULT_MAX_BACKOFF),
+            probe_wait=config_health.get("probe_wait", DEFAULT_PROBE_WAIT),
+        )
+
+    def backoff(self, failures):
+        """Return the time before the next read after some failures in a row"""
+        return min(self.base_backoff * 2 ** max(failures - 1, 0), self.max_backoff)
+
+    def _site(self, competition, bookmaker):
+        key = (competition, bookmaker)
+        if key not in self.sites:
+            self.sites[key] = {
+                "competition": competition,
+                "bookmaker": bookmaker,
+                "state": CLOSED,
+                "failures": 0,
+                "total_failures": 0,
+                "total_successes": 0,
+                "last_success": None,
+                "last_failure": None,
+                "last_error": None,
+                "retry_at": None,
+            }
+        return self.sites[key]
+
+    def _save(self, site):
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO sites ({', '.join(COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(COLUMNS))})",
+            [site[i] for i in COLUMNS],
+        )
+
+    @staticmethod
+    def _set_gauge(site):
+        metrics.set_gauge(
+            "circuit_open",
+            int(site["state"] != CLOSED),
+            competition=site["competition"],
+            bookmaker=site["bookmaker"],
+        )
+
+    def allow(self, competition, bookmaker, now=None):
+        """
+        Tell how to read a tab.
+
+        Returns:
+            str: READ for a normal read, PROBE for a read with probe_wait once the
+            backoff of an open circuit is over, None if the tab is skipped.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            site = self.sites.get((competition, bookmaker))
+            if site is None or site["failures"] == 0:
+                return READ
+            if site["retry_at"] is not None and now < site["retry_at"]:
+                action = None
+            elif site["state"] == CLOSED:
+                return READ
+            else:
+                if site["state"] == OPEN:
+                    site["state"] = HALF_OPEN
+                    self._save(site)
+                action = PROBE
+        if action is None:
+            metrics.inc(
+                "health_skips_total", competition=competition, bookmaker=bookmaker
+            )
+        else:
+            logger.info(f"{competition} - {bookmaker} probed")
+        return action
+
+    def success(self, competition, bookmaker, now=None):
+        """Record a read with quotes: the failures are reset and the circuit closed"""
+        now = time.time() if now is None else now
+        with self._lock:
+            site = self._site(competition, bookmaker)
+            recovered = site["state"] != CLOSED
+            site.update(
+                state=CLOSED,
+                failures=0,
+                total_successes=site["total_successes"] + 1,
+                last_success=str(datetime.fromtimestamp(now)),
+                retry_at=None,
+            )
+            self._save(site)
+        if recovered:
+            logger.info(f"{competition} - {bookmaker} recovered, circuit closed")
+            self._set_gauge(site)
+
+    def failure(self, competition, bookmaker, reason=None, now=None):
+        """
+        Record a failed read: the next read waits for the backoff, and the circuit
+        opens after threshold failures in a row.
+        """
+        now = time.time() if now is None else now
+        date = str(datetime.fromtimestamp(now))
+        with self._lock:
+            site = self._site(competition, bookmaker)
+            was_open = site["state"] != CLOSED
+            failures = site["failures"] + 1
+            backoff = self.backoff(failures)
+            site.update(
+                state=OPEN if failures >= self.threshold else CLOSED,
+                failures=failures,
+                total_failures=site["total_failures"] + 1,
+                last_failure=date,
+                last_error=reason,
+                retry_at=now + backoff,
+            )
+            self._save(site)
+            self.connection.execute(
+                "INSERT INTO failures (competition, bookmaker, date, reason, state) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (competition, bookmaker, date, reason, site["state"]),
+            )
+        metrics.inc("failed_urls_total", competition=competition, bookmaker=bookmaker)
+        if site["state"] == OPEN and not was_open:
+            logger.warning(
+                f"{competition} - {bookmaker} failed {failures} times in a row, "
+                f"circuit open for {backoff:.0f}s"
+            )
+            self._set_gauge(site)
+        else:
+            logger.warning(
+                f"{competition} - {bookmaker} failed ({reason}), "
+                f"retry in {backoff:.0f}s"
+            )
+
+    def record(self, competition, names, dict_quotes):
+        """
+        Record the reads of the tabs of a competition.
+
+        Args:
+            competition (str): Name of the competition.
+            names (iterable): The tabs which were read.
+            dict_quotes (dict): The raw quotes of each website, an empty list for a
+                failed read. A tab missing from it (e.g. its rows did not change)
+                counts as a success.
+        """
+        for name in names:
+            if name in dict_quotes and len(dict_quotes[name]) == 0:
+                self.failure(competition, name, "no quotes")
+            else:
+                self.success(competition, name)
+
+    def stats(self):
+        """Return the state of every tab, the failing ones first"""
+        with self._lock:
+            rows = [dict(i) for i in self.sites.values()]
+        df = pd.DataFrame(rows, columns=COLUMNS)
+        # Local dates as the other ones
+        df["retry_at"] = pd.to_datetime(
+            df["retry_at"].map(datetime.fromtimestamp, na_action="ignore")
+        )
+        return df.sort_values(
+            ["failures", "competition", "bookmaker"], ascending=[False, True, True]
+        )
+
+    def history(self, start=None, end=None):
+        """
+        Return the logged failures between two dates.
+
+        Args:
+            start (str, optional): First date, e.g. "2023-03-01".
+            end (str, optional): Last date, excluded.
+        """
+        query = "SELECT competition, bookmaker, date, reason, state FROM failures"
+        clauses = []
+        params = []
+        if start is not None:
+            clauses.append("date >= ?")
+            params.append(str(pd.Timestamp(start)))
+        if end is not None:
+            clauses.append("date < ?")
+            params.append(str(pd.Timestamp(end)))
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        with self._lock:
+            rows = self.connection.execute(query + " ORDER BY id", params).fetchall()
+        return pd.DataFrame(
+            rows, columns=["competition", "bookmaker", "date", "reason", "state"]
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,210 @@
+import asyncio
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import logger as log
+from row_parser import QUARANTINE
+from sites import get_adapter
+
+logger = log.get_logger("kambi")
+
+# Public offering API of the Kambi front end (scooore, napoleon...)
+DEFAULT_BASE_URL = "https://eu-offering-api.kambicdn.com"
+LIST_VIEW_URL = "{base_url}/offering/v2018/{operator}/listView/{path}.json"
+DEFAULT_PARAMS = {"lang": "fr_BE", "market": "BE", "useCombined": "true"}
+DEFAULT_TIMEOUT = 10
+# Maximum number of connections kept open to the API
+DEFAULT_LIMIT = 20
+# Kambi outcome types of the 1X2 bet offer
+OUTCOME_TYPES = ["OT_ONE", "OT_CROSS", "OT_TWO"]
+# Path of the league in the url of the website
+LEAGUE_PATH = re.compile(r"sports-hub/([^?#]+?)/?$")
+
+
+def league_path(url):
+    """
+    Get the league path of the API from the url of the website
+    ".../sports-hub/football/france/ligue_1" -> "football/france/ligue_1"
+    """
+    match = LEAGUE_PATH.search(url)
+    if match is None:
+        raise ValueError(f"No Kambi league in {url}")
+    return match.group(1)
+
+
+def to_raw_row(start, home, away, odds, col_locators):
+    """
+    Build a row shaped like the split text of the website so standardize_quotes
+    finds home, away and the 3 quotes at the COL_LOCATORS positions.
+    """
+    row = [""] * (max(col_locators) + 1)
+    # The date and time go in the first free cells
+    free = [i for i in range(len(row)) if i not in col_locators]
+    for index, value in zip(free, [start.strftime("%d/%m"), start.strftime("%H:%M")]):
+        row[index] = value
+    for index, value in zip(col_locators, [home, away, *odds]):
+        row[index] = value
+    return row
+
+
+def parse_list_view(payload, col_locators, site=None, quarantine=QUARANTINE):
+    """
+    Convert a listView payload of the Kambi API to the raw rows of get_quotes. An
+    event missing a field is quarantined, the other events are kept.
+
+    Args:
+        payload (dict): The JSON answer of the API.
+        col_locators (list): The COL_LOCATORS of the website.
+        site (str, optional): The website, to quarantine its malformed events.
+        quarantine (Quarantine): Where the malformed events go.
+
+    Returns:
+        list of all quotes split by cells
+    """
+    rows = []
+    for item in payload.get("events", []):
+        event = item.get("event") or {}
+        try:
+            row = _parse_event(item, event, col_locators)
+        except (KeyError, TypeError, ValueError, AttributeError) as err:
+            quarantine.add(
+                site,
+                [event.get(i) for i in ["homeName", "awayName", "start"]],
+                "event",
+            )
+            logger.debug(f"{site} - malformed event {event.get('id')} - {err!r}")
+            continue
+        if row is not None:
+            rows.append(row)
+    return rows
+
+
+def _parse_event(item, event, col_locators):
+    """Return the raw row of one listView event, None if it has no 1X2 offer"""
+    # Only the match result offer - betOfferType 2
+    offer = next(
+        (
+            i
+            for i in item.get("betOffers", [])
+            if i.get("betOfferType", {}).get("id") == 2
+        ),
+        None,
+    )
+    if offer is None or "homeName" not in event:
+        return None
+    odds = {i.get("type"): i.get("odds") for i in offer.get("outcomes", [])}
+    # The API gives the start in UTC
+    start = datetime.strptime(event["start"][:19], "%Y-%m-%dT%H:%M:%S")
+    start = start.replace(tzinfo=timezone.utc).astimezone()
+    return to_raw_row(
+        start,
+        event["homeName"],
+        event["awayName"],
+        # The API gives the quotes multiplied by 1000
+        [f"{odds[i] / 1000:.2f}" if odds.get(i) else None for i in OUTCOME_TYPES],
+        col_locators,
+    )
+
+
+class KambiFetcher:
+    """
+    Browserless extraction of the websites built on the Kambi front end. The
+    quotes are pulled from the JSON offering API with one aiohttp session whose
+    connections are reused between the calls. The session lives in its own event
+    loop thread so the fetcher can be called from any extraction worker.
+
+    Args:
+        config (dict): The parsed config.json, with a KAMBI section
+            {"base_url": ..., "operators": {site: operator}, "params": {...},
+            "timeout": ...}
+    """
+
+    def __init__(self, config):
+        # aiohttp is only needed when a website uses this fetcher
+        try:
+            import aiohttp  # noqa: F401
+        except ImportError:
+            raise ImportError("aiohttp is required by the kambi fetcher")
+        config_kambi = config.get("KAMBI", {})
+        self.config = config
+        self.base_url = config_kambi.get("base_url", DEFAULT_BASE_URL).rstrip("/")
+        self.operators = config_kambi.get("operators", {})
+        self.params = {**DEFAULT_PARAMS, **config_kambi.get("params", {})}
+        self.timeout = config_kambi.get("timeout", DEFAULT_TIMEOUT)
+        self.limit = config_kambi.get("limit", DEFAULT_LIMIT)
+        self._session = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def url(self, competition, site):
+        """Return the listView url of a website for a competition"""
+        return LIST_VIEW_URL.format(
+            base_url=self.base_url,
+            operator=self.operators[site],
+            path=league_path(self.config["URLS"][competition][site]),
+        )
+
+    async def _get_session(self):
+        import aiohttp
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _fetch_one(self, competition, site):
+        session = await self._get_session()
+        url = self.url(competition, site)
+        start = time.perf_counter()
+        try:
+            async with session.get(url, params=self.params) as response:
+                response.raise_for_status()
+                payload = await response.json(content_type=None)
+            rows = parse_list_view(
+                payload, get_adapter(site, self.config).col_locators, site=site
+            )
+        except Exception as err:
+            logger.error(f"{competition} - {site} - unable to fetch {url} - {err}")
+            return site, []
+        logger.info(
+            f"{competition} - {site} - {len(rows)} events fetched "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+        return site, rows
+
+    async def _fetch(self, competition, sites):
+        results = await asyncio.gather(
+            *[self._fetch_one(competition, site) for site in sites]
+        )
+        return dict(results)
+
+    def submit(self, competition, sites):
+        """
+        Start fetching the quotes of some websites for one competition, concurrently.
+        The caller can read the browser tabs meanwhile.
+
+        Returns:
+            concurrent.futures.Future: Its result is a dictionary mapping the websites
+            to their raw rows, an empty list if the website could not be fetched -
+            as get_all_quotes.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._fetch(competition, sites), self._loop
+        )
+
+    def fetch(self, competition, sites):
+        """Fetch the quotes of some websites for one competition and wait for them"""
+        return self.submit(competition, sites).result()
+
+    def close(self):
+        """Close the connections and stop the event loop"""
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -1,48 +1,251 @@
+import atexit
+import contextvars
+import json
 import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
 
+# Level of the loggers of the project - the other libraries only log warnings
+DEFAULT_LEVEL = logging.DEBUG
+DEFAULT_DIRECTORY = "data"
+DEFAULT_FORMAT = "text"
+# At most `burst` identical warnings or errors are written per `window` seconds
+DEFAULT_RATE_LIMIT_WINDOW = 60
+DEFAULT_RATE_LIMIT_BURST = 5
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Fields added to the records, set by context for the running extraction
+CONTEXT_FIELDS = ("competition", "bookmaker")
 
-def get_logger(name):
+_context = contextvars.ContextVar("log_context", default={})
+_lock = threading.RLock()
+_state = {"handler": None, "listener": None, "level": DEFAULT_LEVEL}
+# Names of the loggers of the project
+_loggers = set()
+
+
+class LazyText:
+    """
+    Text computed only when the record is written, e.g. a dataframe dump:
+    logger.error("dataframe head\\n%s", LazyText(lambda: df.head().to_string()))
     """
-    Returns a logger object configured with a console handler and a file handler.
-    The console handler prints log messages to the console with level DEBUG or higher.
-    The file handler saves log messages to a file named 'logfile.log' with level DEBUG or higher.
-    The logger object can be used to write log messages for the given name.
 
-    Parameters:
-    name (str): The name of the logger object.
+    def __init__(self, func):
+        self.func = func
 
-    Returns:
-    logging.Logger: The configured logger object.
+    def __str__(self):
+        return str(self.func())
+
+
+class ContextFilter(logging.Filter):
+    """Tag the records with the competition and the bookmaker being extracted"""
+
+    def filter(self, record):
+        context = _context.get()
+        for field in CONTEXT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field))
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drop a warning or an error already written `burst` times in the last `window`
+    seconds. The next one written after the window says how many were dropped.
     """
-    # Create logger
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
 
-    # Create console handler
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
+    def __init__(
+        self, window=DEFAULT_RATE_LIMIT_WINDOW, burst=DEFAULT_RATE_LIMIT_BURST
+    ):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        # key -> [start of the window, records written, records dropped]
+        self.seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or not self.burst:
+            return True
+        # f-strings are already formatted, only the template is used otherwise
+        key = (record.name, record.levelno, str(record.msg)[:200], record.competition)
+        now = time.monotonic()
+        with self._lock:
+            state = self.seen.get(key)
+            if state is None or now - state[0] > self.window:
+                dropped = state[2] if state is not None else 0
+                self.seen[key] = [now, 1, 0]
+                if dropped:
+                    record.msg = f"{record.msg} ({dropped} similar messages dropped)"
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record with the competition and bookmaker"""
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for field in CONTEXT_FIELDS:
+            if getattr(record, field, None) is not None:
+                data[field] = getattr(record, field)
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
 
-    # Create file handler
-    # Just get the last log
-    fh = logging.FileHandler(r"data/logfile.log", mode="w")
-    fh.setLevel(logging.DEBUG)
 
-    # Create file handler for error
-    # Get all the Log for errors
-    fh_error = logging.FileHandler(r"data/logfile_error.log")
-    fh_error.setLevel(logging.ERROR)
+class TextFormatter(logging.Formatter):
+    """The usual text format, prefixed by the competition and bookmaker if known"""
+
+    def format(self, record):
+        text = super().format(record)
+        tags = [getattr(record, i, None) for i in CONTEXT_FIELDS]
+        tags = [i for i in tags if i is not None]
+        if not tags:
+            return text
+        asctime, rest = text.split(" - ", 1)
+        return f"{asctime} - [{' / '.join(tags)}] {rest}"
+
+
+class InProcessQueueHandler(QueueHandler):
+    """
+    QueueHandler which does not format the record in the calling thread: the
+    message, the LazyText arguments and the traceback are formatted by the
+    listener thread.
+    """
+
+    def prepare(self, record):
+        return record
 
-    # Create formatter
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+def setup(
+    directory=DEFAULT_DIRECTORY,
+    format=DEFAULT_FORMAT,
+    level=DEFAULT_LEVEL,
+    rate_limit_window=DEFAULT_RATE_LIMIT_WINDOW,
+    rate_limit_burst=DEFAULT_RATE_LIMIT_BURST,
+    console=True,
+):
+    """
+    Build the handlers once: the records of every logger go through a queue to
+    one background thread writing them to the console, <directory>/logfile.log
+    (last run) and <directory>/logfile_error.log (all errors). Calling it again
+    replaces the handlers.
+
+    Args:
+        directory (str): Directory of the log files.
+        format (str): "text" or "json" records.
+        level (int or str): Level of the loggers of the project.
+        rate_limit_window (float): Window of the rate limit of repeated warnings
+            and errors (in seconds).
+        rate_limit_burst (int): Identical warnings or errors written per window,
+            0 to write all of them.
+        console (bool): Also write the records to the console.
+    """
+    with _lock:
+        shutdown()
+        formatter = JsonFormatter() if format == "json" else TextFormatter(TEXT_FORMAT)
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        handlers = []
+        if console:
+            handlers.append(logging.StreamHandler())
+        # Just get the last log
+        handlers.append(
+            logging.FileHandler(Path(directory) / "logfile.log", mode="w", delay=True)
+        )
+        # Get all the Log for errors
+        fh_error = logging.FileHandler(
+            Path(directory) / "logfile_error.log", delay=True
+        )
+        fh_error.setLevel(logging.ERROR)
+        handlers.append(fh_error)
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        handler = InProcessQueueHandler(queue.SimpleQueue())
+        handler.addFilter(ContextFilter())
+        handler.addFilter(RateLimitFilter(rate_limit_window, rate_limit_burst))
+        listener = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+
+        root = logging.getLogger()
+        root.addHandler(handler)
+        # The records of the project pass, selenium and urllib3 only above warning
+        root.setLevel(logging.WARNING)
+        _state.update(handler=handler, listener=listener, level=level)
+        for name in _loggers:
+            logging.getLogger(name).setLevel(level)
+
+
+def configure(config):
+    """Set up the logging with the LOGGING section of config.json"""
+    config_logging = config.get("LOGGING", {})
+    setup(
+        directory=config_logging.get("directory", DEFAULT_DIRECTORY),
+        format=config_logging.get("format", DEFAULT_FORMAT),
+        level=config_logging.get("level", DEFAULT_LEVEL),
+        rate_limit_window=config_logging.get(
+            "rate_limit_window", DEFAULT_RATE_LIMIT_WINDOW
+        ),
+        rate_limit_burst=config_logging.get(
+            "rate_limit_burst", DEFAULT_RATE_LIMIT_BURST
+        ),
+        console=config_logging.get("console", True),
     )
-    ch.setFormatter(formatter)
-    fh.setFormatter(formatter)
-    fh_error.setFormatter(formatter)
 
-    # Add handlers to logger
-    logger.addHandler(ch)
-    logger.addHandler(fh)
-    logger.addHandler(fh_error)
 
+def shutdown():
+    """Write the queued records and remove the handlers"""
+    handler, listener = _state.get("handler"), _state.get("listener")
+    if listener is not None:
+        listener.stop()
+    if handler is not None:
+        logging.getLogger().removeHandler(handler)
+        for i in listener.handlers:
+            i.close()
+    _state.update(handler=None, listener=None)
+
+
+atexit.register(shutdown)
+
+
+@contextmanager
+def context(**fields):
+    """Tag the records of the current thread in the block, e.g. competition=..."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def get_logger(name):
+    """
+    Returns the logger object of a module. Getting a logger has no side effect: the
+    handlers and the log files are only built by setup or configure, until then
+    the warnings go to stderr.
+
+    Parameters:
+    name (str): The name of the logger object.
+
+    Returns:
+    logging.Logger: The configured logger object.
+    """
+    with _lock:
+        _loggers.add(name)
+        logger = logging.getLogger(name)
+        logger.setLevel(_state["level"])
     return logger
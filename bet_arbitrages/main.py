@@ -1,105 +1,343 @@
-import json
-from functools import reduce
+import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
-from pathlib import Path
 
 import logger as log
-from driver_init import *
-from driver_extract import *
-from data_handling import *
+import metrics
+from driver_extract import get_all_quotes
+from data_handling import standardize_quotes, concatenate_quotes
+from storage import melt_quotes
+from arbitrage import get_markets
+from health import PROBE
+from sites import get_adapters, site_names
 
 logger = log.get_logger("main.py")
-# Define config path and the competition
-CONFIG_PATH = "config.json"
-DRIVER_PATH = "driver_location.json"
 KEY_PATH = "teams_correspondancy.csv"
-DRIVER_INIT_PATH = r"bet_arbitrages/driver_init.py"
-# Define date format
-DATE_FORMAT_PD = "%Y-%m-%d %H:%M:%S"
-DATE_FORMAT_FILE = "%Y%m%d_%H%M%S"
+UNRESOLVED_PATH = "data/unresolved_teams.csv"
+# Number of competitions extracted at the same time if not set in config
+DEFAULT_MAX_WORKERS = 3
 
-if __name__ == "__main__":
-    import subprocess
-
-    with open(CONFIG_PATH) as config:
-        config = json.load(config)
-    # Define competitions you want the quotes
-    competitions = [i for i in config["URLS"].keys()]
-    competitions = ["ligue2", "laliga", "ligue1"]
-    # Get the dataframe with the keys
-    df_keys = pd.read_csv(KEY_PATH)
-    dict_driver = {}
-    for competition in competitions:
-        try:
-            logger.info("try getting the driver if exist")
-            dict_driver[competition] = get_driver(competition)
-        except (ImportError, FileNotFoundError) as err:
-            logger.info("driver or file not exist - launch driver_init.py")
-            subprocess.call(["python", DRIVER_INIT_PATH, competition])
-            dict_driver[competition] = get_driver(competition)
-        except Exception as err:
-            logger.exception("investigate")
-
-    # First get the date of the extraction
-    now = datetime.now()
-    now_pd = now.strftime(DATE_FORMAT_PD)
+
+def get_competition_quotes(
+    competition,
+    driver,
+    config,
+    kambi=None,
+    names=None,
+    readiness=None,
+    on_quotes=None,
+    changes=None,
+    on_unchanged=None,
+    health=None,
+    cached=None,
+):
+    """
+    Get the raw quotes of the websites of one competition. The websites whose
+    adapter fetches with "kambi" (e.g. "FETCHERS": {"<site>": "kambi"}) are fetched
+    from their JSON API while the tabs of the others are read on the driver, with
+    the CSS selector of their adapter.
+
+    Args:
+        competition (str): Name of the competition as defined in config["URLS"].
+        driver (selenium.webdriver): The driver holding one tab per website of the competition.
+        config (dict): The parsed config.json.
+        kambi (KambiFetcher, optional): The fetcher of the Kambi websites, None to use
+            the browser for all websites.
+        names (iterable, optional): Only get these websites, all of them if None.
+        readiness (ReadinessTracker, optional): Wait until the rows of each tab stop
+            changing, with a timeout learned per website.
+        on_quotes (callable, optional): Called with each website and its raw quotes
+            as soon as they are read (see standardize_on_read).
+        changes (ChangeTracker, optional): Skip the tabs whose rows did not change
+            since their last full read.
+        on_unchanged (callable, optional): Called with each skipped website (see
+            keep_on_unchanged).
+        health (SiteHealth, optional): Skip the websites waiting for their backoff,
+            probe the ones whose circuit is open and record the reads.
+        cached (container, optional): The websites whose last quotes are kept by
+            the caller, only these can be skipped when unchanged.
+
+    Returns:
+        dict: A dictionary mapping the websites to their raw quotes, the skipped
+        websites are not included.
+    """
+    dict_url = config["URLS"][competition]
+    names = list(dict_url) if names is None else names
+    probes = {}
+    if health is not None:
+        allowed = []
+        for name in names:
+            action = health.allow(competition, name)
+            if action == PROBE:
+                probes[name] = health.probe_wait
+            if action is not None:
+                allowed.append(name)
+        names = allowed
+    adapters = get_adapters(dict_url, config)
+    kambi_names = [
+        i for i in names if kambi is not None and adapters[i].fetcher == "kambi"
+    ]
+    browser_names = [i for i in names if i not in kambi_names]
+
+    # The API calls run while the browser tabs are read
+    future = kambi.submit(competition, kambi_names) if kambi_names else None
     dict_quotes = {}
-    all_quotes = []
-    df_failed = pd.DataFrame(columns=["competition", "website", "date"])
-    # For all competitions - Extract the quote
-    for competition, driver in dict_driver.items():
-        logger.info(f"get_quotes for {competition}")
-        # Extract quote for the competition
-        dict_quotes[competition] = get_all_quotes(
-            driver, config["URLS"][competition], config["CSS_SELECTORS"]
-        )
-        # Get URLS where we failed to get the quotes
-        # You should create DB for log and take them from there but too much work
-        failed_urls = [
-            [i, [k for k, v in j.items() if len(v) == 0]]
-            for i, j in dict_quotes.items()
-        ]
-        failed_urls = [
-            {i[0]: [competition, *i[1], now]} for i in failed_urls if len(i[1]) > 0
-        ]
-        if failed_urls:
-            # Concat list of dict into one dict
-            failed_urls = reduce(lambda x, y: {**x, **y}, failed_urls)
-            df_failed = pd.concat(
-                [df_failed, pd.DataFrame(failed_urls).T], axis=0, ignore_index=True
+    if browser_names:
+        with metrics.timer("get_all_quotes_seconds"):
+            dict_quotes.update(
+                get_all_quotes(
+                    driver,
+                    dict_url,
+                    {i: j.css_selector for i, j in adapters.items() if j.css_selector},
+                    bulk=config.get("EXTRACTION", {}).get("bulk", True),
+                    names=browser_names,
+                    readiness=readiness,
+                    on_quotes=on_quotes,
+                    changes=changes,
+                    on_unchanged=on_unchanged,
+                    probes=probes,
+                    # A stale page is retried after its backoff
+                    retry_stale=health is None,
+                    cached=cached,
+                )
+            )
+    if future is not None:
+        kambi_quotes = future.result()
+        dict_quotes.update(kambi_quotes)
+        if on_quotes is not None:
+            for name, quotes in kambi_quotes.items():
+                on_quotes(name, quotes)
+    for name, quotes in dict_quotes.items():
+        if quotes:
+            metrics.mark_fresh(bookmaker=name)
+    if health is not None:
+        health.record(competition, names, dict_quotes)
+    # Keep the order of the config
+    return {i: dict_quotes[i] for i in dict_url if i in dict_quotes}
+
+
+def standardize_on_read(competition, config, dict_quotes_std, alerts=None, book=None):
+    """
+    Return the on_quotes callback of get_competition_quotes: each website is
+    standardized into dict_quotes_std as soon as its quotes are read, and its
+    prices are passed to the alerts and the book without waiting for the other
+    websites.
+
+    Args:
+        competition (str): Name of the competition as defined in config["URLS"].
+        config (dict): The parsed config.json.
+        dict_quotes_std (dict): The standardized quotes of each website, updated.
+        alerts (AlertEngine, optional): The engine evaluating the arbitrages.
+        book (OddsBook, optional): The book holding the prices of every website.
+    """
+
+    # The positions of the columns read by the parser of each website
+    col_locators = {
+        i: j.col_locators
+        for i, j in get_adapters(config["URLS"][competition], config).items()
+    }
+
+    def on_quotes(name, quotes):
+        read_time = time.time()
+        # A failed page leaves no quotes for the website
+        dict_quotes_std.pop(name, None)
+        dict_quotes_std.update(
+            standardize_quotes(
+                {name: quotes},
+                col_locators,
+                datetime.fromtimestamp(read_time),
             )
+        )
+        if alerts is not None:
+            alerts.update(competition, name, dict_quotes_std.get(name), read_time)
+        if book is not None:
+            book.update_frame(competition, name, dict_quotes_std.get(name))
+
+    return on_quotes
+
+
+def keep_on_unchanged(competition, dict_quotes_std, alerts=None):
+    """
+    Return the on_unchanged callback of get_competition_quotes: the standardized
+    quotes of a skipped website stay in dict_quotes_std, and they are passed again
+    to the alerts so its prices do not expire there.
+    """
+
+    def on_unchanged(name):
+        if alerts is not None:
+            alerts.update(competition, name, dict_quotes_std.get(name))
+
+    return on_unchanged
+
 
-        # Standardize the quotes as dict of dataframes
-        dict_quotes_std = standardize_quotes(
-            dict_quotes[competition], config["COL_LOCATORS"]
+def get_kambi_fetcher(config):
+    """Return a KambiFetcher if a website opted in, None otherwise"""
+    adapters = get_adapters(site_names(config), config)
+    if not any(i.fetcher == "kambi" for i in adapters.values()):
+        return None
+    from kambi import KambiFetcher
+
+    return KambiFetcher(config)
+
+
+def extract_competition(
+    competition,
+    driver,
+    config,
+    team_index,
+    now,
+    kambi=None,
+    readiness=None,
+    alerts=None,
+    health=None,
+):
+    """
+    Extracts, standardizes and concatenates the quotes of one competition.
+
+    Args:
+        competition (str): Name of the competition as defined in config["URLS"].
+        driver (selenium.webdriver): The driver holding one tab per website of the competition.
+        config (dict): The parsed config.json.
+        team_index (TeamIndex): The index of the team names of every website.
+        now (datetime): Date of the sweep, written in the failed urls.
+        kambi (KambiFetcher, optional): The fetcher of the Kambi websites.
+        readiness (ReadinessTracker, optional): The time-to-ready of every website.
+        alerts (AlertEngine, optional): The engine alerting on the arbitrages as
+            soon as the prices of a website are read.
+        health (SiteHealth, optional): The backoff and circuit breaker of every tab.
+
+    Returns:
+        tuple: (DataFrame of all quotes, DataFrame of the failed urls, elapsed seconds)
+    """
+    start = time.perf_counter()
+    logger.info(f"get_quotes for {competition}")
+    # Extract quote for the competition - each website is standardized once read
+    dict_quotes_std = {}
+    with metrics.labels(competition=competition):
+        dict_quotes = get_competition_quotes(
+            competition,
+            driver,
+            config,
+            kambi,
+            readiness=readiness,
+            on_quotes=standardize_on_read(competition, config, dict_quotes_std, alerts),
+            health=health,
         )
+    # Get URLS where we failed to get the quotes
+    failed_urls = [
+        [competition, name, now]
+        for name, quotes in dict_quotes.items()
+        if len(quotes) == 0
+    ]
+    df_failed = pd.DataFrame(failed_urls, columns=["competition", "website", "date"])
+    # Keep the order of the config
+    dict_quotes_std = {
+        i: dict_quotes_std[i] for i in dict_quotes if i in dict_quotes_std
+    }
+    with metrics.labels(competition=competition):
         # Concat all the quotes into 1 df
-        all_quotes.append(concatenate_quotes(dict_quotes_std, df_keys))
-
-    # Finally write the dataframes as csv
-    logger.info("Writting data as csv")
-    # First check if data directory exist - if not create
-    directory = Path("data")
-    if not directory.exists():
-        directory.mkdir(parents=True)
-    # Concatenate all dataframes into one
-    df_all_quotes = pd.concat(all_quotes, axis=0)
-    df_all_quotes["date"] = now_pd
-    # Check if file exist otherwise append it
-    filepath_all_quotes = Path(f"data/all_quotes_{now.strftime(DATE_FORMAT_FILE)}.csv")
-    df_all_quotes.to_csv(
-        filepath_all_quotes, mode="w", index=False,
-    )
-    # Write a dataframe giving all the urls which have failed
-    # Check if file exist otherwise append it
-    # Avoid to append data to the file with headers in the csv
-    filepath_fail = Path(f"data/failed_urls.csv")
-    file_exists = filepath_fail.exists()
-    df_failed.to_csv(
-        filepath_fail,
-        header=not file_exists,
-        mode="a" if file_exists else "w",
-        index=False,
-    )
+        df_quotes = concatenate_quotes(dict_quotes_std, team_index, get_markets(config))
+    df_quotes.insert(0, "competition", competition)
+    elapsed = time.perf_counter() - start
+    metrics.observe("extract_competition_seconds", elapsed, competition=competition)
+    logger.info(f"{competition} extracted in {elapsed:.2f}s")
+
+    return df_quotes, df_failed, elapsed
+
+
+def extract_all_competitions(
+    dict_driver,
+    config,
+    team_index,
+    now,
+    max_workers=None,
+    kambi=None,
+    readiness=None,
+    alerts=None,
+    health=None,
+):
+    """
+    Extracts the quotes of every competition, each driver on its own worker thread.
+    A driver is only used by one worker so the tabs of a competition are still read one
+    after another, but the competitions do not wait for each other anymore.
+
+    Args:
+        dict_driver (dict): A dictionary mapping competitions to their driver.
+        config (dict): The parsed config.json.
+        team_index (TeamIndex): The index of the team names of every website.
+        now (datetime): Date of the sweep.
+        max_workers (int, optional): Maximum number of competitions extracted at the same time.
+            Defaults to config["EXTRACTION"]["max_workers"]. Use 1 for a sequential sweep.
+        kambi (KambiFetcher, optional): The fetcher of the Kambi websites.
+        readiness (ReadinessTracker, optional): The time-to-ready of every website.
+        alerts (AlertEngine, optional): The engine alerting on the arbitrages.
+        health (SiteHealth, optional): The backoff and circuit breaker of every tab.
+
+    Returns:
+        tuple: (list of DataFrames of quotes, DataFrame of the failed urls,
+        dict mapping competitions to their wall-clock time in seconds)
+    """
+    if max_workers is None:
+        max_workers = config.get("EXTRACTION", {}).get(
+            "max_workers", DEFAULT_MAX_WORKERS
+        )
+    max_workers = max(1, min(max_workers, len(dict_driver) or 1))
+
+    all_quotes = []
+    list_failed = [pd.DataFrame(columns=["competition", "website", "date"])]
+    timings = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                extract_competition,
+                competition,
+                driver,
+                config,
+                team_index,
+                now,
+                kambi,
+                readiness,
+                alerts,
+                health,
+            ): competition
+            for competition, driver in dict_driver.items()
+        }
+        for future in as_completed(futures):
+            competition = futures[future]
+            try:
+                df_quotes, df_failed, elapsed = future.result()
+            # One broken competition must not stop the others
+            except Exception:
+                logger.exception(f"extraction failed for {competition}")
+                continue
+            all_quotes.append(df_quotes)
+            list_failed.append(df_failed)
+            timings[competition] = elapsed
+
+    return all_quotes, pd.concat(list_failed, axis=0, ignore_index=True), timings
+
+
+def write_quotes(store, df_all_quotes, now):
+    """
+    Append the quotes of one sweep to the store in the long layout. The store
+    writes them by batches, or when it is closed.
+
+    Args:
+        store (OddsStore): The storage set in config.json.
+        df_all_quotes (DataFrame): The quotes of all competitions.
+        now (datetime): Date of the sweep.
+    """
+    logger.info("Writting data to the store")
+    with metrics.timer("write_seconds", writer="store"):
+        df_long = melt_quotes(df_all_quotes, now)
+        store.append(df_long)
+    metrics.inc("rows_written_total", df_long.shape[0], writer="store")
+
+
+if __name__ == "__main__":
+    import sys
+    from cli import main
 
+    # Same as "cli.py daemon" or "cli.py scrape" with the competitions of config
+    main(["daemon" if "--daemon" in sys.argv[1:] else "scrape"])
@@ -0,0 +1,266 @@
+import bisect
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import logger as log
+
+logger = log.get_logger("metrics")
+
+# Prefix of the metric names
+NAMESPACE = "betarb"
+# Upper bounds of the latency histograms (in seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60)
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 9108
+
+# Labels of the running extraction - each worker thread sets its competition
+_labels = contextvars.ContextVar("labels", default={})
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed buckets, as Prometheus expects it"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return (upper bound, number of values below it) for each bucket"""
+        total, result = 0, []
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """
+    In-memory registry of the histograms, counters and gauges of the pipeline,
+    keyed by their name and labels. When disabled every call returns at once so
+    the instrumentation costs nothing.
+
+    Args:
+        enabled (bool): Record the metrics.
+        buckets (tuple): Upper bounds of the histograms (in seconds).
+    """
+
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.server = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted({**_labels.get(), **labels}.items()))
+
+    def observe(self, name, value, **labels):
+        """Add a value to a histogram"""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        """Increase a counter"""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge"""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self.gauges[key] = value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the time spent in the block in the histogram name"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def mark_fresh(self, **labels):
+        """Record that fresh quotes were extracted, to follow their staleness"""
+        self.set("last_success_timestamp_seconds", time.time(), **labels)
+
+    def snapshot(self):
+        """
+        Return all the metrics as a dictionary. The staleness of the quotes is the
+        time since their last successful extraction.
+        """
+        now = time.time()
+        with self._lock:
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": i.count,
+                    "sum": i.sum,
+                    # JSON has no infinity
+                    "buckets": [
+                        ["+Inf" if bound == float("inf") else bound, count]
+                        for bound, count in i.cumulative()
+                    ],
+                }
+                for (name, labels), i in self.histograms.items()
+            ]
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self.counters.items()
+            ]
+            gauges = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self.gauges.items()
+            ]
+        gauges += [
+            {
+                "name": "staleness_seconds",
+                "labels": i["labels"],
+                "value": now - i["value"],
+            }
+            for i in gauges
+            if i["name"] == "last_success_timestamp_seconds"
+        ]
+        return {"histograms": histograms, "counters": counters, "gauges": gauges}
+
+    def render_prometheus(self):
+        """Return the metrics in the Prometheus text format"""
+        snapshot = self.snapshot()
+        lines, typed = [], set()
+
+        def type_line(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for i in sorted(snapshot["histograms"], key=lambda x: x["name"]):
+            name = f"{NAMESPACE}_{i['name']}"
+            type_line(name, "histogram")
+            for bound, count in i["buckets"]:
+                le = bound if bound == "+Inf" else repr(float(bound))
+                labels = format_labels({**i["labels"], "le": le})
+                lines.append(f"{name}_bucket{labels} {count}")
+            lines.append(f"{name}_sum{format_labels(i['labels'])} {i['sum']}")
+            lines.append(f"{name}_count{format_labels(i['labels'])} {i['count']}")
+        for kind in ["counters", "gauges"]:
+            for i in sorted(snapshot[kind], key=lambda x: x["name"]):
+                name = f"{NAMESPACE}_{i['name']}"
+                type_line(name, "counter" if kind == "counters" else "gauge")
+                lines.append(f"{name}{format_labels(i['labels'])} {i['value']}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """
+        Expose the metrics on http://host:port/metrics (Prometheus text) and
+        /metrics.json in a background thread.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = registry.render_prometheus().encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(registry.snapshot()).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(
+            f"metrics served on http://{host}:{self.server.server_port}/metrics"
+        )
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
+
+
+def format_labels(labels):
+    """{"competition": "ligue1"} -> '{competition="ligue1"}'"""
+    if not labels:
+        return ""
+    items = [
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels.items()
+    ]
+    return "{" + ",".join(items) + "}"
+
+
+@contextmanager
+def labels(**kwargs):
+    """
+    Add labels to all the metrics recorded in the block by the current thread,
+    the log records of the block are tagged with them too.
+    """
+    token = _labels.set({**_labels.get(), **kwargs})
+    try:
+        with log.context(**kwargs):
+            yield
+    finally:
+        _labels.reset(token)
+
+
+# Registry of the process, disabled until configure is called
+REGISTRY = Metrics()
+observe = REGISTRY.observe
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set
+timer = REGISTRY.timer
+mark_fresh = REGISTRY.mark_fresh
+
+
+def configure(config):
+    """
+    Enable the metrics with the METRICS section of config.json
+    {"enabled": ..., "host": ..., "port": ...}, and serve them if a port is set.
+    """
+    config_metrics = config.get("METRICS", {})
+    REGISTRY.enabled = config_metrics.get("enabled", False)
+    if REGISTRY.enabled and config_metrics.get("port", DEFAULT_PORT) is not None:
+        REGISTRY.serve(
+            config_metrics.get("host", DEFAULT_HOST),
+            config_metrics.get("port", DEFAULT_PORT),
+        )
+    return REGISTRY
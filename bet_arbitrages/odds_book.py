@@ -0,0 +1,543 @@
+"""
+Resident book of the latest prices, kept up to date quote by quote instead of
+rebuilding the wide quotes of every sweep.
+
+Every event - (competition, home id, away id) - owns a row of three arrays: the
+prices (events, bookmakers, outcomes), the best price and its bookmaker
+(events, outcomes) and the margin of each market (events, markets). A new price
+only touches its row: the best price of its outcome is replaced if the new one is
+higher, searched again over the bookmakers only if the best bookmaker lowered its
+price, and the margin of its market is summed again over a few outcomes. The
+arbitrages are indexed in a heap so the best one is found without scanning the
+events, and the rows of the evicted events are reused.
+"""
+
+import heapq
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+import logger as log
+import metrics
+from arbitrage import DEFAULT_MARKETS, MAIN_MARKET, margin_column
+
+logger = log.get_logger("odds book")
+
+# Number of events allocated at first, doubled when full
+DEFAULT_CAPACITY = 1024
+# Number of bookmakers allocated at first, doubled when full
+DEFAULT_BOOKMAKERS = 8
+# An event is an arbitrage below this margin
+DEFAULT_THRESHOLD = 1.0
+# The starts are stored as seconds since this date, naive as the parsed starts
+EPOCH = pd.Timestamp("1970-01-01")
+
+
+def to_seconds(dates):
+    """Convert naive dates to seconds since EPOCH, NaN for a missing date"""
+    if dates is None:
+        return np.nan
+    if np.ndim(dates) == 0:
+        return (
+            np.nan if pd.isna(dates) else (pd.Timestamp(dates) - EPOCH).total_seconds()
+        )
+    dates = pd.Series(dates)
+    # The parsed starts are already dates, only the others are converted
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates)
+    return (dates - EPOCH).dt.total_seconds().to_numpy(dtype=float)
+
+
+class OddsBook:
+    """
+    Latest prices of every bookmaker on every event, with the best price of each
+    outcome and the margin of each market maintained incrementally.
+
+    Args:
+        markets (dict, optional): The outcomes of each market (see get_markets),
+            DEFAULT_MARKETS if None.
+        team_index (TeamIndex, optional): Resolves the team names of the frames of
+            update_frame and names the teams in to_frame.
+        threshold (float): An event is an arbitrage below this margin.
+        capacity (int): Number of events allocated at first.
+    """
+
+    def __init__(
+        self,
+        markets=None,
+        team_index=None,
+        threshold=DEFAULT_THRESHOLD,
+        capacity=DEFAULT_CAPACITY,
+    ):
+        self.markets = DEFAULT_MARKETS if markets is None else markets
+        self.team_index = team_index
+        self.threshold = threshold
+        self.outcomes = [i for market in self.markets.values() for i in market]
+        self.outcome_index = {j: i for i, j in enumerate(self.outcomes)}
+        # The outcomes of a market are contiguous
+        self.market_names = list(self.markets)
+        self.market_slices = []
+        start = 0
+        for market in self.markets.values():
+            self.market_slices.append(slice(start, start + len(market)))
+            start += len(market)
+        self.outcome_market = np.repeat(
+            np.arange(len(self.markets)), [len(i) for i in self.markets.values()]
+        )
+
+        self.bookmakers = []
+        self.bookmaker_index = {}
+        # (competition, home_id, away_id) -> row, and row -> key
+        self.events = {}
+        self.keys = []
+        self.free = []
+        self.prices = np.full(
+            (capacity, DEFAULT_BOOKMAKERS, len(self.outcomes)), np.nan
+        )
+        self.best = np.full((capacity, len(self.outcomes)), np.nan)
+        self.best_book = np.full((capacity, len(self.outcomes)), -1, dtype=np.int32)
+        self.margins = np.full((capacity, len(self.markets)), np.nan)
+        self.is_surebet = np.zeros((capacity, len(self.markets)), dtype=bool)
+        self.start = np.full(capacity, np.nan)
+        self.updated = np.full(capacity, np.nan)
+        # Incremented each time a row is freed, invalidates its heap entries
+        self.generation = np.zeros(capacity, dtype=np.int64)
+        # (row, market) -> margin of the current arbitrages
+        self.surebets = {}
+        # (margin, generation, row, market), stale entries are dropped when met
+        self._heap = []
+        # (competition, bookmaker) -> the team names, outcomes, selected lines,
+        # rows and generations of its last frame, to skip the team resolution
+        self._listings = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.events)
+
+    def _grow_events(self):
+        capacity = self.prices.shape[0]
+
+        def extend(array, value):
+            block = np.full((capacity,) + array.shape[1:], value, dtype=array.dtype)
+            return np.concatenate([array, block])
+
+        self.prices = extend(self.prices, np.nan)
+        self.best = extend(self.best, np.nan)
+        self.best_book = extend(self.best_book, -1)
+        self.margins = extend(self.margins, np.nan)
+        self.is_surebet = extend(self.is_surebet, False)
+        self.start = extend(self.start, np.nan)
+        self.updated = extend(self.updated, np.nan)
+        self.generation = extend(self.generation, 0)
+
+    def _bookmaker(self, bookmaker):
+        index = self.bookmaker_index.get(bookmaker)
+        if index is None:
+            index = len(self.bookmakers)
+            if index == self.prices.shape[1]:
+                block = np.full(self.prices.shape, np.nan)
+                self.prices = np.concatenate([self.prices, block], axis=1)
+            self.bookmakers.append(bookmaker)
+            self.bookmaker_index[bookmaker] = index
+        return index
+
+    def _row(self, key):
+        row = self.events.get(key)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+                self.keys[row] = key
+            else:
+                row = len(self.keys)
+                if row == self.prices.shape[0]:
+                    self._grow_events()
+                self.keys.append(key)
+            self.events[key] = row
+        return row
+
+    def _index_surebet(self, row, market, margin):
+        if margin < self.threshold:
+            if self.surebets.get((row, market)) != margin:
+                self.surebets[(row, market)] = margin
+                self.is_surebet[row, market] = True
+                heapq.heappush(
+                    self._heap, (margin, int(self.generation[row]), row, market)
+                )
+                # The stale entries never outnumber the live ones by much
+                if len(self._heap) > 2 * len(self.surebets) + 64:
+                    self._heap = [
+                        (j, int(self.generation[i[0]]), i[0], i[1])
+                        for i, j in self.surebets.items()
+                    ]
+                    heapq.heapify(self._heap)
+        elif self.is_surebet[row, market]:
+            del self.surebets[(row, market)]
+            self.is_surebet[row, market] = False
+
+    def update(self, key, bookmaker, outcome, price, start=None):
+        """
+        Set one price. Only the best price of its outcome and the margin of its
+        market are computed again, and only if the price changes them.
+
+        Args:
+            key (tuple): The event, (competition, home_id, away_id).
+            bookmaker (str): Name of the bookmaker.
+            outcome (str): The outcome, as declared in the markets.
+            price (float): The price, NaN if the bookmaker withdrew it.
+            start (datetime, optional): Start of the event.
+
+        Returns:
+            float: The margin of the market of the outcome.
+        """
+        o = self.outcome_index[outcome]
+        with self._lock:
+            b = self._bookmaker(bookmaker)
+            row = self._row(key)
+            if start is not None:
+                self.start[row] = to_seconds(start)
+            self.updated[row] = time.time()
+            old = self.prices[row, b, o]
+            self.prices[row, b, o] = price
+            best = self.best[row, o]
+            market = int(self.outcome_market[o])
+            if price > best or (best != best and price == price):
+                self.best[row, o] = price
+                self.best_book[row, o] = b
+            elif self.best_book[row, o] == b and not price >= old:
+                # The best price went down, another bookmaker may be better now
+                column = self.prices[row, : len(self.bookmakers), o]
+                column = np.where(np.isnan(column), -np.inf, column)
+                index = int(column.argmax())
+                if column[index] == -np.inf:
+                    self.best[row, o] = np.nan
+                    self.best_book[row, o] = -1
+                else:
+                    self.best[row, o] = column[index]
+                    self.best_book[row, o] = index
+            else:
+                return self.margins[row, market]
+            margin = (1 / self.best[row, self.market_slices[market]]).sum()
+            self.margins[row, market] = margin
+            self._index_surebet(row, market, margin)
+        return margin
+
+    def update_many(self, bookmaker, keys, prices, outcomes, starts=None):
+        """
+        Set the prices of one bookmaker on many events at once, e.g. a page just
+        read. The best prices and the margins are computed again on the touched
+        events only, with array operations.
+
+        Args:
+            bookmaker (str): Name of the bookmaker.
+            keys (list): The events, (competition, home_id, away_id).
+            prices (numpy.ndarray): The prices shaped (events, outcomes), NaN for
+                a withdrawn price.
+            outcomes (list): The outcome of each column of prices.
+            starts (array-like, optional): Start of each event.
+        """
+        if len(keys) == 0:
+            return
+        with self._lock:
+            get = self.events.get
+            rows = np.array([get(i, -1) for i in keys], dtype=np.int64)
+            # The new events get a row one by one
+            for i in np.nonzero(rows < 0)[0]:
+                rows[i] = self._row(keys[i])
+            self._update_rows(bookmaker, rows, prices, outcomes, starts)
+
+    def _update_rows(self, bookmaker, rows, prices, outcomes, starts=None):
+        with self._lock:
+            b = self._bookmaker(bookmaker)
+            columns = np.array([self.outcome_index[i] for i in outcomes])
+            if starts is not None:
+                self.start[rows] = to_seconds(starts)
+            self.updated[rows] = time.time()
+            self.prices[rows[:, None], b, columns] = prices
+
+            # The best price of the touched outcomes over all the bookmakers, the
+            # bookmakers come last with the slice between the indexes
+            cube = self.prices[rows[:, None], : len(self.bookmakers), columns]
+            cube = cube.transpose(0, 2, 1)
+            cube = np.where(np.isnan(cube), -np.inf, cube)
+            index = cube.argmax(axis=1)
+            best = np.take_along_axis(cube, index[:, None, :], axis=1)[:, 0, :]
+            missing = best == -np.inf
+            self.best[rows[:, None], columns] = np.where(missing, np.nan, best)
+            self.best_book[rows[:, None], columns] = np.where(missing, -1, index)
+
+            for market in np.unique(self.outcome_market[columns]):
+                sl = self.market_slices[market]
+                margins = (1 / self.best[rows, sl]).sum(axis=1)
+                previous = self.margins[rows, market]
+                self.margins[rows, market] = margins
+                # Only the arbitrages opened, moved or closed go through the index
+                surebet = margins < self.threshold
+                changed = (surebet & (margins != previous)) | (
+                    ~surebet & self.is_surebet[rows, market]
+                )
+                for row, margin in zip(rows[changed], margins[changed]):
+                    self._index_surebet(int(row), int(market), margin)
+
+    def update_frame(self, competition, bookmaker, df_quotes):
+        """
+        Replace the prices of a bookmaker on a competition by a standardized frame
+        of standardize_quotes: the events it does not list anymore lose its
+        prices, and an event left without any price is evicted.
+
+        Args:
+            competition (str): Name of the competition.
+            bookmaker (str): Name of the bookmaker.
+            df_quotes (DataFrame): Its standardized quotes, None if its page failed.
+        """
+        start = time.perf_counter()
+        if df_quotes is not None and df_quotes.shape[0]:
+            outcomes = [
+                i for i in self.outcomes if f"{bookmaker}_{i}" in df_quotes.columns
+            ]
+            prices = df_quotes[[f"{bookmaker}_{i}" for i in outcomes]]
+            prices = prices.to_numpy(dtype=float)
+            column_start = f"{bookmaker}_start"
+            starts = df_quotes[column_start] if column_start in df_quotes else None
+            if self._update_listed(
+                competition, bookmaker, df_quotes, outcomes, prices, starts
+            ):
+                self._observe(bookmaker, start)
+                return
+        keys = []
+        if df_quotes is not None and df_quotes.shape[0]:
+            home_id = self.team_index.resolve_many(
+                bookmaker, df_quotes[f"{bookmaker}_home"]
+            )
+            away_id = self.team_index.resolve_many(
+                bookmaker, df_quotes[f"{bookmaker}_away"]
+            )
+            resolved = (home_id.notna() & away_id.notna()).to_numpy()
+            keys = [
+                (competition, int(i), int(j))
+                for i, j in zip(home_id[resolved], away_id[resolved])
+            ]
+            # An event listed twice keeps its first line, as in concatenate_quotes
+            first = {}
+            for line, key in zip(np.nonzero(resolved)[0].tolist(), keys):
+                first.setdefault(key, line)
+            keys = list(first)
+            lines = np.array(list(first.values()), dtype=np.int64)
+        with self._lock:
+            b = self.bookmaker_index.get(bookmaker)
+            listed = set(keys)
+            withdrawn = []
+            if b is not None:
+                quoted = ~np.isnan(self.prices[: len(self.keys), b, :]).all(axis=1)
+                withdrawn = [
+                    self.keys[i]
+                    for i in np.nonzero(quoted)[0]
+                    if self.keys[i][0] == competition and self.keys[i] not in listed
+                ]
+            if withdrawn:
+                self.update_many(
+                    bookmaker,
+                    withdrawn,
+                    np.full((len(withdrawn), len(self.outcomes)), np.nan),
+                    self.outcomes,
+                )
+                rows = [self.events[i] for i in withdrawn]
+                empty = np.isnan(self.prices[rows]).all(axis=(1, 2))
+                self.evict([i for i, j in zip(withdrawn, empty) if j])
+            self._listings.pop((competition, bookmaker), None)
+            if keys:
+                self.update_many(
+                    bookmaker,
+                    keys,
+                    prices[lines],
+                    outcomes,
+                    None if starts is None else starts.iloc[lines],
+                )
+                rows = np.array([self.events[i] for i in keys], dtype=np.int64)
+                self._listings[(competition, bookmaker)] = (
+                    df_quotes[f"{bookmaker}_home"].to_numpy(dtype=object),
+                    df_quotes[f"{bookmaker}_away"].to_numpy(dtype=object),
+                    outcomes,
+                    lines,
+                    rows,
+                    self.generation[rows].copy(),
+                )
+        self._observe(bookmaker, start)
+
+    def _update_listed(
+        self, competition, bookmaker, df_quotes, outcomes, prices, starts
+    ):
+        """
+        Update the prices of a frame listing the same events as the last one of
+        the bookmaker on the competition, without resolving its team names again.
+        Returns False if the events changed.
+        """
+        listing = self._listings.get((competition, bookmaker))
+        if listing is None:
+            return False
+        home, away, listed_outcomes, lines, rows, generations = listing
+        if (
+            outcomes != listed_outcomes
+            or len(home) != df_quotes.shape[0]
+            or not (home == df_quotes[f"{bookmaker}_home"].to_numpy(dtype=object)).all()
+            or not (away == df_quotes[f"{bookmaker}_away"].to_numpy(dtype=object)).all()
+        ):
+            return False
+        with self._lock:
+            # An evicted event invalidates the rows
+            if not (self.generation[rows] == generations).all():
+                return False
+            self._update_rows(
+                bookmaker,
+                rows,
+                prices[lines],
+                outcomes,
+                None if starts is None else starts.iloc[lines],
+            )
+        return True
+
+    def _observe(self, bookmaker, start):
+        metrics.observe(
+            "odds_book_seconds", time.perf_counter() - start, bookmaker=bookmaker
+        )
+        metrics.set_gauge("odds_book_events", len(self.events))
+
+    def evict(self, keys):
+        """Remove some events, their rows are reused by the next ones"""
+        with self._lock:
+            for key in keys:
+                row = self.events.pop(key, None)
+                if row is None:
+                    continue
+                self.keys[row] = None
+                self.prices[row] = np.nan
+                self.best[row] = np.nan
+                self.best_book[row] = -1
+                self.margins[row] = np.nan
+                self.start[row] = np.nan
+                self.updated[row] = np.nan
+                self.generation[row] += 1
+                for market in np.nonzero(self.is_surebet[row])[0]:
+                    del self.surebets[(row, int(market))]
+                self.is_surebet[row] = False
+                self.free.append(row)
+
+    def evict_started(self, now=None):
+        """
+        Remove the events started before now, e.g. to keep the prematch prices only.
+
+        Returns:
+            int: The number of events removed.
+        """
+        now = to_seconds(pd.Timestamp.now() if now is None else now)
+        with self._lock:
+            rows = np.nonzero(self.start[: len(self.keys)] <= now)[0]
+            self.evict([self.keys[i] for i in rows])
+        return len(rows)
+
+    def evict_stale(self, max_age, now=None):
+        """
+        Remove the events without any new price for max_age seconds, e.g. the ones
+        no bookmaker lists anymore.
+
+        Returns:
+            int: The number of events removed.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = np.nonzero(self.updated[: len(self.keys)] < now - max_age)[0]
+            self.evict([self.keys[i] for i in rows])
+        return len(rows)
+
+    def _surebet(self, row, market, margin):
+        sl = self.market_slices[market]
+        return {
+            "key": self.keys[row],
+            "market": self.market_names[market],
+            "margin": float(margin),
+            "prices": dict(zip(self.outcomes[sl], self.best[row, sl].tolist())),
+            "bookmakers": {
+                i: self.bookmakers[j]
+                for i, j in zip(self.outcomes[sl], self.best_book[row, sl])
+            },
+        }
+
+    def best_surebet(self):
+        """
+        Return the arbitrage with the lowest margin, None if there is none. The
+        stale entries of the heap are dropped on the way, so it is O(1) amortized.
+
+        Returns:
+            dict: The key of the event, its market, margin, best prices and their
+            bookmakers.
+        """
+        with self._lock:
+            heap = self._heap
+            while heap:
+                margin, generation, row, market = heap[0]
+                if (
+                    generation == self.generation[row]
+                    and self.surebets.get((row, market)) == margin
+                ):
+                    return self._surebet(row, market, margin)
+                heapq.heappop(heap)
+        return None
+
+    def top_surebets(self, n=10):
+        """Return the n arbitrages with the lowest margin, as best_surebet"""
+        with self._lock:
+            best = heapq.nsmallest(n, self.surebets.items(), key=lambda i: i[1])
+            return [self._surebet(row, market, j) for (row, market), j in best]
+
+    def to_frame(self, competition=None, bookmakers=None):
+        """
+        Export the book in the layout of concatenate_quotes: "home_id", "away_id",
+        "home", "away", the "<bookmaker>_<outcome>" prices and the margins.
+
+        Args:
+            competition (str, optional): Only export this competition. If None all
+                of them are exported with a first "competition" column.
+            bookmakers (list, optional): Order of the bookmaker columns, the order
+                of their first price if None.
+
+        Returns:
+            DataFrame: The prices of the events, sorted by their key.
+        """
+        with self._lock:
+            keys = sorted(
+                i for i in self.events if competition is None or i[0] == competition
+            )
+            rows = np.array([self.events[i] for i in keys], dtype=np.int64)
+            prices = self.prices[rows, : len(self.bookmakers)]
+            margins = self.margins[rows]
+        ids = np.array([i[1:] for i in keys], dtype=np.int64).reshape(-1, 2)
+        columns = {}
+        if competition is None:
+            columns["competition"] = [i[0] for i in keys]
+        columns["home_id"] = ids[:, 0]
+        columns["away_id"] = ids[:, 1]
+        names = None if self.team_index is None else self.team_index.names
+        columns["home"] = names[ids[:, 0]] if names is not None else None
+        columns["away"] = names[ids[:, 1]] if names is not None else None
+
+        quoted = ~np.isnan(prices)
+        order = self.bookmakers if bookmakers is None else bookmakers
+        listed = []
+        for bookmaker in order:
+            b = self.bookmaker_index.get(bookmaker)
+            if b is None or not quoted[:, b].any():
+                continue
+            listed.append(bookmaker)
+            for o, outcome in enumerate(self.outcomes):
+                main = outcome in self.markets.get(MAIN_MARKET, [])
+                if main or quoted[:, b, o].any():
+                    columns[f"{bookmaker}_{outcome}"] = prices[:, b, o]
+
+        df = pd.DataFrame(columns)
+        for market, name in enumerate(self.market_names):
+            quoted_market = any(
+                f"{b}_{o}" in columns for b in listed for o in self.markets[name]
+            )
+            if name == MAIN_MARKET or quoted_market:
+                df[margin_column(name)] = margins[:, market]
+        return df
@@ -0,0 +1,222 @@
+import threading
+from collections import deque
+import numpy as np
+import pandas as pd
+
+import logger as log
+
+logger = log.get_logger("readiness")
+
+# Time without any change of the rows before a page is considered loaded (in seconds)
+DEFAULT_SETTLE = 0.5
+# Bounds of the learned timeout (in seconds)
+DEFAULT_MIN_TIMEOUT = 3
+DEFAULT_MAX_TIMEOUT = 15
+# The timeout is the 95th percentile of the recent load times times this factor
+DEFAULT_FACTOR = 1.5
+# Number of recent load times kept per site
+DEFAULT_HISTORY = 20
+# Minimum number of load times before the timeout is learned
+MIN_SAMPLES = 5
+# Extra time given to the webdriver on top of the timeout of the script (in seconds)
+SCRIPT_MARGIN = 5
+
+# Wait in the browser until the rows matching arguments[0] exist and their layout
+# has not changed for arguments[1] ms, or until arguments[2] ms. The layout is the
+# number of rows and their text without the digits: the quotes and the clock of a
+# live page keep changing once it is loaded. A MutationObserver re-reads the rows
+# on each change of the page, a timer checks the settle window since a page may
+# not change at all once loaded. A page already showing arguments[3], the layout of
+# its last settled read, is ready at once.
+# Calls back with {ready, rows, elapsed, layout, known} - elapsed is the time until
+# the last change.
+READY_SCRIPT = """
+var selector = arguments[0], settle = arguments[1], timeout = arguments[2];
+var known = arguments[3];
+var done = arguments[arguments.length - 1];
+var start = performance.now(), lastChange = start, layout = null, count = 0;
+var finished = false, observer = null, timer = null;
+
+function read() {
+    var rows = document.querySelectorAll(selector);
+    var hash = 0;
+    for (var i = 0; i < rows.length; i++) {
+        var text = rows[i].textContent;
+        for (var j = 0; j < text.length; j++) {
+            var code = text.charCodeAt(j);
+            if (code < 48 || code > 57) { hash = (hash * 31 + code) | 0; }
+        }
+    }
+    var current = rows.length + ":" + hash;
+    if (current !== layout) {
+        layout = current;
+        count = rows.length;
+        lastChange = performance.now();
+    }
+}
+
+function finish(ready, isKnown) {
+    if (finished) { return; }
+    finished = true;
+    if (observer) { observer.disconnect(); }
+    clearInterval(timer);
+    done({ready: ready, rows: count, elapsed: lastChange - start, layout: layout,
+          known: isKnown});
+}
+
+function check() {
+    read();
+    var now = performance.now();
+    if (count > 0 && now - lastChange >= settle) { finish(true, false); }
+    else if (now - start >= timeout) { finish(false, false); }
+}
+
+read();
+if (count > 0 && layout === known) { finish(true, true); return; }
+observer = new MutationObserver(read);
+observer.observe(document, {childList: true, subtree: true, characterData: true});
+timer = setInterval(check, 50);
+check();
+"""
+
+
+def wait_ready(driver, css_selector, timeout, settle=DEFAULT_SETTLE, layout=None):
+    """
+    Wait until the layout of the rows of a page stops changing, watching the page
+    in the browser. Only the digits of the rows may still change.
+
+    Args:
+        driver (selenium.webdriver): A Selenium WebDriver object.
+        css_selector: the CSS Selector of the rows.
+        timeout (float): The maximum amount of time to wait (in seconds).
+        settle (float): Time without change of the rows for the page to be ready.
+        layout (str, optional): The layout of the last settled read of the page,
+            the page is ready at once if it still shows it.
+
+    Returns:
+        dict: {"ready": bool, "rows": number of rows, "elapsed": time until the last
+        change of the rows in seconds, "layout": the layout read, "known": True if
+        it was the given layout}
+    """
+    driver.set_script_timeout(timeout + settle + SCRIPT_MARGIN)
+    result = driver.execute_async_script(
+        READY_SCRIPT, css_selector, int(settle * 1000), int(timeout * 1000), layout
+    )
+    return {
+        "ready": bool(result["ready"]),
+        "rows": int(result["rows"]),
+        "elapsed": result["elapsed"] / 1000,
+        "layout": result["layout"],
+        "known": bool(result["known"]),
+    }
+
+
+class ReadinessTracker:
+    """
+    Record the time-to-ready of every site and learn its timeout from the recent
+    load times: a fast site gives up quickly when it is broken instead of
+    stalling the sweep for the maximum time. The layout of the last settled read
+    of every page is kept, a page still showing it is read without waiting.
+
+    Args:
+        settle (float): Time without change of the rows for a page to be ready.
+        min_timeout (float): Lower bound of the learned timeout.
+        max_timeout (float): Upper bound of the timeout, used until enough load
+            times are known.
+        factor (float): Margin applied to the 95th percentile of the load times.
+        history (int): Number of recent load times kept per site.
+    """
+
+    def __init__(
+        self,
+        settle=DEFAULT_SETTLE,
+        min_timeout=DEFAULT_MIN_TIMEOUT,
+        max_timeout=DEFAULT_MAX_TIMEOUT,
+        factor=DEFAULT_FACTOR,
+        history=DEFAULT_HISTORY,
+    ):
+        self.settle = settle
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.factor = factor
+        # site -> recent time-to-ready of the pages which got ready
+        self.load_times = {}
+        # site -> [number of waits, number of timeouts]
+        self.counts = {}
+        # url -> layout of its last settled read, see READY_SCRIPT
+        self.layouts = {}
+        self.history = history
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Instantiate the tracker with the EXTRACTION.readiness section of config"""
+        config_readiness = config.get("EXTRACTION", {}).get("readiness", {})
+        return cls(
+            settle=config_readiness.get("settle", DEFAULT_SETTLE),
+            min_timeout=config_readiness.get("min_timeout", DEFAULT_MIN_TIMEOUT),
+            max_timeout=config_readiness.get("max_timeout", DEFAULT_MAX_TIMEOUT),
+            factor=config_readiness.get("factor", DEFAULT_FACTOR),
+            history=config_readiness.get("history", DEFAULT_HISTORY),
+        )
+
+    def timeout(self, site):
+        """Return the time to wait for a page of a site (in seconds)"""
+        with self._lock:
+            load_times = list(self.load_times.get(site, []))
+        if len(load_times) < MIN_SAMPLES:
+            return self.max_timeout
+        # The rows must then stay unchanged for the settle window
+        timeout = np.percentile(load_times, 95) * self.factor + self.settle
+        return float(np.clip(timeout, self.min_timeout, self.max_timeout))
+
+    def layout(self, url):
+        """Return the layout of the last settled read of a page, None if unknown"""
+        with self._lock:
+            return self.layouts.get(url)
+
+    def record(self, site, elapsed, ready, url=None, layout=None, known=False):
+        """
+        Record the time-to-ready of a page, a timeout is not used to learn and
+        neither is a page read at once since it still showed a known layout.
+        """
+        with self._lock:
+            if url is not None:
+                if ready:
+                    self.layouts[url] = layout
+                else:
+                    self.layouts.pop(url, None)
+            if known:
+                return
+            counts = self.counts.setdefault(site, [0, 0])
+            counts[0] += 1
+            if ready:
+                self.load_times.setdefault(site, deque(maxlen=self.history)).append(
+                    elapsed
+                )
+            else:
+                counts[1] += 1
+        logger.info(f"{site} - {'ready' if ready else 'timeout'} in {elapsed:.2f}s")
+
+    def stats(self):
+        """
+        Return the number of waits, timeouts, median and 95th percentile of the
+        time-to-ready and the current timeout of every site.
+        """
+        rows = []
+        for site, (waits, timeouts) in sorted(self.counts.items()):
+            load_times = list(self.load_times.get(site, []))
+            rows.append(
+                [
+                    site,
+                    waits,
+                    timeouts,
+                    np.median(load_times) if load_times else np.nan,
+                    np.percentile(load_times, 95) if load_times else np.nan,
+                    self.timeout(site),
+                ]
+            )
+        return pd.DataFrame(
+            rows,
+            columns=["site", "waits", "timeouts", "median", "p95", "timeout"],
+        )
@@ -0,0 +1,432 @@
+import glob
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+import logger as log
+from data_handling import compute_margin, parse_odds
+from storage import OUTCOMES, get_store
+from changelog import FULL_KINDS, KEY, OddsChangeLog
+
+logger = log.get_logger("replay")
+
+# An event is an arbitrage below this margin
+DEFAULT_THRESHOLD = 1.0
+# Amount staked on each arbitrage for the theoretical returns
+DEFAULT_BANKROLL = 100
+# Rows read at once from a legacy csv
+DEFAULT_CHUNKSIZE = 50000
+# Legacy files written by the first version of main.py
+LEGACY_PATTERN = "data/all_quotes_*.csv"
+LEGACY_DATE = re.compile(r"all_quotes_(\d{8}_\d{6})")
+LEGACY_DATE_FORMAT = "%Y%m%d_%H%M%S"
+# The events of the legacy files have no competition
+LEGACY_COMPETITION = "legacy"
+SNAPSHOT_COLUMNS = ["timestamp", "competition", "event", "home", "away"]
+OPPORTUNITY_COLUMNS = [
+    "competition",
+    "event",
+    "home",
+    "away",
+    "first_seen",
+    "last_seen",
+    "closed",
+    "snapshots",
+    "open_margin",
+    "min_margin",
+    "bookmakers",
+]
+
+
+def best_prices(df_wide, outcomes_cols):
+    """
+    Find the best price of each outcome of every row of wide quotes and the margin
+    of the row, as concatenate_quotes computes it.
+
+    Args:
+        df_wide (DataFrame): The SNAPSHOT_COLUMNS and the quotes as float.
+        outcomes_cols (list): One list of "<bookmaker>_<outcome>" columns per outcome.
+
+    Returns:
+        DataFrame: The SNAPSHOT_COLUMNS, "margin" and the bookmaker of the best price
+        of each outcome as "book_<outcome>". The rows missing an outcome are dropped.
+    """
+    df_best = df_wide[SNAPSHOT_COLUMNS].copy()
+    for outcome in OUTCOMES:
+        df_best[f"book_{outcome}"] = None
+    if not all(outcomes_cols):
+        # An outcome is not quoted at all
+        return df_best.iloc[:0].assign(margin=np.nan)
+    complete = np.ones(len(df_wide), dtype=bool)
+    for outcome, cols in zip(OUTCOMES, outcomes_cols):
+        values = df_wide[cols].to_numpy(dtype=float)
+        # NaN never wins the argmax
+        index = np.where(np.isnan(values), -np.inf, values).argmax(axis=1)
+        bookmakers = np.array([i.rsplit("_", 1)[0] for i in cols], dtype=object)
+        df_best[f"book_{outcome}"] = bookmakers[index]
+        complete &= ~np.isnan(values).all(axis=1)
+    df_best = df_best[complete]
+    df_best["margin"] = compute_margin(df_wide[complete], outcomes_cols)
+    return df_best
+
+
+def pivot_snapshots(df_long):
+    """
+    Convert stored quotes of full snapshots (long layout) to one row per event and
+    snapshot with a "<bookmaker>_<outcome>" column per price.
+    """
+    df_long = df_long.assign(column=df_long["bookmaker"] + "_" + df_long["outcome"])
+    df_wide = df_long.pivot_table(
+        index=SNAPSHOT_COLUMNS, columns="column", values="price", aggfunc="last"
+    ).reset_index()
+    df_wide.columns.name = None
+    return df_wide, [
+        [i for i in df_wide.columns if i.rsplit("_", 1)[-1] == o and "_" in i]
+        for o in OUTCOMES
+    ]
+
+
+def iter_states(df_long, state=None):
+    """
+    Yield the full quotes of a competition after each timestamp of its stored
+    rows: a snapshot or a checkpoint replaces the state, the changes of the
+    change-log are applied to it.
+
+    Args:
+        df_long (DataFrame): The stored rows of one competition, sorted by timestamp.
+        state (DataFrame, optional): The quotes before the first row, indexed by KEY
+            with home, away and price columns.
+    """
+    for timestamp, df in df_long.groupby("timestamp", sort=True):
+        full = df["kind"].isin(FULL_KINDS)
+        if full.any():
+            state = df[full].drop_duplicates(KEY, keep="last").set_index(KEY)
+            state = state[["home", "away", "price"]]
+        changes = df[~full].drop_duplicates(KEY, keep="last").set_index(KEY)
+        if changes.shape[0]:
+            if state is None:
+                # Changes without a known state can not be replayed
+                continue
+            deleted = changes.index[changes["kind"] == "delete"]
+            upserted = changes[changes["kind"] != "delete"][["home", "away", "price"]]
+            state = state.drop(index=deleted, errors="ignore")
+            state = pd.concat([state[~state.index.isin(upserted.index)], upserted])
+        if state is not None:
+            yield timestamp, state
+
+
+class OpportunityTracker:
+    """
+    Follow the arbitrages over the snapshots of a replay. An arbitrage opens at the
+    first snapshot where the margin of its event is below threshold and closes at
+    the first later snapshot of its competition where it is not.
+
+    Args:
+        threshold (float): An event is an arbitrage below this margin.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        # (competition, event) -> opportunity dict
+        self.active = {}
+        self.closed = []
+        # competition -> [first timestamp, last timestamp]
+        self.bounds = {}
+
+    def observe(self, timestamp, competition, df_best):
+        """
+        Feed the best prices of one snapshot of one competition (see best_prices).
+        """
+        bounds = self.bounds.setdefault(competition, [timestamp, timestamp])
+        bounds[1] = max(bounds[1], timestamp)
+
+        df_arbs = df_best[df_best["margin"] < self.threshold]
+        seen = set()
+        book_cols = [f"book_{i}" for i in OUTCOMES]
+        for row in df_arbs.itertuples(index=False):
+            key = (competition, row.event)
+            seen.add(key)
+            opportunity = self.active.get(key)
+            if opportunity is None:
+                books = sorted(set(getattr(row, i) for i in book_cols))
+                self.active[key] = {
+                    "competition": competition,
+                    "event": row.event,
+                    "home": row.home,
+                    "away": row.away,
+                    "first_seen": timestamp,
+                    "last_seen": timestamp,
+                    "closed": pd.NaT,
+                    "snapshots": 1,
+                    "open_margin": row.margin,
+                    "min_margin": row.margin,
+                    "bookmakers": "+".join(books),
+                }
+            else:
+                opportunity["last_seen"] = timestamp
+                opportunity["snapshots"] += 1
+                opportunity["min_margin"] = min(opportunity["min_margin"], row.margin)
+        for key in [i for i in self.active if i[0] == competition and i not in seen]:
+            opportunity = self.active.pop(key)
+            opportunity["closed"] = timestamp
+            self.closed.append(opportunity)
+
+    def result(self):
+        """Return the closed arbitrages and the ones still open at the end"""
+        return self.closed + list(self.active.values()), self.bounds
+
+
+def replay_store(config, competition, day, threshold=DEFAULT_THRESHOLD):
+    """
+    Replay one day of one competition of the store set in config.json. Only this
+    day is read so the memory does not grow with the history.
+
+    Returns:
+        tuple: (list of opportunity dicts, {competition: [first, last timestamp]})
+    """
+    store = get_store(config)
+    changelog = store if isinstance(store, OddsChangeLog) else OddsChangeLog(store)
+    tracker = OpportunityTracker(threshold)
+    with changelog:
+        day = pd.Timestamp(day)
+        df_day = changelog.read(
+            start=day,
+            end=day + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1),
+            competitions=[competition],
+        )
+        state = None
+        if df_day.shape[0] and df_day["kind"].iloc[0] not in FULL_KINDS:
+            # The day starts with changes - rebuild the state they apply to
+            state = changelog.state_at(competition, day - pd.Timedelta(microseconds=1))
+    for timestamp, df_state in iter_states(df_day, state):
+        df_long = df_state.reset_index().assign(
+            timestamp=timestamp, competition=competition
+        )
+        df_wide, outcomes_cols = pivot_snapshots(df_long)
+        tracker.observe(timestamp, competition, best_prices(df_wide, outcomes_cols))
+    return tracker.result()
+
+
+def legacy_date(path):
+    """Return the date of a data/all_quotes_<date>.csv file, None if unknown"""
+    match = LEGACY_DATE.search(Path(path).name)
+    if match is None:
+        return None
+    return pd.Timestamp(pd.to_datetime(match.group(1), format=LEGACY_DATE_FORMAT))
+
+
+def read_legacy(path, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Read a data/all_quotes_<date>.csv file of the first version by chunks. The
+    events are named by the teams of the first website of the file.
+
+    Yields:
+        tuple: (DataFrame with the SNAPSHOT_COLUMNS and the quotes, outcomes_cols)
+    """
+    file_date = legacy_date(path)
+    for df in pd.read_csv(path, chunksize=chunksize):
+        home = [i for i in df.columns if i.endswith("_home")][0]
+        away = [i for i in df.columns if i.endswith("_away")][0]
+        odds_cols = [
+            i for i in df.columns if "_" in i and i.rsplit("_", 1)[1] in OUTCOMES
+        ]
+        df_wide = parse_odds(df[odds_cols])
+        if "date" in df.columns:
+            df_wide.insert(0, "timestamp", pd.to_datetime(df["date"]))
+        else:
+            df_wide.insert(0, "timestamp", file_date)
+        df_wide.insert(1, "competition", df.get("competition", LEGACY_COMPETITION))
+        df_wide.insert(2, "event", df[home].astype(str) + " - " + df[away].astype(str))
+        df_wide.insert(3, "home", df[home])
+        df_wide.insert(4, "away", df[away])
+        yield df_wide, [
+            [i for i in odds_cols if i.rsplit("_", 1)[1] == o] for o in OUTCOMES
+        ]
+
+
+def replay_legacy(paths, threshold=DEFAULT_THRESHOLD, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Replay legacy csv files, one snapshot per file, in the order of their date.
+
+    Returns:
+        tuple: (list of opportunity dicts, {competition: [first, last timestamp]})
+    """
+    tracker = OpportunityTracker(threshold)
+    for path in paths:
+        # A snapshot can span several chunks - it is fed once complete
+        list_best = []
+        for df_wide, outcomes_cols in read_legacy(path, chunksize):
+            list_best.append(best_prices(df_wide, outcomes_cols))
+        df_best = pd.concat(list_best, axis=0, ignore_index=True)
+        for (timestamp, competition), df in df_best.groupby(
+            ["timestamp", "competition"], sort=True
+        ):
+            tracker.observe(timestamp, competition, df)
+    return tracker.result()
+
+
+def stitch(partitions):
+    """
+    Join the results of consecutive partitions: an arbitrage still open at the
+    last snapshot of a partition continues the one opened at the first snapshot
+    of the next partition of its competition.
+
+    Args:
+        partitions (list): The (opportunities, bounds) of each partition, in the
+            order of time.
+
+    Returns:
+        list: The opportunity dicts.
+    """
+    opportunities = []
+    # (competition, event) -> opportunity open at the end of the last partition
+    pending = {}
+    for partition_opportunities, bounds in partitions:
+        continued = {}
+        for opportunity in partition_opportunities:
+            key = (opportunity["competition"], opportunity["event"])
+            first = bounds[opportunity["competition"]][0]
+            previous = pending.pop(key, None)
+            if previous is not None and opportunity["first_seen"] == first:
+                opportunity = {
+                    **opportunity,
+                    "first_seen": previous["first_seen"],
+                    "snapshots": previous["snapshots"] + opportunity["snapshots"],
+                    "open_margin": previous["open_margin"],
+                    "min_margin": min(
+                        previous["min_margin"], opportunity["min_margin"]
+                    ),
+                    "bookmakers": previous["bookmakers"],
+                }
+            elif previous is not None:
+                # It closed at the first snapshot of this partition
+                previous["closed"] = bounds[previous["competition"]][0]
+                opportunities.append(previous)
+            if pd.isna(opportunity["closed"]):
+                continued[key] = opportunity
+            else:
+                opportunities.append(opportunity)
+        # Open at the end of a partition without any snapshot after it
+        for key in list(pending):
+            if key[0] in bounds:
+                previous = pending.pop(key)
+                previous["closed"] = bounds[key[0]][0]
+                opportunities.append(previous)
+        pending.update(continued)
+    return opportunities + list(pending.values())
+
+
+def replay(
+    config=None,
+    start=None,
+    end=None,
+    competitions=None,
+    legacy=None,
+    threshold=DEFAULT_THRESHOLD,
+    max_workers=None,
+):
+    """
+    Replay the stored quotes and the legacy csv files and list the arbitrages
+    which appeared. The store is replayed by (competition, day) and the legacy
+    files by day, each partition in its own process, then the arbitrages which
+    span two partitions are joined.
+
+    Args:
+        config (dict, optional): The parsed config.json, to replay its store.
+        start (datetime, optional): Replay from this date.
+        end (datetime, optional): Replay until this date.
+        competitions (list, optional): Only replay these competitions.
+        legacy (str or list, optional): Legacy csv files or a glob pattern.
+        threshold (float): An event is an arbitrage below this margin.
+        max_workers (int, optional): Number of processes, 1 to replay in this one.
+
+    Returns:
+        DataFrame: One row per arbitrage with the OPPORTUNITY_COLUMNS, "lifetime_s"
+        from its first to its last snapshot, "duration_s" until the snapshot
+        where it closed (NaN if still open) and "return_open", the return of the
+        stakes split at the opening. A change-log only stores the sweeps which
+        changed something so its arbitrages are seen on fewer snapshots, their
+        duration_s is still exact.
+    """
+    tasks = []
+    if config is not None:
+        with get_store(config) as store:
+            df_days = store.days(start, end, competitions)
+        tasks += [
+            (row.competition, row.day, replay_store, (config, row.competition, row.day))
+            for row in df_days.itertuples(index=False)
+        ]
+    if legacy is not None:
+        paths = sorted(glob.glob(legacy)) if isinstance(legacy, str) else legacy
+        days = {}
+        for path in paths:
+            day = legacy_date(path)
+            if day is None:
+                logger.warning(f"{path} skipped - no date in its name")
+                continue
+            day = day.normalize()
+            if (start is None or day >= pd.Timestamp(start).normalize()) and (
+                end is None or day <= pd.Timestamp(end)
+            ):
+                days.setdefault(day, []).append(path)
+        tasks += [
+            (LEGACY_COMPETITION, day, replay_legacy, (paths,))
+            for day, paths in days.items()
+        ]
+    logger.info(f"replay of {len(tasks)} partitions")
+
+    if max_workers == 1:
+        results = [func(*args, threshold=threshold) for _, _, func, args in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(func, *args, threshold=threshold)
+                for _, _, func, args in tasks
+            ]
+            results = [i.result() for i in futures]
+
+    # The partitions of a competition are joined in the order of time
+    order = sorted(range(len(tasks)), key=lambda i: (tasks[i][0], tasks[i][1]))
+    opportunities = stitch([results[i] for i in order])
+    df = pd.DataFrame(opportunities, columns=OPPORTUNITY_COLUMNS)
+    df["lifetime_s"] = (df["last_seen"] - df["first_seen"]).dt.total_seconds()
+    df["duration_s"] = (df["closed"] - df["first_seen"]).dt.total_seconds()
+    df["return_open"] = 1 / df["open_margin"] - 1
+    return df.sort_values("first_seen").reset_index(drop=True)
+
+
+def pair_frequency(df_opportunities):
+    """
+    Count the arbitrages produced by each combination of bookmakers with their
+    median lifetime and mean return.
+    """
+    return (
+        df_opportunities.groupby("bookmakers")
+        .agg(
+            opportunities=("event", "size"),
+            median_lifetime_s=("lifetime_s", "median"),
+            mean_return=("return_open", "mean"),
+        )
+        .sort_values("opportunities", ascending=False)
+        .reset_index()
+    )
+
+
+def summary(df_opportunities, bankroll=DEFAULT_BANKROLL):
+    """
+    Summarize a replay: the number of arbitrages per day, their median lifetime
+    and the theoretical profit of staking bankroll on each one at its opening.
+    """
+    df = df_opportunities.assign(day=df_opportunities["first_seen"].dt.normalize())
+    return (
+        df.groupby("day")
+        .agg(
+            opportunities=("event", "size"),
+            median_lifetime_s=("lifetime_s", "median"),
+            best_return=("return_open", "max"),
+            profit=("return_open", lambda x: (x * bankroll).sum()),
+        )
+        .reset_index()
+    )
@@ -0,0 +1,475 @@
+import json
+import re
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from itertools import chain
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+import logger as log
+import metrics
+
+logger = log.get_logger("row parser")
+
+# Split the text of a row into its cells (team names, quotes, dates...)
+ROW_SPLIT = re.compile(r" - |\n")
+# Patterns of the cells, compiled once
+ODDS = re.compile(r"^\d{1,3}[.,]\d{1,3}$")
+TIME = re.compile(r"^(\d{1,2})[:hH](\d{2})$")
+DATE = re.compile(r"(?<!\d)(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?(?!\d)")
+TODAY = re.compile(r"^(aujourd'hui|today|vandaag)$", re.IGNORECASE)
+TOMORROW = re.compile(r"^(demain|tomorrow|morgen)$", re.IGNORECASE)
+LIVE = re.compile(r"^(en direct|live|en cours)$", re.IGNORECASE)
+# Cells which are neither a team nor a quote: number of bets, ids, outcome names,
+# promotions...
+LABELS = re.compile(
+    r"^(\+\d+|\d+|[1X2]|boost(ed)?|cote boost[ée]e|super ?cote|top|new|nouveau"
+    r"|\d+ paris|[-+]?\d+(\.\d+)?%|-)$",
+    re.IGNORECASE,
+)
+LETTER = re.compile(r"[^\W\d_]")
+# Kinds of the cells
+EMPTY_CELL = "empty"
+ODDS_CELL = "odds"
+TIME_CELL = "time"
+DATE_CELL = "date"
+LIVE_CELL = "live"
+LABEL_CELL = "label"
+TEAM_CELL = "team"
+KINDS = [EMPTY_CELL, ODDS_CELL, TIME_CELL, DATE_CELL, LIVE_CELL, LABEL_CELL, TEAM_CELL]
+KIND_CODES = {j: i for i, j in enumerate(KINDS)}
+# Number of cells whose kind is cached per website
+MAX_CACHED_CELLS = 100000
+# Number of rejected rows kept in memory
+DEFAULT_QUARANTINE_SIZE = 1000
+QUARANTINE_PATH = "data/quarantine.jsonl"
+
+
+class Quote:
+    """One parsed row: the start of the event, the teams, the 3 quotes and if live"""
+
+    __slots__ = ("start", "home", "away", "odds_1", "odds_x", "odds_2", "live")
+
+    def __init__(self, start, home, away, odds_1, odds_x, odds_2, live):
+        self.start = start
+        self.home = home
+        self.away = away
+        self.odds_1 = odds_1
+        self.odds_x = odds_x
+        self.odds_2 = odds_2
+        self.live = live
+
+
+class Quarantine:
+    """
+    The rows a parser could not read, kept with their raw text to be looked at
+    instead of losing the whole website.
+    """
+
+    def __init__(self, maxlen=DEFAULT_QUARANTINE_SIZE):
+        self.rows = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def add(self, site, cells, reason):
+        with self._lock:
+            self.rows.append(
+                {
+                    "time": datetime.now().isoformat(timespec="seconds"),
+                    "site": site,
+                    "reason": reason,
+                    "text": " | ".join(str(i) for i in cells),
+                }
+            )
+        metrics.inc("parse_failures_total", bookmaker=site, reason=reason)
+
+    def write(self, path=QUARANTINE_PATH):
+        """Append the quarantined rows to a JSON lines file and forget them"""
+        with self._lock:
+            rows = list(self.rows)
+            self.rows.clear()
+        if not rows:
+            return
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+        logger.warning(f"{len(rows)} rows quarantined in {path}")
+
+
+QUARANTINE = Quarantine()
+
+
+def split_row(text):
+    """
+    Split the text of one row into a list of cells.
+    Lines are stripped and empty ones removed, as WebElement.text does.
+    """
+    text = "\n".join(line.strip() for line in text.splitlines() if line.strip())
+    return ROW_SPLIT.split(text)
+
+
+def to_float(text):
+    return float(text.replace(",", "."))
+
+
+def parse_start(date, time, now):
+    """
+    Build the start of an event from its date cell ("21/10", "Sam. 21/10",
+    "Demain"...) and its time cell ("13:00"), None if unknown. A date without
+    a year is the next one from now.
+    """
+    if time is None:
+        return None
+    match = TIME.match(time)
+    hour, minute = int(match.group(1)), int(match.group(2))
+    day = now.date()
+    if date is not None:
+        if TOMORROW.match(date):
+            day = day + timedelta(days=1)
+        elif not TODAY.match(date):
+            match = DATE.search(date)
+            if match is None:
+                return None
+            year = match.group(3)
+            try:
+                day = day.replace(
+                    year=int(year) % 100 + 2000 if year else day.year,
+                    month=int(match.group(2)),
+                    day=int(match.group(1)),
+                )
+            except ValueError:
+                return None
+            # The listings only show events to come
+            if not year and day < now.date() - timedelta(days=180):
+                day = day.replace(year=day.year + 1)
+    if hour > 23 or minute > 59:
+        return None
+    return datetime(day.year, day.month, day.day, hour, minute)
+
+
+class RowParser:
+    """
+    Turn the split text of the rows of a website into Quote records. Each cell is
+    classified once by the patterns - the same team names, dates and quotes come
+    back on every read so the kinds are cached. The cells at the COL_LOCATORS
+    positions are checked first - the fast path for the expected layout. If they
+    do not match, e.g. a "Boosted" label or a time shifted the cells, the first
+    two team names and the first three quotes after them are kept. A row which
+    can not be read either way goes to the quarantine.
+
+    Args:
+        site (str): Name of the website.
+        col_locators (list, optional): Positions of home, away and the 3 quotes
+            once the live labels are removed.
+        labels (str, optional): Pattern of extra cells to ignore on this website.
+        quarantine (Quarantine, optional): Where the rejected rows go.
+    """
+
+    def __init__(self, site, col_locators=None, labels=None, quarantine=QUARANTINE):
+        self.site = site
+        self.col_locators = list(col_locators) if col_locators else None
+        self._last_locator = max(self.col_locators) if self.col_locators else None
+        self.labels = re.compile(labels, re.IGNORECASE) if labels else None
+        self.quarantine = quarantine
+        # cell -> kind, quote cell -> float, and (date, time, day of the read) -> start
+        self._kinds = {}
+        self._odds = {}
+        self._starts = {}
+
+    def classify(self, cell):
+        """Return the kind of a cell: ODDS_CELL, TIME_CELL, DATE_CELL..."""
+        kind = self._kinds.get(cell)
+        if kind is not None:
+            return kind
+        if not isinstance(cell, str) or not cell:
+            kind = EMPTY_CELL
+        elif ODDS.match(cell):
+            kind = ODDS_CELL
+        elif TIME.match(cell):
+            kind = TIME_CELL
+        elif LIVE.match(cell):
+            kind = LIVE_CELL
+        elif TODAY.match(cell) or TOMORROW.match(cell) or DATE.search(cell):
+            kind = DATE_CELL
+        elif (
+            LABELS.match(cell)
+            or (self.labels is not None and self.labels.match(cell))
+            or not LETTER.search(cell)
+        ):
+            kind = LABEL_CELL
+        else:
+            kind = TEAM_CELL
+        # The quotes change with every read, keep the cache bounded
+        if len(self._kinds) >= MAX_CACHED_CELLS:
+            self._kinds.clear()
+            self._odds.clear()
+        self._kinds[cell] = kind
+        if kind is ODDS_CELL:
+            self._odds[cell] = to_float(cell)
+        return kind
+
+    def start(self, date, time, now, day=None):
+        key = (date, time, now.date() if day is None else day)
+        try:
+            return self._starts[key]
+        except KeyError:
+            if len(self._starts) >= MAX_CACHED_CELLS:
+                self._starts.clear()
+            start = self._starts[key] = parse_start(date, time, now)
+            return start
+
+    def parse_row(self, cells, now, day=None):
+        """
+        Return the Quote of one row, or the reason it can not be read. day is
+        now.date(), computed once per page by parse.
+        """
+        # Most cells are already cached, only the new ones go through classify
+        cached, classify = self._kinds.get, self.classify
+        kinds = [cached(i) or classify(i) for i in cells]
+        live = LIVE_CELL in kinds
+        if live:
+            cells = [i for i, kind in zip(cells, kinds) if kind is not LIVE_CELL]
+            kinds = [kind for kind in kinds if kind is not LIVE_CELL]
+        time = date = None
+        if TIME_CELL in kinds:
+            time = cells[kinds.index(TIME_CELL)]
+            if DATE_CELL in kinds:
+                date = cells[kinds.index(DATE_CELL)]
+        start = self.start(date, time, now, day)
+
+        locators = self.col_locators
+        if locators is not None and len(cells) > self._last_locator:
+            home, away, odds_1, odds_x, odds_2 = locators
+            if (
+                kinds[home] is TEAM_CELL
+                and kinds[away] is TEAM_CELL
+                and kinds[odds_1] is ODDS_CELL
+                and kinds[odds_x] is ODDS_CELL
+                and kinds[odds_2] is ODDS_CELL
+            ):
+                # Another page of the website may have just cleared the cache
+                value = self._odds.get
+                odds_1, odds_x, odds_2 = cells[odds_1], cells[odds_x], cells[odds_2]
+                return Quote(
+                    start,
+                    cells[home],
+                    cells[away],
+                    value(odds_1) or to_float(odds_1),
+                    value(odds_x) or to_float(odds_x),
+                    value(odds_2) or to_float(odds_2),
+                    live,
+                )
+
+        # The layout has moved - find the cells by their kinds
+        teams = [index for index, kind in enumerate(kinds) if kind is TEAM_CELL]
+        if len(teams) < 2:
+            return "teams"
+        odds = [
+            cells[index]
+            for index in range(teams[1] + 1, len(cells))
+            if kinds[index] is ODDS_CELL
+        ]
+        if len(odds) < 3:
+            return "odds"
+        return Quote(
+            start,
+            cells[teams[0]],
+            cells[teams[1]],
+            to_float(odds[0]),
+            to_float(odds[1]),
+            to_float(odds[2]),
+            live,
+        )
+
+    def parse(self, rows, now=None):
+        """
+        Parse the rows of one page.
+
+        Args:
+            rows (list): The rows split in cells (see get_quotes).
+            now (datetime, optional): Date of the read, to date the events.
+
+        Returns:
+            list: The Quote of every readable row.
+        """
+        now = datetime.now() if now is None else now
+        day = now.date()
+        quotes = []
+        for cells in rows:
+            quote = self.parse_row(cells, now, day)
+            if isinstance(quote, Quote):
+                quotes.append(quote)
+            else:
+                self.quarantine.add(self.site, cells, quote)
+        if len(quotes) < len(rows):
+            logger.warning(
+                f"{self.site} - {len(rows) - len(quotes)} of {len(rows)} rows "
+                "quarantined"
+            )
+        return quotes
+
+    def parse_frame(self, rows, now=None):
+        """
+        Parse the rows of one page straight into the frame of to_frame. The cells
+        of the whole page are classified once per distinct value and the rows in
+        the COL_LOCATORS layout are read with array operations, the other rows go
+        through parse_row as in parse.
+
+        Args:
+            rows (list): The rows split in cells (see get_quotes).
+            now (datetime, optional): Date of the read, to date the events.
+
+        Returns:
+            DataFrame: The quotes of every readable row, as to_frame.
+        """
+        now = datetime.now() if now is None else now
+        day = now.date()
+        n_rows = len(rows)
+        if self.col_locators is None or n_rows == 0:
+            return self.to_frame(self.parse(rows, now))
+
+        # All the cells of the page end to end, each one with its row
+        lengths = np.fromiter(map(len, rows), dtype=np.int64, count=n_rows)
+        cells = np.empty(lengths.sum(), dtype=object)
+        cells[:] = list(chain.from_iterable(rows))
+        row = np.repeat(np.arange(n_rows), lengths)
+        offsets = np.cumsum(lengths) - lengths
+
+        # The kind of each distinct cell, the missing cells (code -1) take the
+        # last kind which is EMPTY_CELL
+        codes, uniques = pd.factorize(cells)
+        unique_kinds = list(map(self._kinds.get, uniques))
+        if None in unique_kinds:
+            for i in [i for i, kind in enumerate(unique_kinds) if kind is None]:
+                unique_kinds[i] = self.classify(uniques[i])
+        unique_kinds = list(map(KIND_CODES.get, unique_kinds))
+        unique_kinds = np.array(unique_kinds + [KIND_CODES[EMPTY_CELL]], dtype=np.int8)
+        kinds = unique_kinds[codes]
+
+        # Position of the cells once the live labels are removed, as parse_row
+        is_live = kinds == KIND_CODES[LIVE_CELL]
+        live_before = np.concatenate([[0], np.cumsum(is_live)])
+        position = np.arange(len(cells)) - offsets[row]
+        position -= live_before[:-1] - live_before[offsets[row]]
+        live = np.bincount(row[is_live], minlength=n_rows) > 0
+
+        # The cell at each locator of each row, -1 if the row is too short
+        width = int(lengths.max())
+        table = np.full(n_rows * width, -1, dtype=np.int64)
+        kept = np.nonzero(~is_live)[0]
+        table[row[kept] * width + position[kept]] = kept
+        table = table.reshape(n_rows, width)
+        located = []
+        fast = np.ones(n_rows, dtype=bool)
+        expected = [TEAM_CELL, TEAM_CELL, ODDS_CELL, ODDS_CELL, ODDS_CELL]
+        for locator, kind in zip(self.col_locators, expected):
+            index = table[:, locator] if locator < width else np.full(n_rows, -1)
+            fast &= (index >= 0) & (kinds[index] == KIND_CODES[kind])
+            located.append(index)
+        home, away, odds_1, odds_x, odds_2 = located
+
+        # The first time and date cells of each row, then one start per pair
+        def first(kind):
+            index = np.full(n_rows, -1, dtype=np.int64)
+            found = np.nonzero(kinds == KIND_CODES[kind])[0]
+            rows_found, first_found = np.unique(row[found], return_index=True)
+            index[rows_found] = found[first_found]
+            return index
+
+        time, date = first(TIME_CELL), first(DATE_CELL)
+        time_code = np.where(time >= 0, codes[time], -1)
+        date_code = np.where((time >= 0) & (date >= 0), codes[date], -1)
+        pairs, inverse = np.unique(
+            (time_code + 1) * (len(uniques) + 1) + date_code + 1, return_inverse=True
+        )
+        starts = np.empty(len(pairs), dtype=object)
+        for i, pair in enumerate(pairs.tolist()):
+            t, d = divmod(pair, len(uniques) + 1)
+            starts[i] = self.start(
+                uniques[d - 1] if d else None, uniques[t - 1] if t else None, now, day
+            )
+        starts = starts[inverse.reshape(-1)]
+
+        # The float of each distinct quote
+        values = np.full(len(uniques) + 1, np.nan)
+        for i in np.nonzero(unique_kinds[:-1] == KIND_CODES[ODDS_CELL])[0]:
+            values[i] = self._odds.get(uniques[i]) or to_float(uniques[i])
+
+        columns = [
+            cells[home],
+            cells[away],
+            values[codes[odds_1]],
+            values[codes[odds_x]],
+            values[codes[odds_2]],
+        ]
+        # The rows out of the layout, read one by one
+        readable = fast.copy()
+        for index in np.nonzero(~fast)[0].tolist():
+            quote = self.parse_row(rows[index], now, day)
+            if isinstance(quote, Quote):
+                readable[index] = True
+                for column, value in zip(
+                    columns,
+                    [quote.home, quote.away, quote.odds_1, quote.odds_x, quote.odds_2],
+                ):
+                    column[index] = value
+                starts[index] = quote.start
+                live[index] = quote.live
+            else:
+                self.quarantine.add(self.site, rows[index], quote)
+        if not readable.all():
+            logger.warning(
+                f"{self.site} - {n_rows - readable.sum()} of {n_rows} rows "
+                "quarantined"
+            )
+        return self._frame(*[i[readable] for i in columns + [starts, live]])
+
+    def to_frame(self, quotes):
+        """
+        Convert Quote records to the columns of standardize_quotes:
+        "<site>_home", "<site>_away", "<site>_1", "<site>_X", "<site>_2" and the
+        "<site>_start" and "<site>_live" of the events.
+        """
+        return self._frame(
+            [i.home for i in quotes],
+            [i.away for i in quotes],
+            [i.odds_1 for i in quotes],
+            [i.odds_x for i in quotes],
+            [i.odds_2 for i in quotes],
+            [i.start for i in quotes],
+            [i.live for i in quotes],
+        )
+
+    def _frame(self, home, away, odds_1, odds_x, odds_2, start, live):
+        site = self.site
+        return pd.DataFrame(
+            {
+                f"{site}_home": home,
+                f"{site}_away": away,
+                f"{site}_1": odds_1,
+                f"{site}_X": odds_x,
+                f"{site}_2": odds_2,
+                f"{site}_start": pd.to_datetime(list(start)),
+                f"{site}_live": live,
+            },
+            columns=[
+                f"{site}_{i}" for i in ["home", "away", "1", "X", "2", "start", "live"]
+            ],
+        )
+
+
+# Parsers of the websites - built once per (site, layout)
+_parsers = {}
+_parsers_lock = threading.Lock()
+
+
+def get_parser(site, col_locators=None, labels=None):
+    """Return the parser of a website, built at its first use"""
+    key = (site, tuple(col_locators or ()), labels)
+    parser = _parsers.get(key)
+    if parser is None:
+        with _parsers_lock:
+            parser = _parsers.setdefault(key, RowParser(site, col_locators, labels))
+    return parser
@@ -0,0 +1,30 @@
+"""
+Registry of the site adapters. Each module of this package declares the adapter
+of one bookmaker with @register, they are all imported here. Adding a bookmaker
+only takes its urls in config.json and, if it needs more than the config, its
+module in this package.
+"""
+
+import importlib
+import pkgutil
+
+from .base import REGISTRY, SiteAdapter, register, step
+
+for _module in pkgutil.iter_modules(__path__):
+    if _module.name != "base":
+        importlib.import_module(f"{__name__}.{_module.name}")
+
+
+def get_adapter(name, config):
+    """Return the adapter of a website, SiteAdapter if it has no module"""
+    return REGISTRY.get(name, SiteAdapter).from_config(name, config)
+
+
+def get_adapters(names, config):
+    """Return a dictionary mapping the websites to their adapter"""
+    return {name: get_adapter(name, config) for name in names}
+
+
+def site_names(config):
+    """Return the websites of all the competitions of config, in order"""
+    return list(dict.fromkeys(i for urls in config["URLS"].values() for i in urls))
@@ -0,0 +1,173 @@
+import logger as log
+
+logger = log.get_logger("sites")
+
+# Maximum wait for the element of a preparation step (in seconds)
+DEFAULT_STEP_WAIT = 2
+# Extra time given to the webdriver on top of the waits of the steps (in seconds)
+SCRIPT_MARGIN = 5
+# How the quotes of a website are read: on its browser tab or from its JSON API
+FETCHERS = ("browser", "kambi")
+
+# Run the preparation steps arguments[0] of a tab in the browser, one after another.
+# A step waits up to its "wait" ms for its selector then clicks the first match
+# ("click") or all of them ("click_all"). "unless_text" skips the click when the
+# first match already shows this text, "if_clicked" skips the step when the
+# previous one clicked nothing. Calls back with the number of clicks of each step,
+# -1 for a step whose selector never showed up.
+PREPARE_SCRIPT = """
+var steps = arguments[0], done = arguments[arguments.length - 1];
+var report = [], index = 0, stepStart = performance.now();
+
+function run(step) {
+    var els = document.querySelectorAll(step.selector);
+    if (els.length === 0) { return null; }
+    if (step.unless_text && els[0].textContent.trim() === step.unless_text) {
+        return 0;
+    }
+    if (step.action === "click_all") {
+        for (var i = 0; i < els.length; i++) { els[i].click(); }
+        return els.length;
+    }
+    els[0].click();
+    return 1;
+}
+
+function next() {
+    while (index < steps.length) {
+        var step = steps[index], clicks;
+        if (step.if_clicked && index > 0 && !(report[index - 1] > 0)) {
+            clicks = 0;
+        } else {
+            clicks = run(step);
+        }
+        if (clicks === null) {
+            if (performance.now() - stepStart < step.wait) {
+                setTimeout(next, 100);
+                return;
+            }
+            clicks = -1;
+        }
+        report.push(clicks);
+        index++;
+        stepStart = performance.now();
+    }
+    done(report);
+}
+
+next();
+"""
+
+# Name of every registered website -> its SiteAdapter class
+REGISTRY = {}
+
+
+def register(cls):
+    """Class decorator adding a SiteAdapter to the registry under its name"""
+    REGISTRY[cls.name] = cls
+    return cls
+
+
+def step(action, selector, wait=DEFAULT_STEP_WAIT, unless_text=None, if_clicked=False):
+    """
+    Build a preparation step of PREPARE_SCRIPT.
+
+    Args:
+        action (str): "click" the first element matching selector or "click_all".
+        selector (str): The CSS selector of the elements.
+        wait (float): Maximum wait for the elements (in seconds).
+        unless_text (str, optional): Do not click if the first element shows it.
+        if_clicked (bool): Only run the step if the previous one clicked.
+    """
+    return {
+        "action": action,
+        "selector": selector,
+        "wait": int(wait * 1000),
+        "unless_text": unless_text,
+        "if_clicked": if_clicked,
+    }
+
+
+class SiteAdapter:
+    """
+    Everything specific to one website: how its tab is prepared once loaded, the
+    CSS selector of its rows - the readiness condition and the extractor of the
+    browser tabs -, where its quotes come from and the positions read by its
+    parser. The class attributes are the defaults of the website, the
+    CSS_SELECTORS, COOKIES_REF, FETCHERS and COL_LOCATORS sections of config.json
+    override them. A website without module gets this class with the config only.
+
+    Args:
+        name (str): Name of the website as in config["URLS"].
+        css_selector (str): The CSS selector of the rows of quotes.
+        cookies (str, optional): The id of the button accepting the cookies.
+        fetcher (str): "browser" to read the tab, "kambi" to fetch the JSON API.
+        col_locators (list, optional): Positions of home, away and the 3 quotes.
+    """
+
+    name = None
+    css_selector = None
+    cookies = None
+    fetcher = "browser"
+    col_locators = None
+
+    def __init__(
+        self, name, css_selector=None, cookies=None, fetcher=None, col_locators=None
+    ):
+        self.name = name
+        if css_selector is not None:
+            self.css_selector = css_selector
+        if cookies is not None:
+            self.cookies = cookies
+        if fetcher is not None:
+            if fetcher not in FETCHERS:
+                raise ValueError(
+                    f"Unknown fetcher {fetcher}, expected one of {FETCHERS}"
+                )
+            self.fetcher = fetcher
+        if col_locators is not None:
+            self.col_locators = col_locators
+
+    @classmethod
+    def from_config(cls, name, config):
+        """Instantiate the adapter of a website with its entries of config.json"""
+        return cls(
+            name,
+            css_selector=config.get("CSS_SELECTORS", {}).get(name),
+            cookies=config.get("COOKIES_REF", {}).get(name),
+            fetcher=config.get("FETCHERS", {}).get(name),
+            col_locators=config.get("COL_LOCATORS", {}).get(name),
+        )
+
+    def steps(self):
+        """
+        Return the preparation steps of the tab, run once its page is loaded.
+        Override it to add the steps of a website after the cookies.
+        """
+        if self.cookies is None:
+            return []
+        return [step("click", f'[id="{self.cookies}"]')]
+
+    def prepare(self, driver):
+        """
+        Run the preparation steps on the active tab in a single script call.
+
+        Returns:
+            list: The number of clicks of each step, -1 if its element was missing.
+        """
+        steps = self.steps()
+        if not steps:
+            return []
+        from selenium.common.exceptions import WebDriverException
+
+        logger.info(f"prepare {self.name} - {len(steps)} steps")
+        driver.set_script_timeout(sum(i["wait"] for i in steps) / 1000 + SCRIPT_MARGIN)
+        try:
+            report = driver.execute_async_script(PREPARE_SCRIPT, steps)
+        except WebDriverException as err:
+            logger.warning(f"unable to prepare {self.name} - {err.msg}")
+            return []
+        missing = [i["selector"] for i, j in zip(steps, report) if j < 0]
+        if missing:
+            logger.warning(f"{self.name} - elements not found: {', '.join(missing)}")
+        return report
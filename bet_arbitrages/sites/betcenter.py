@@ -0,0 +1,9 @@
+from .base import SiteAdapter, register
+
+
+@register
+class BetcenterAdapter(SiteAdapter):
+    name = "betcenter"
+    css_selector = ".game--upcoming, .game--live"
+    cookies = "cookiescript_accept"
+    col_locators = [0, 1, 5, 7, 9]
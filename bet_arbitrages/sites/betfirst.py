@@ -0,0 +1,8 @@
+from .base import SiteAdapter, register
+
+
+@register
+class BetfirstAdapter(SiteAdapter):
+    name = "betfirst"
+    css_selector = ".rj-ev-list__ev-card"
+    col_locators = [0, 1, 5, 7, 9]
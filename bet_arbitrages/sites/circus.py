@@ -0,0 +1,9 @@
+from .base import SiteAdapter, register
+
+
+@register
+class CircusAdapter(SiteAdapter):
+    name = "circus"
+    css_selector = ".bet-event-main-row"
+    cookies = "didomi-notice-agree-button"
+    col_locators = [2, 3, 5, 6, 7]
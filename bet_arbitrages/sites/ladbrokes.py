@@ -0,0 +1,8 @@
+from .base import SiteAdapter, register
+
+
+@register
+class LadbrokesAdapter(SiteAdapter):
+    name = "ladbrokes"
+    css_selector = ".event-row"
+    col_locators = [2, 3, 4, 5, 6]
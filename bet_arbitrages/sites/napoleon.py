@@ -0,0 +1,11 @@
+from .base import SiteAdapter, register
+
+
+@register
+class NapoleonAdapter(SiteAdapter):
+    """Kambi sportsbook, its quotes can also be fetched from the Kambi API"""
+
+    name = "napoleon"
+    css_selector = ".KambiBC-sandwich-filter__event-list-item"
+    cookies = "onetrust-accept-btn-handler"
+    col_locators = [2, 3, 4, 5, 6]
@@ -0,0 +1,10 @@
+from .base import SiteAdapter, register
+
+
+@register
+class ScooreAdapter(SiteAdapter):
+    """Kambi sportsbook, its quotes can also be fetched from the Kambi API"""
+
+    name = "scoore"
+    css_selector = ".KambiBC-sandwich-filter__event-list-item"
+    col_locators = [2, 3, 4, 5, 6]
@@ -0,0 +1,39 @@
+from .base import SiteAdapter, register, step
+
+# Titles of the collapsible panels of the events
+PANEL_TITLES = [
+    "._asb_events-tree-table-node-CH--expansion-panel-title",
+    "._asb_events-tree-table-node-DT--expansion-panel-title",
+    "._asb_events-tree-table-node-SP--expansion-panel-title",
+    "._asb_results-table--expansion-panel-title",
+    "._asb_toto-jackpots-tree--expansion-panel-header",
+]
+
+
+@register
+class StarcasinoAdapter(SiteAdapter):
+    """
+    The french page lists the team names of the keys, and the events of a date
+    are only rendered once its panel is expanded.
+    """
+
+    name = "starcasino"
+    css_selector = "._asb_events-table-row"
+    col_locators = [3, 4, 5, 6, 7]
+    language = "FR"
+
+    def steps(self):
+        return super().steps() + [
+            # Open the language menu unless the page is already in french
+            step(
+                "click",
+                ".css-pe3ddf.css-pe3ddf.css-pe3ddf",
+                unless_text=self.language,
+            ),
+            step("click", f'li[data-value="{self.language}"]', if_clicked=True),
+            # Expand all the dates at once
+            step(
+                "click_all",
+                ", ".join(f"{i} .asb-icon-arrow-down" for i in PANEL_TITLES),
+            ),
+        ]
@@ -0,0 +1,384 @@
+import abc
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+
+import logger as log
+from arbitrage import DEFAULT_MARKETS, MAIN_MARKET
+
+logger = log.get_logger("storage")
+
+# Long layout of the stored quotes - one row per (event, bookmaker, outcome)
+COLUMNS = [
+    "timestamp",
+    "competition",
+    "event",
+    "home",
+    "away",
+    "bookmaker",
+    "outcome",
+    "price",
+    "kind",
+]
+# Only the outcomes of the main market are stored
+OUTCOMES = DEFAULT_MARKETS[MAIN_MARKET]
+# Kind of the rows - full snapshots, or checkpoints and changes of a change-log
+KINDS = ["snapshot", "checkpoint", "insert", "update", "delete"]
+# Format of the day partitions
+DATE_FORMAT_DAY = "%Y-%m-%d"
+DATE_FORMAT_TIMESTAMP = "%Y-%m-%d %H:%M:%S.%f"
+DEFAULT_BATCH_SIZE = 50000
+# Maximum time the quotes stay buffered before a write (in seconds). The readers
+# only see the written quotes and a crash loses the buffered ones, a parquet store
+# waits longer since each write is a new file.
+DEFAULT_FLUSH_INTERVAL = 30
+DEFAULT_PARQUET_FLUSH_INTERVAL = 300
+
+
+def melt_quotes(df_quotes, timestamp):
+    """
+    Convert the wide quotes of concatenate_quotes ("<name>_1", "<name>_X", "<name>_2"
+    columns) to the long layout of the storage. Missing quotes are not kept.
+
+    Args:
+        df_quotes (DataFrame): The quotes with a "competition" column.
+        timestamp (datetime): Date of the extraction.
+
+    Returns:
+        DataFrame: The quotes with the COLUMNS of the storage.
+    """
+    odds_cols = [
+        i for i in df_quotes.columns if "_" in i and i.rsplit("_", 1)[1] in OUTCOMES
+    ]
+    df_long = df_quotes.melt(
+        id_vars=["competition", "home_id", "away_id", "home", "away"],
+        value_vars=odds_cols,
+        var_name="column",
+        value_name="price",
+    )
+    df_long = df_long[df_long["price"].notna()]
+    bookmaker_outcome = df_long["column"].str.rsplit("_", n=1, expand=True)
+    df_long = df_long.assign(
+        timestamp=pd.Timestamp(timestamp),
+        event=df_long["home_id"].astype(int).astype(str)
+        + "-"
+        + df_long["away_id"].astype(int).astype(str),
+        bookmaker=bookmaker_outcome[0],
+        outcome=bookmaker_outcome[1],
+        price=df_long["price"].astype(float),
+        kind="snapshot",
+    )
+    return df_long[COLUMNS].reset_index(drop=True)
+
+
+class OddsStore(abc.ABC):
+    """
+    Append-only storage of the quotes in the long layout. The rows are buffered and
+    written by batches of batch_size rows, by a timer flush_interval seconds after
+    the oldest buffered rows, or when flush() or close() is called. A crash loses
+    the buffered rows, at most flush_interval seconds of quotes.
+
+    Args:
+        path (str): Location of the storage.
+        batch_size (int): Number of buffered rows triggering a write.
+        flush_interval (float): Maximum age of the buffered rows (in seconds).
+    """
+
+    def __init__(
+        self, path, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL
+    ):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._buffered_rows = 0
+        # Writes the buffered rows flush_interval seconds after the oldest ones,
+        # even if no other rows come
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def append(self, df_long):
+        """Buffer quotes in the long layout, write them if the batch is full"""
+        if df_long.shape[0] == 0:
+            return
+        with self._lock:
+            if not self._buffer:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            self._buffer.append(df_long[COLUMNS])
+            self._buffered_rows += df_long.shape[0]
+            due = self._buffered_rows >= self.batch_size
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write all the buffered quotes"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._buffer:
+                return
+            df = pd.concat(self._buffer, axis=0, ignore_index=True)
+            self._buffer = []
+            self._buffered_rows = 0
+            start = time.perf_counter()
+            self._write(df)
+        logger.info(
+            f"{df.shape[0]} quotes written in {time.perf_counter() - start:.2f}s"
+        )
+
+    def read(self, start=None, end=None, competitions=None, kinds=None):
+        """
+        Read the stored quotes.
+
+        Args:
+            start (datetime, optional): Only the quotes extracted from this date.
+            end (datetime, optional): Only the quotes extracted until this date (included).
+            competitions (list, optional): Only the quotes of these competitions.
+            kinds (list, optional): Only the rows of these KINDS.
+
+        Returns:
+            DataFrame: The quotes with the COLUMNS of the storage, sorted by timestamp.
+        """
+        df = self._read(
+            pd.Timestamp(start) if start is not None else None,
+            pd.Timestamp(end) if end is not None else None,
+            list(competitions) if competitions is not None else None,
+        )
+        if kinds is not None:
+            df = df[df["kind"].isin(kinds)]
+        return df.sort_values("timestamp", kind="mergesort").reset_index(drop=True)
+
+    def days(self, start=None, end=None, competitions=None):
+        """
+        List the (competition, day) partitions holding quotes, to read a long
+        history one day at a time.
+
+        Returns:
+            DataFrame: The columns "competition" and "day" (Timestamp), sorted.
+        """
+        self.flush()
+        df = self._days()
+        df["day"] = pd.to_datetime(df["day"], format=DATE_FORMAT_DAY)
+        if start is not None:
+            df = df[df["day"] >= pd.Timestamp(start).normalize()]
+        if end is not None:
+            df = df[df["day"] <= pd.Timestamp(end)]
+        if competitions is not None:
+            df = df[df["competition"].isin(competitions)]
+        return df.sort_values(["competition", "day"]).reset_index(drop=True)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @abc.abstractmethod
+    def _write(self, df):
+        """Write the quotes of a batch"""
+
+    @abc.abstractmethod
+    def _read(self, start, end, competitions):
+        """Read the quotes of a time range and some competitions"""
+
+    @abc.abstractmethod
+    def _days(self):
+        """Return the (competition, day) partitions holding quotes"""
+
+
+class ParquetStore(OddsStore):
+    """
+    Quotes stored as parquet files partitioned by day and competition:
+    <path>/day=<YYYY-MM-DD>/competition=<competition>/part-<date>.parquet
+    Each flush adds new files, the existing ones are never rewritten: batch_size
+    and flush_interval set the number of files.
+    """
+
+    def __init__(
+        self,
+        path,
+        batch_size=DEFAULT_BATCH_SIZE,
+        flush_interval=DEFAULT_PARQUET_FLUSH_INTERVAL,
+    ):
+        # pyarrow is only needed by this backend
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("pyarrow is required to store the quotes as parquet")
+        super().__init__(path, batch_size, flush_interval)
+
+    def _write(self, df):
+        part = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        days = df["timestamp"].dt.strftime(DATE_FORMAT_DAY)
+        for (day, competition), df_part in df.groupby([days, "competition"]):
+            directory = self.path / f"day={day}" / f"competition={competition}"
+            directory.mkdir(parents=True, exist_ok=True)
+            df_part.to_parquet(directory / f"part-{part}.parquet", index=False)
+
+    def _read(self, start, end, competitions):
+        files = []
+        for dir_day in sorted(self.path.glob("day=*")):
+            day = pd.Timestamp(dir_day.name.split("=", 1)[1])
+            # Skip the partitions out of the time range without opening them
+            if start is not None and day < start.normalize():
+                continue
+            if end is not None and day > end:
+                continue
+            for dir_competition in sorted(dir_day.glob("competition=*")):
+                competition = dir_competition.name.split("=", 1)[1]
+                if competitions is not None and competition not in competitions:
+                    continue
+                files += sorted(dir_competition.glob("*.parquet"))
+
+        list_df = [pd.read_parquet(i) for i in files]
+        if not list_df:
+            return pd.DataFrame(columns=COLUMNS)
+        df = pd.concat(list_df, axis=0, ignore_index=True)
+        # Files written before the change-log do not have a kind
+        if "kind" in df.columns:
+            df["kind"] = df["kind"].fillna("snapshot")
+        else:
+            df["kind"] = "snapshot"
+        df = df[COLUMNS]
+        if start is not None:
+            df = df[df["timestamp"] >= start]
+        if end is not None:
+            df = df[df["timestamp"] <= end]
+        return df
+
+    def _days(self):
+        rows = [
+            [dir_competition.name.split("=", 1)[1], dir_day.name.split("=", 1)[1]]
+            for dir_day in self.path.glob("day=*")
+            for dir_competition in dir_day.glob("competition=*")
+        ]
+        return pd.DataFrame(rows, columns=["competition", "day"])
+
+
+class SQLiteStore(OddsStore):
+    """
+    Quotes stored in one table of a SQLite database, indexed by competition, day
+    and timestamp so a time range or a competition is read without a full scan.
+    """
+
+    def __init__(
+        self, path, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL
+    ):
+        super().__init__(path, batch_size, flush_interval)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS odds (
+                timestamp TEXT NOT NULL,
+                day TEXT NOT NULL,
+                competition TEXT NOT NULL,
+                event TEXT NOT NULL,
+                home TEXT,
+                away TEXT,
+                bookmaker TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                price REAL,
+                kind TEXT NOT NULL DEFAULT 'snapshot'
+            );
+            CREATE INDEX IF NOT EXISTS odds_competition_day
+                ON odds (competition, day, timestamp);
+            CREATE INDEX IF NOT EXISTS odds_timestamp ON odds (timestamp);
+            """
+        )
+        # Databases created before the change-log do not have a kind
+        columns = [i[1] for i in self.connection.execute("PRAGMA table_info(odds)")]
+        if "kind" not in columns:
+            with self.connection:
+                self.connection.execute(
+                    "ALTER TABLE odds ADD COLUMN kind TEXT NOT NULL DEFAULT 'snapshot'"
+                )
+
+    def _write(self, df):
+        df = df.assign(
+            timestamp=df["timestamp"].dt.strftime(DATE_FORMAT_TIMESTAMP),
+            day=df["timestamp"].dt.strftime(DATE_FORMAT_DAY),
+        )
+        columns = ["timestamp", "day"] + COLUMNS[1:]
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT INTO odds ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                df[columns].itertuples(index=False, name=None),
+            )
+
+    def _read(self, start, end, competitions):
+        where, params = [], []
+        if start is not None:
+            where.append("timestamp >= ?")
+            params.append(start.strftime(DATE_FORMAT_TIMESTAMP))
+        if end is not None:
+            where.append("timestamp <= ?")
+            params.append(end.strftime(DATE_FORMAT_TIMESTAMP))
+        if competitions is not None:
+            where.append(f"competition IN ({', '.join('?' * len(competitions))})")
+            params += competitions
+        query = f"SELECT {', '.join(COLUMNS)} FROM odds"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        with self._lock:
+            df = pd.read_sql_query(query, self.connection, params=params)
+        df["timestamp"] = pd.to_datetime(df["timestamp"], format=DATE_FORMAT_TIMESTAMP)
+        return df
+
+    def _days(self):
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT DISTINCT competition, day FROM odds", self.connection
+            )
+
+    def close(self):
+        super().close()
+        self.connection.close()
+
+
+STORES = {"parquet": ParquetStore, "sqlite": SQLiteStore}
+
+
+def get_store(config):
+    """
+    Instantiate the storage set in the STORAGE section of config.json:
+    {"format": "parquet" or "sqlite", "path": ..., "batch_size": ...,
+    "flush_interval": ..., "mode": "snapshot" or "changelog",
+    "checkpoint_every": ...}
+    In changelog mode the store is wrapped in an OddsChangeLog which only writes
+    the quotes which have changed since the previous sweep.
+    """
+    config_storage = config.get("STORAGE", {})
+    storage_format = config_storage.get("format", "sqlite")
+    if storage_format not in STORES:
+        raise ValueError(f"Unknown storage format {storage_format}")
+    path = config_storage.get(
+        "path", "data/odds" if storage_format == "parquet" else "data/odds.sqlite"
+    )
+    logger.info(f"store the quotes as {storage_format} in {path}")
+    flush_interval = DEFAULT_FLUSH_INTERVAL
+    if storage_format == "parquet":
+        flush_interval = DEFAULT_PARQUET_FLUSH_INTERVAL
+    store = STORES[storage_format](
+        path,
+        config_storage.get("batch_size", DEFAULT_BATCH_SIZE),
+        config_storage.get("flush_interval", flush_interval),
+    )
+    if config_storage.get("mode", "snapshot") == "changelog":
+        from changelog import OddsChangeLog, DEFAULT_CHECKPOINT_EVERY
+
+        store = OddsChangeLog(
+            store,
+            config_storage.get("checkpoint_every", DEFAULT_CHECKPOINT_EVERY),
+        )
+    return store
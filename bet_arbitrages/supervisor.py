@@ -0,0 +1,293 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import pandas as pd
+
+import logger as log
+import metrics
+
+logger = log.get_logger("supervisor")
+
+# Switch added to every chrome launched by the project with the pid of the python
+# process owning it, chrome ignores it but it shows in its command line
+MARKER_FLAG = "--bet-arbitrages-owner"
+DEFAULT_MAX_RSS_MB = 1500
+# Maximum age of a session before it is recycled (in seconds)
+DEFAULT_MAX_AGE = 6 * 3600
+# Time between two checks of the sessions (in seconds)
+DEFAULT_INTERVAL = 30
+# Number of memory samples kept per session
+DEFAULT_HISTORY = 2880
+CHROMEDRIVER_NAMES = ("chromedriver", "chromedriver.exe")
+
+
+def _psutil():
+    # psutil is only needed by the supervision
+    try:
+        import psutil
+    except ImportError:
+        raise ImportError("psutil is required to supervise the browsers")
+    return psutil
+
+
+def pid_alive(pid):
+    """
+    Return True if a process is running. Without psutil a process is assumed
+    alive on Windows, where os.kill would terminate it.
+    """
+    try:
+        return _psutil().pid_exists(pid)
+    except ImportError:
+        pass
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def marker_flag(pid=None):
+    """Return the switch marking the chrome processes of a python process"""
+    return f"{MARKER_FLAG}={os.getpid() if pid is None else pid}"
+
+
+def process_tree(pid):
+    """
+    Return the process and all its descendants, e.g. chromedriver and the chrome
+    processes it launched. Empty if the process does not exist anymore.
+    """
+    psutil = _psutil()
+    try:
+        process = psutil.Process(pid)
+        return [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+def tree_rss(processes):
+    """Sum the resident memory of some processes (in bytes)"""
+    psutil = _psutil()
+    rss = 0
+    for process in processes:
+        try:
+            rss += process.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return rss
+
+
+def kill_processes(processes, timeout=5):
+    """Terminate some processes, kill the ones still alive after timeout seconds"""
+    psutil = _psutil()
+    for process in processes:
+        try:
+            process.terminate()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    _, alive = psutil.wait_procs(processes, timeout=timeout)
+    for process in alive:
+        try:
+            process.kill()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return len(processes)
+
+
+def registered_owners(path_driver_location="driver_location.json"):
+    """
+    Return the pids of the processes which launched the sessions registered in
+    driver_location.json: their browsers are left open on purpose.
+    """
+    if path_driver_location is None:
+        return set()
+    try:
+        with open(path_driver_location) as f:
+            dict_location = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return set()
+    return {i["owner"] for i in dict_location.values() if "owner" in i}
+
+
+def find_orphans(keep=()):
+    """
+    Find the processes left by crashed runs: the chrome processes whose owner in
+    MARKER_FLAG is not running anymore, with the chromedriver which launched them.
+    Only the processes carrying MARKER_FLAG are considered.
+
+    Args:
+        keep (iterable): The owners whose browsers are kept, e.g. the ones of the
+            sessions registered in driver_location.json (see registered_owners).
+    """
+    psutil = _psutil()
+    keep = set(keep)
+    orphans = []
+    for process in psutil.process_iter(["pid", "ppid", "name", "cmdline"]):
+        try:
+            cmdline = process.info["cmdline"] or []
+            owners = [i.split("=", 1)[1] for i in cmdline if i.startswith(MARKER_FLAG)]
+            if not owners:
+                continue
+            owner = int(owners[0])
+            if owner == os.getpid() or owner in keep or psutil.pid_exists(owner):
+                continue
+            # The renderers of chrome do not have the switch
+            orphans += [process] + process.children(recursive=True)
+            parent = process.parent()
+            if parent is not None and parent.name() in CHROMEDRIVER_NAMES:
+                orphans.append(parent)
+        except (psutil.NoSuchProcess, psutil.AccessDenied, ValueError):
+            continue
+    # A process can be listed twice, as a child and by itself
+    return list({i.pid: i for i in orphans}.values())
+
+
+def reap_orphans(timeout=5, path_driver_location="driver_location.json"):
+    """
+    Kill the orphaned chrome and chromedriver processes, except the sessions
+    registered in driver_location.json, and return their number.
+    """
+    orphans = find_orphans(registered_owners(path_driver_location))
+    if orphans:
+        logger.warning(f"{len(orphans)} orphaned browser processes reaped")
+        kill_processes(orphans, timeout)
+    return len(orphans)
+
+
+class BrowserSupervisor:
+    """
+    Watch the process tree of every session of a DriverPool from a background
+    thread. The resident memory of each session is sampled every interval seconds
+    and a session above max_rss_mb or older than max_age is retired: the pool
+    recycles it - tabs and cookies included - the next time it is handed out, so
+    a driver is never closed while a worker reads it.
+
+    Args:
+        pool (DriverPool): The pool of the sessions.
+        max_rss_mb (float): Maximum resident memory of a session (in MB).
+        max_age (float): Maximum age of a session (in seconds).
+        interval (float): Time between two checks (in seconds).
+        history (int): Number of memory samples kept per session.
+    """
+
+    def __init__(
+        self,
+        pool,
+        max_rss_mb=DEFAULT_MAX_RSS_MB,
+        max_age=DEFAULT_MAX_AGE,
+        interval=DEFAULT_INTERVAL,
+        history=DEFAULT_HISTORY,
+    ):
+        _psutil()
+        self.pool = pool
+        self.max_rss_mb = max_rss_mb
+        self.max_age = max_age
+        self.interval = interval
+        # competition -> (time, rss in MB, processes) samples
+        self.samples = {}
+        self.history = history
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, pool, config):
+        """Instantiate the supervisor with the SUPERVISOR section of config.json"""
+        config_supervisor = config.get("SUPERVISOR", {})
+        return cls(
+            pool,
+            max_rss_mb=config_supervisor.get("max_rss_mb", DEFAULT_MAX_RSS_MB),
+            max_age=config_supervisor.get("max_age", DEFAULT_MAX_AGE),
+            interval=config_supervisor.get("interval", DEFAULT_INTERVAL),
+            history=config_supervisor.get("history", DEFAULT_HISTORY),
+        )
+
+    def check(self):
+        """Sample the memory of every session and retire the ones over the limits"""
+        now = time.time()
+        for competition, session in list(self.pool.sessions.items()):
+            if session.pid is None or session.retire is not None:
+                continue
+            processes = process_tree(session.pid)
+            rss_mb = tree_rss(processes) / 2**20
+            self.samples.setdefault(competition, deque(maxlen=self.history)).append(
+                (now, rss_mb, len(processes))
+            )
+            metrics.set_gauge(
+                "browser_rss_bytes", rss_mb * 2**20, competition=competition
+            )
+            if not processes:
+                session.retire = "process exited"
+            elif rss_mb > self.max_rss_mb:
+                session.retire = f"{rss_mb:.0f} MB over {self.max_rss_mb} MB"
+            elif session.age > self.max_age:
+                session.retire = f"{session.age:.0f}s old"
+            if session.retire is not None:
+                logger.warning(f"{competition} - session retired - {session.retire}")
+                metrics.inc("sessions_retired_total", competition=competition)
+
+    def run(self):
+        reap_orphans(path_driver_location=self.pool.path_driver_location)
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            # The supervision must not die with one failing check
+            except Exception:
+                logger.exception("supervisor check failed")
+
+    def start(self):
+        """Reap the orphans of crashed runs then check the sessions in background"""
+        self._thread = threading.Thread(target=self.run, name="supervisor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def memory(self):
+        """
+        Return the memory samples of every session: time, competition, rss in MB
+        and number of processes.
+        """
+        rows = [
+            [datetime.fromtimestamp(t), competition, rss_mb, n]
+            for competition, samples in self.samples.items()
+            for t, rss_mb, n in list(samples)
+        ]
+        return pd.DataFrame(
+            rows, columns=["time", "competition", "rss_mb", "processes"]
+        )
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Supervise the browser processes")
+    parser.add_argument(
+        "--reap", action="store_true", help="kill the orphaned browser processes"
+    )
+    parser.add_argument(
+        "--driver-location",
+        default="driver_location.json",
+        help="the browsers of the sessions registered in this file are kept",
+    )
+    args = parser.parse_args()
+    for process in find_orphans(registered_owners(args.driver_location)):
+        print(f"orphan {process.pid} {process.name()}")
+    if args.reap:
+        print(
+            f"{reap_orphans(path_driver_location=args.driver_location)} processes reaped"
+        )
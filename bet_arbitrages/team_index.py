@@ -0,0 +1,199 @@
+import re
+import threading
+import unicodedata
+from difflib import get_close_matches
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+import logger as log
+
+logger = log.get_logger("team index")
+
+# Words which do not help to tell two teams apart
+STOP_WORDS = set("fc sc ac as cf afc sv vfb vfl rc kv krc".split())
+# Minimum similarity of the team suggested for a name which is not resolved
+DEFAULT_CUTOFF = 0.6
+
+
+def normalize_name(name):
+    """
+    Normalize a team name to compare the spellings of the websites:
+    lower case, no accents, no punctuation and no stop words.
+    "Olympique de Marseille" -> "olympique de marseille", "R.C. Lens" -> "lens"
+    """
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c)).lower()
+    # Acronyms written with dots - "R.C." -> "rc"
+    name = re.sub(r"\b(\w)\.(?=\w\b)", r"\1", name)
+    words = re.findall(r"[a-z0-9]+", name)
+    return " ".join(w for w in words if w not in STOP_WORDS)
+
+
+class TeamIndex:
+    """
+    Map the team names of every website to one canonical team id, built once from
+    the teams_correspondancy.csv file where each row is a team and each column the
+    name of the team on one website. The id of a team is its row in the file.
+
+    Names which are not in the file are looked up by their normalized spelling. A
+    close spelling is never taken for the team - "Real Madrid B" is not "Real
+    Madrid" - the names which can not be resolved are recorded with the closest
+    team to be added to the file later (see write_unresolved). The result is
+    cached so each new spelling is only resolved once.
+
+    Args:
+        df_keys (DataFrame): The team names correspondancy between websites.
+        sites (list, optional): The columns of df_keys holding names, all the named
+            columns if None.
+        cutoff (float, optional): Minimum similarity of the team suggested for a
+            name which is not resolved, between 0 and 1.
+    """
+
+    def __init__(self, df_keys, sites=None, cutoff=DEFAULT_CUTOFF):
+        if sites is None:
+            sites = [i for i in df_keys.columns if not str(i).startswith("Unnamed")]
+        self.sites = [i for i in sites if i in df_keys.columns]
+        self.cutoff = cutoff
+        # Canonical name of each team id - the first name found on the row
+        self.names = []
+        # (website, name) -> team id
+        self.exact = {}
+        # normalized name -> team ids
+        normalized = {}
+        for team_id, row in enumerate(df_keys[self.sites].itertuples(index=False)):
+            names = [
+                (site, i) for site, i in zip(self.sites, row) if isinstance(i, str)
+            ]
+            self.names.append(names[0][1] if names else None)
+            for site, name in names:
+                self.exact[(site, name)] = team_id
+                normalized.setdefault(normalize_name(name), set()).add(team_id)
+        self.names = np.array(self.names, dtype=object)
+        # normalized name -> team id, a spelling shared by several teams resolves
+        # none of them
+        self.normalized = {}
+        for name, team_ids in normalized.items():
+            if len(team_ids) > 1:
+                teams = ", ".join(f"'{self.names[i]}'" for i in sorted(team_ids))
+                logger.warning(
+                    f"'{name}' is the normalized name of several teams ({teams}), "
+                    "only their exact names are resolved"
+                )
+            else:
+                self.normalized[name] = team_ids.pop()
+        self._normalized_keys = list(self.normalized)
+        # website -> (Index of its names, their team ids), to look up a whole
+        # column of names at once in resolve_many
+        by_site = {}
+        for (site, name), team_id in self.exact.items():
+            by_site.setdefault(site, ([], []))
+            by_site[site][0].append(name)
+            by_site[site][1].append(team_id)
+        self._site_names = {
+            site: (pd.Index(names), np.array(ids, dtype=float))
+            for site, (names, ids) in by_site.items()
+        }
+        # Spellings resolved by their normalized name, None if not resolved
+        self._cache = {}
+        # name -> closest canonical name, None if none is close enough
+        self._suggestions = {}
+        # (website, name) -> number of lookups which failed
+        self.unresolved = {}
+        self._lock = threading.Lock()
+        logger.info(f"team index built with {len(self.names)} teams")
+
+    def __len__(self):
+        return len(self.names)
+
+    def resolve(self, site, name):
+        """
+        Return the team id of the name used by a website, None if unknown.
+        """
+        key = (site, name)
+        team_id = self.exact.get(key)
+        if team_id is not None:
+            return team_id
+        try:
+            team_id = self._cache[key]
+        except KeyError:
+            team_id = self._resolve_fallback(name)
+            self._cache[key] = team_id
+            if team_id is not None:
+                logger.info(f"{site} - '{name}' resolved as '{self.names[team_id]}'")
+            elif isinstance(name, str):
+                logger.info(
+                    f"{site} - '{name}' not resolved, closest team "
+                    f"'{self.suggest(name)}'"
+                )
+        if team_id is None:
+            with self._lock:
+                self.unresolved[key] = self.unresolved.get(key, 0) + 1
+        return team_id
+
+    def _resolve_fallback(self, name):
+        """Resolve an unknown spelling by its normalized name, None if unknown"""
+        if not isinstance(name, str):
+            return None
+        return self.normalized.get(normalize_name(name))
+
+    def resolve_many(self, site, names):
+        """
+        Resolve a column of names of one website. Each distinct name is resolved once.
+
+        Args:
+            site (str): The website using these names.
+            names (Series): The team names.
+
+        Returns:
+            Series: The team ids as float, NaN if the name is unknown.
+        """
+        team_ids = np.full(len(names), np.nan)
+        missing = np.ones(len(names), dtype=bool)
+        if site in self._site_names:
+            index, ids = self._site_names[site]
+            positions = index.get_indexer(names)
+            missing = positions < 0
+            team_ids[~missing] = ids[positions[~missing]]
+        # Only the names which are not in the file go through resolve
+        if missing.any():
+            unknown = names[missing]
+            mapping = {name: self.resolve(site, name) for name in unknown.unique()}
+            team_ids[missing] = unknown.map(mapping).astype(float).to_numpy()
+        return pd.Series(team_ids, index=names.index, name=names.name)
+
+    def suggest(self, name):
+        """
+        Return the canonical name closest to name, to help filling the key file.
+        It is only a suggestion, the name is not resolved as this team.
+        """
+        if name not in self._suggestions:
+            matches = get_close_matches(
+                normalize_name(name), self._normalized_keys, n=1, cutoff=self.cutoff
+            )
+            self._suggestions[name] = (
+                self.names[self.normalized[matches[0]]] if matches else None
+            )
+        return self._suggestions[name]
+
+    def write_unresolved(self, path):
+        """
+        Write the names which could not be resolved in a csv with the closest
+        known team. The lookups of a previous file are added up.
+        """
+        if not self.unresolved:
+            return
+        # The lookups written are removed so they are not counted twice
+        with self._lock:
+            unresolved, self.unresolved = self.unresolved, {}
+        df = pd.DataFrame(
+            [[site, name, count] for (site, name), count in unresolved.items()],
+            columns=["website", "name", "count"],
+        )
+        path = Path(path)
+        if path.exists():
+            df = pd.concat([pd.read_csv(path)[["website", "name", "count"]], df])
+            df = df.groupby(["website", "name"], as_index=False)["count"].sum()
+        df["suggestion"] = [self.suggest(i) for i in df["name"]]
+        df.sort_values("count", ascending=False).to_csv(path, index=False)
+        logger.warning(f"{len(df)} team names not resolved - see {path}")